@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <a000680@c20671.ad.smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""An asyncio runner: dataset messages are taken from one or more
+transports, the files checked without blocking the event loop, the scenes
+scheduled on the processing pipeline, and each product is announced as soon
+as it is written. Python 3.7 or later; the threaded runner is still there for
+Python 2.
+
+A transport has an async iterator messages() and/or a coroutine
+publish(msg). BusTransport adapts posttroll Subscribe/Publish, or the
+mpef_oca.bus.LocalBus stand-in for tests.
+"""
+
+import asyncio
+import logging
+import threading
+import traceback
+from functools import partial
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+
+LOG = logging.getLogger(__name__)
+
+_CLOSED = object()
+
+
+class BusTransport(object):
+
+    """Async adapter of a posttroll style *subscriber* (with recv(timeout)
+    yielding messages, or None on timeout) and *publisher* (with send). Both
+    may be context managers, as posttroll's Subscribe and Publish are. The
+    subscriber is read in a thread of its own, and the publisher used from
+    one thread only"""
+
+    def __init__(self, subscriber=None, publisher=None, timeout=1.0):
+        self.subscriber = subscriber
+        self.publisher = publisher
+        self.timeout = timeout
+        self._closed = False
+        self._queue = None
+        self._sender = None
+        self._send = None
+
+    def _read(self, loop):
+        """Reader thread: pass the messages to the event loop"""
+
+        subscriber = self.subscriber
+        if hasattr(subscriber, '__enter__'):
+            subscriber = subscriber.__enter__()
+        try:
+            for msg in subscriber.recv(timeout=self.timeout):
+                if self._closed:
+                    break
+                if msg is not None:
+                    loop.call_soon_threadsafe(self._queue.put_nowait, msg)
+        except Exception:
+            LOG.exception("Failed receiving messages")
+        finally:
+            if hasattr(self.subscriber, '__exit__'):
+                self.subscriber.__exit__(None, None, None)
+            loop.call_soon_threadsafe(self._queue.put_nowait, _CLOSED)
+
+    async def messages(self):
+        """Yield the received messages, until closed"""
+
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        reader = threading.Thread(target=self._read, args=(loop, ))
+        reader.daemon = True
+        reader.start()
+
+        while True:
+            msg = await self._queue.get()
+            if msg is _CLOSED:
+                return
+            yield msg
+
+    def _open_publisher(self):
+        publisher = self.publisher
+        if hasattr(publisher, '__enter__'):
+            publisher = publisher.__enter__()
+        self._send = publisher.send
+
+    async def publish(self, msg):
+        """Send *msg*, in the publisher thread"""
+
+        loop = asyncio.get_running_loop()
+        if self._sender is None:
+            self._sender = ThreadPoolExecutor(max_workers=1)
+            await loop.run_in_executor(self._sender, self._open_publisher)
+        await loop.run_in_executor(self._sender, self._send, msg)
+
+    def close(self):
+        """Stop reading, and release the publisher"""
+
+        self._closed = True
+        if self._sender is not None:
+            if hasattr(self.publisher, '__exit__'):
+                self._sender.submit(self.publisher.__exit__, None, None, None)
+            self._sender.shutdown(wait=True)
+            self._sender = None
+
+
+class ExecutorPool(object):
+
+    """The apply_async interface of WarmPool, used by ScenePipeline, on top
+    of a concurrent.futures *executor* (e.g. a ProcessPoolExecutor)"""
+
+    def __init__(self, executor):
+        self.executor = executor
+
+    def apply_async(self, func, args=(), kwds=None, callback=None,
+                    error_callback=None):
+        future = self.executor.submit(func, *args, **(kwds or {}))
+
+        def _done(fut):
+            try:
+                value = fut.result()
+            except Exception:
+                if error_callback is not None:
+                    error_callback(traceback.format_exc())
+                return
+            if callback is not None:
+                callback(value)
+
+        future.add_done_callback(_done)
+        return future
+
+    def close(self):
+        pass
+
+    def join(self):
+        self.executor.shutdown(wait=True)
+
+
+class AsyncRunner(object):
+
+    """Run the scenes announced on the transports *sources* through
+    *scheduler* (a SceneScheduler feeding a ScenePipeline), and publish the
+    products on the transport *sink*.
+
+    *make_scene(msg)* gives the (key, scene, uris) of a message, or None if
+    it is not to be processed. *check_uri(uris)* gives the local file names
+    of the uris, or raises IOError if they are not all there; it may block
+    and is run in a thread (*io_workers* threads). *make_message(key, scene,
+    product)* gives the message announcing a product, see
+    ScenePipeline.on_product.
+
+    The outcome of the latest *keep_results* scenes is kept in results, as
+    asyncio futures of the list of products written. Failed scenes are
+    logged as their futures complete, and run gathers the outcomes of the
+    scenes kept before returning"""
+
+    def __init__(self, sources, sink, scheduler, make_scene, make_message,
+                 check_uri=None, io_workers=4, keep_results=100):
+        self.sources = sources
+        self.sink = sink
+        self.scheduler = scheduler
+        self.make_scene = make_scene
+        self.make_message = make_message
+        self.check_uri = check_uri
+        self.keep_results = keep_results
+        self.results = OrderedDict()
+
+        self._io = ThreadPoolExecutor(max_workers=io_workers)
+        self._checking = set()
+        self._loop = None
+        self._outbox = None
+        self._handlers = set()
+
+        scheduler.pipeline.on_product = self._product_ready
+
+    async def run(self):
+        """Consume all the sources until they are closed, then publish the
+        products still to come"""
+
+        self._loop = asyncio.get_running_loop()
+        self._outbox = asyncio.Queue()
+        publisher = asyncio.ensure_future(self._publish())
+        try:
+            await asyncio.gather(*[self._consume(source)
+                                   for source in self.sources])
+            if self._handlers:
+                await asyncio.gather(*self._handlers)
+            await self._loop.run_in_executor(None,
+                                             self.scheduler.pipeline.join)
+            await self._gather_results()
+        finally:
+            self._outbox.put_nowait(_CLOSED)
+            await publisher
+            self._io.shutdown(wait=False)
+
+    async def _gather_results(self):
+        """Wait for the outcome of the scenes kept in results"""
+
+        keys = list(self.results.keys())
+        outcomes = await asyncio.gather(*self.results.values(),
+                                        return_exceptions=True)
+        failed = [key for key, outcome in zip(keys, outcomes)
+                  if isinstance(outcome, BaseException)]
+        LOG.info("%d scenes done, %d failed%s", len(keys), len(failed),
+                 ': ' + ', '.join(failed) if failed else '')
+
+    def stop(self):
+        """Close the sources; run returns once the scenes in the pipeline
+        are done"""
+
+        for source in self.sources:
+            source.close()
+
+    async def _consume(self, source):
+        async for msg in source.messages():
+            task = asyncio.ensure_future(self._handle(msg))
+            self._handlers.add(task)
+            task.add_done_callback(self._handlers.discard)
+
+    async def _handle(self, msg):
+        """Check the files of the scene in *msg*, and schedule it"""
+
+        try:
+            parsed = self.make_scene(msg)
+        except Exception:
+            LOG.exception("Failed reading message %s", str(msg))
+            return
+        if parsed is None:
+            return
+
+        key, scene, uris = parsed
+        if key in self._checking:
+            LOG.debug("Scene %s already being checked", key)
+            return
+        self._checking.add(key)
+        try:
+            if self.check_uri is None:
+                filenames = list(uris)
+            else:
+                filenames = await self._loop.run_in_executor(
+                    self._io, self.check_uri, uris)
+        except IOError:
+            LOG.warning("One or more files of %s not present on this host!",
+                        key)
+            return
+        finally:
+            self._checking.discard(key)
+
+        scene['filenames'] = filenames
+        done = Future()
+        result = self.scheduler.add(key, scene, callback=done.set_result,
+                                    error_callback=self._failed(done))
+        if result is not None:
+            outcome = asyncio.wrap_future(done)
+            outcome.add_done_callback(partial(self._scene_outcome, key))
+            self.results[key] = outcome
+            while len(self.results) > self.keep_results:
+                self.results.popitem(last=False)
+
+    @staticmethod
+    def _failed(done):
+        def _fail(reason):
+            done.set_exception(RuntimeError(reason))
+        return _fail
+
+    @staticmethod
+    def _scene_outcome(key, outcome):
+        """Log the failure of the scene *key*. This retrieves the exception
+        of the future *outcome*, also for scenes no longer kept in
+        results"""
+
+        if outcome.cancelled():
+            return
+        err = outcome.exception()
+        if err is not None:
+            LOG.error("No complete OCA products for scene %s: %s", key, err)
+
+    def _product_ready(self, key, scene, product):
+        """Called in the pool callback thread for each product"""
+
+        try:
+            msg = self.make_message(key, scene, product)
+        except Exception:
+            LOG.exception("Failed making the message for %s",
+                          product['filename'])
+            return
+        self._loop.call_soon_threadsafe(self._outbox.put_nowait, msg)
+
+    async def _publish(self):
+        while True:
+            msg = await self._outbox.get()
+            if msg is _CLOSED:
+                break
+            try:
+                await self.sink.publish(msg)
+            except Exception:
+                LOG.exception("Failed publishing %s", str(msg))
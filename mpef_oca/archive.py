@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <adam.dybbroe@smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Bulk reprocessing of archived MPEF OCA LRIT segments: slot discovery,
+claim files to share the slots between processes and nodes, and
+checkpointing of the slots done
+"""
+
+import os
+import time
+import socket
+import logging
+
+from .lrit import LRIT_PATTERN
+from .utils import SATELLITE, SAT_FILE_PREFIX
+
+LOG = logging.getLogger(__name__)
+
+
+def find_slots(archive_dir):
+    """Find the LRIT segments under *archive_dir* and group them per slot.
+    Returns a dict of slot key to (platform_name, nominal_time, filenames)"""
+
+    from trollsift import parser
+
+    p__ = parser.Parser(LRIT_PATTERN)
+    slots = {}
+    for dirpath, dirnames, filenames in os.walk(archive_dir):
+        for fname in filenames:
+            if fname.find('PRO') > 0:
+                continue
+            try:
+                res = p__.parse(fname)
+            except ValueError:
+                continue
+            platform_name = res['platform_name'].strip('_')
+            key = slot_key(platform_name, res['nominal_time'])
+            if key not in slots:
+                slots[key] = (platform_name, res['nominal_time'], [])
+            slots[key][2].append(os.path.join(dirpath, fname))
+
+    for key in slots:
+        slots[key][2].sort()
+    return slots
+
+
+def slot_key(platform_name, nominal_time):
+    """Get the key of the slot of *platform_name* at *nominal_time*"""
+
+    return '%s_%s' % (platform_name, nominal_time.strftime('%Y%m%d%H%M'))
+
+
+def output_prefix(platform_name, nominal_time, area_id):
+    """Get the output file name prefix of a slot and area"""
+
+    satid = SATELLITE.get(platform_name, platform_name)
+    return '%s_%s_%s_oca' % (SAT_FILE_PREFIX.get(satid, satid.lower()),
+                             nominal_time.strftime('%Y%m%d%H%M'), area_id)
+
+
+class SlotClaims(object):
+
+    """Claim and done files in *state_dir*, shared by all the processes and
+    nodes working on the same archive. A claim older than *stale_after*
+    seconds is considered left by a killed run and can be taken over"""
+
+    def __init__(self, state_dir, stale_after=3600):
+        self.stale_after = stale_after
+        self.claim_dir = os.path.join(state_dir, 'claims')
+        self.done_dir = os.path.join(state_dir, 'done')
+        for path in [self.claim_dir, self.done_dir]:
+            if not os.path.isdir(path):
+                try:
+                    os.makedirs(path)
+                except OSError:
+                    if not os.path.isdir(path):
+                        raise
+
+    def is_done(self, key):
+        """Check whether slot *key* is already processed"""
+
+        return os.path.exists(os.path.join(self.done_dir, key))
+
+    def claim(self, key):
+        """Try to claim slot *key*. Returns True if this process got it"""
+
+        if self.is_done(key):
+            return False
+
+        claim_file = os.path.join(self.claim_dir, key)
+        try:
+            fd_ = os.open(claim_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError:
+            if not self._break_stale(claim_file):
+                return False
+            return self.claim(key)
+
+        os.write(fd_, ('%s %d %f\n' % (socket.gethostname(), os.getpid(),
+                                       time.time())).encode('ascii'))
+        os.close(fd_)
+        return True
+
+    def _break_stale(self, claim_file):
+        """Remove *claim_file* if it is stale. Returns True if it was"""
+
+        try:
+            age = time.time() - os.path.getmtime(claim_file)
+        except OSError:
+            return True
+        if age < self.stale_after:
+            return False
+
+        LOG.warning("Taking over stale claim %s", claim_file)
+        stale = '%s.stale.%s.%d' % (claim_file, socket.gethostname(),
+                                    os.getpid())
+        try:
+            os.rename(claim_file, stale)
+            os.remove(stale)
+        except OSError:
+            return False
+        return True
+
+    def done(self, key):
+        """Checkpoint slot *key* as processed and release its claim"""
+
+        done_file = os.path.join(self.done_dir, key)
+        tmpname = os.path.join(self.done_dir, '.%s.%d' % (key, os.getpid()))
+        with open(tmpname, 'w') as fpt:
+            fpt.write('%s %d %f\n' % (socket.gethostname(), os.getpid(),
+                                      time.time()))
+        os.rename(tmpname, done_file)
+        self.release(key)
+
+    def release(self, key):
+        """Release the claim on slot *key*"""
+
+        try:
+            os.remove(os.path.join(self.claim_dir, key))
+        except OSError:
+            pass
+
+
+def process_slot(filenames, area_ids, output_dir, formats=('tif', ),
+                 nthreads=4, area_def=None):
+    """Decode the LRIT segments *filenames* of one slot, and write the NetCDF
+    file and images of each area in *area_ids* to *output_dir*. The grid of
+    the segments is *area_def* (default the full disk). Returns the list of
+    files written"""
+
+    from .oca_reader import OCAData
+    from .render import render
+    from .lrit import read_segment_info
+
+    header = read_segment_info(filenames[0])
+    oca = OCAData(area_def=area_def)
+    oca.read_from_lrit(filenames, area_ids=area_ids)
+
+    written = []
+    for area_id, scene in zip(area_ids,
+                              oca.project_many(area_ids, nthreads=nthreads)):
+        prefix = os.path.join(output_dir, output_prefix(
+            header['platform_name'], header['nominal_time'], area_id))
+        scene.to_netcdf(prefix + '.nc')
+        written.append(prefix + '.nc')
+        if formats:
+            written.extend(render(scene, prefix, formats=formats,
+                                  nthreads=nthreads))
+    oca.close()
+    return written
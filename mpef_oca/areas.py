@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <a000680@c20671.ad.smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Registry of the area definitions of areas.def. Each area is parsed once
+per process, and the registry is invalidated when the file changes. The
+file is only looked for on first use, not at import
+"""
+
+import os
+import threading
+
+CFG_DIR = os.environ.get('MPEF_OCA_CONFIG_DIR', './')
+AREA_DEF_FILE = os.path.join(CFG_DIR, "areas.def")
+
+#: The full disk grid of the OCA product
+FULL_DISK = 'met09globeFull'
+
+_REGISTRIES = {}
+_LOCK = threading.Lock()
+
+
+class AreaRegistry(object):
+
+    """The area definitions of the file *filename*, parsed on first use and
+    kept as long as the file modification time and size are unchanged"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._stamp = None
+        self._areas = {}
+        self._lock = threading.Lock()
+
+    def _check(self):
+        """Drop the parsed areas if the file changed"""
+
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            raise IOError('Config file %s does not exist!' % self.filename)
+        stamp = (stat.st_mtime, stat.st_size)
+        if stamp != self._stamp:
+            self._areas = {}
+            self._stamp = stamp
+
+    def get_many(self, area_ids):
+        """Get the area definitions of *area_ids*. The ones not parsed yet
+        are parsed together"""
+
+        with self._lock:
+            self._check()
+            missing = []
+            for area_id in area_ids:
+                if area_id not in self._areas and area_id not in missing:
+                    missing.append(area_id)
+            if missing:
+                import pyresample as pr
+                area_defs = pr.utils.load_area(self.filename, *missing)
+                if len(missing) == 1:
+                    area_defs = [area_defs]
+                self._areas.update(zip(missing, area_defs))
+            return [self._areas[area_id] for area_id in area_ids]
+
+    def get(self, area_id):
+        """Get the area definition of *area_id*"""
+
+        return self.get_many([area_id])[0]
+
+
+def get_registry(filename=None):
+    """Get the process wide registry of *filename* (default areas.def in
+    the config dir)"""
+
+    filename = os.path.abspath(filename or AREA_DEF_FILE)
+    with _LOCK:
+        if filename not in _REGISTRIES:
+            _REGISTRIES[filename] = AreaRegistry(filename)
+        return _REGISTRIES[filename]
+
+
+def load_areas(area_ids, filename=None):
+    """Get the area definitions of *area_ids*, from the registry"""
+
+    return get_registry(filename).get_many(area_ids)
+
+
+def load_area(area_id, filename=None):
+    """Get the area definition of *area_id*, from the registry"""
+
+    return get_registry(filename).get(area_id)
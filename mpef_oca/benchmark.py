@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <a000680@c20671.ad.smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Benchmarks of the reader and the processing chain on synthetic products
+(see synthetic), with JSON baselines to catch regressions. Each case is run
+*repeat* times and the median wall time is compared to the baseline; the
+first run, with the caches cold, is kept too
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import logging
+import platform
+import tempfile
+from datetime import datetime
+from contextlib import contextmanager
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_SIZE = 928
+DEFAULT_THRESHOLD = 0.2
+
+
+def timeit(func, repeat=3):
+    """Run *func* *repeat* times. Returns the first, best and median wall
+    times"""
+
+    times = []
+    for _ in range(max(repeat, 1)):
+        tic = time.time()
+        func()
+        times.append(time.time() - tic)
+    ordered = sorted(times)
+    return {'first': times[0],
+            'best': ordered[0],
+            'median': ordered[len(ordered) // 2],
+            'runs': len(times)}
+
+
+def prepare(workdir, size=DEFAULT_SIZE, nsegments=8, seed=0):
+    """Write the synthetic segments and GRIB file of a *size* x *size* full
+    disk in *workdir*. Returns the segment file names and the GRIB file
+    name"""
+
+    from .synthetic import make_grib_stream, write_segments
+
+    stream = make_grib_stream(size, seed=seed)
+    lritdir = os.path.join(workdir, 'lrit')
+    os.makedirs(lritdir)
+    filenames = write_segments(stream, lritdir, nsegments=nsegments)
+    gribfile = os.path.join(workdir, 'oca.grb')
+    with open(gribfile, 'wb') as fpt:
+        fpt.write(stream)
+    return filenames, gribfile
+
+
+@contextmanager
+def private_cache(cache_dir):
+    """Point the on-disk cache at *cache_dir*, and start from empty
+    in-process caches, for the with block. This keeps the lookups of the
+    synthetic grids out of the production cache, and the first runs cold"""
+
+    from . import cache, geoloc, resample
+
+    saved = cache.CACHE_DIR
+    cache.CACHE_DIR = cache_dir
+    geoloc._GEOLOCATIONS.clear()
+    resample._RESAMPLERS.clear()
+    try:
+        yield cache_dir
+    finally:
+        cache.CACHE_DIR = saved
+        geoloc._GEOLOCATIONS.clear()
+        resample._RESAMPLERS.clear()
+
+
+def run_benchmarks(workdir, area_ids, size=DEFAULT_SIZE, repeat=3,
+                   fields=None):
+    """Time the reading, projection, imaging and the full processing of a
+    synthetic slot of *size* x *size* pixels, projected to *area_ids*, with
+    the caches under *workdir*. Returns the timings, keyed by case"""
+
+    with private_cache(os.path.join(workdir, 'cache')):
+        return _run_benchmarks(workdir, area_ids, size, repeat, fields)
+
+
+def _run_benchmarks(workdir, area_ids, size, repeat, fields):
+
+    from .oca_reader import OCAData, AREA_DEF_FILE
+    from .synthetic import reduced_area
+    from .archive import process_slot
+    from .render import DEFAULT_FIELDS
+
+    if fields is None:
+        fields = DEFAULT_FIELDS
+    grid = reduced_area(size, AREA_DEF_FILE)
+    filenames, gribfile = prepare(workdir, size)
+    results = {}
+
+    def _read_from_lrit():
+        scene = OCAData(area_def=grid)
+        scene.read_from_lrit(filenames)
+        scene.load()
+        scene.close()
+
+    def _readgrib():
+        scene = OCAData(area_def=grid)
+        scene._gribfilename = gribfile
+        scene.readgrib()
+        scene.load()
+        scene.close()
+
+    LOG.info("Benchmark read_from_lrit")
+    results['read_from_lrit'] = timeit(_read_from_lrit, repeat)
+    LOG.info("Benchmark readgrib")
+    results['readgrib'] = timeit(_readgrib, repeat)
+
+    scene = OCAData(area_def=grid)
+    scene.read_from_lrit(filenames)
+    scene.load()
+    projected = {}
+    for area_id in area_ids:
+        def _project():
+            projected[area_id] = scene.project_many([area_id])[0]
+            projected[area_id].load()
+        LOG.info("Benchmark project %s", area_id)
+        results['project_' + area_id] = timeit(_project, repeat)
+
+    for field in fields:
+        LOG.info("Benchmark make_image %s", field)
+        results['make_image_' + field] = timeit(
+            lambda: projected[area_ids[0]].make_image(field), repeat)
+    scene.close()
+
+    outdir = os.path.join(workdir, 'out')
+    os.makedirs(outdir)
+    LOG.info("Benchmark the processing of a slot")
+    results['process_slot'] = timeit(
+        lambda: process_slot(filenames, area_ids, outdir, area_def=grid),
+        repeat)
+
+    return results
+
+
+def make_baseline(results, size, area_ids):
+    """Wrap the *results* with a description of the run"""
+
+    return {'size': size,
+            'areas': list(area_ids),
+            'created': datetime.utcnow().isoformat(),
+            'host': socket.gethostname(),
+            'python': platform.python_version(),
+            'results': results}
+
+
+def save_baseline(filename, baseline):
+    """Write the *baseline* to the JSON file *filename*"""
+
+    tmpname = filename + '.tmp'
+    with open(tmpname, 'w') as fpt:
+        json.dump(baseline, fpt, indent=2, sort_keys=True)
+    os.rename(tmpname, filename)
+
+
+def load_baseline(filename):
+    """Read a baseline JSON file"""
+
+    with open(filename) as fpt:
+        return json.load(fpt)
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD, key='median'):
+    """Compare the *current* run to the *baseline*, both as made by
+    make_baseline. Returns the list of (case, baseline time, current time)
+    of the cases more than *threshold* (fraction) slower"""
+
+    if (baseline['size'] != current['size'] or
+            baseline['areas'] != current['areas']):
+        raise ValueError('Baseline made with size %s and areas %s, not %s '
+                         'and %s' % (baseline['size'], baseline['areas'],
+                                     current['size'], current['areas']))
+
+    regressions = []
+    for case in sorted(current['results']):
+        if case not in baseline['results']:
+            continue
+        before = baseline['results'][case][key]
+        after = current['results'][case][key]
+        if after > before * (1. + threshold):
+            regressions.append((case, before, after))
+    return regressions
+
+
+def report(current, baseline=None, out=sys.stdout):
+    """Print the timings of *current*, against *baseline* if given"""
+
+    for case in sorted(current['results']):
+        timing = current['results'][case]
+        line = '%-28s %8.3f s (first %8.3f s)' % (case, timing['median'],
+                                                  timing['first'])
+        if baseline and case in baseline['results']:
+            before = baseline['results'][case]['median']
+            line += '  baseline %8.3f s  %+6.1f%%' % (
+                before, 100. * (timing['median'] - before) / before
+                if before else 0.)
+        out.write(line + '\n')
+
+
+def run(area_ids, size=DEFAULT_SIZE, repeat=3, workdir=None):
+    """Run the benchmarks in a temporary directory (or *workdir*), and get
+    the result as a baseline"""
+
+    tmpdir = tempfile.mkdtemp(prefix='oca_bench_', dir=workdir)
+    try:
+        results = run_benchmarks(tmpdir, area_ids, size, repeat)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return make_baseline(results, size, area_ids)
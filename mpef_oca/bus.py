@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <adam.dybbroe@smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""An in-process stand-in for the posttroll bus, with the publisher and
+subscriber interfaces the runner uses, for tests and local runs without a
+network
+"""
+
+import threading
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+
+class LocalPublisher(object):
+
+    """Publisher on a LocalBus, usable like posttroll's Publish"""
+
+    def __init__(self, bus):
+        self.bus = bus
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def send(self, msg):
+        """Deliver *msg* to all the subscribers of the bus"""
+
+        self.bus.deliver(msg)
+
+    def stop(self):
+        pass
+
+
+class LocalSubscriber(object):
+
+    """Subscriber on a LocalBus, usable like posttroll's Subscribe"""
+
+    def __init__(self, bus, topics=None):
+        self.bus = bus
+        self.topics = topics
+        self.queue = Queue()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+    def accepts(self, msg):
+        """Check the subject of *msg* against the subscribed topics"""
+
+        if not self.topics:
+            return True
+        subject = getattr(msg, 'subject', None)
+        if subject is None:
+            return True
+        return any(subject.startswith(topic) for topic in self.topics)
+
+    def recv(self, timeout=None):
+        """Yield the messages, or None each time *timeout* seconds pass
+        without one, as posttroll does"""
+
+        while True:
+            try:
+                yield self.queue.get(timeout=timeout)
+            except Empty:
+                yield None
+
+
+class LocalBus(object):
+
+    """In-process message bus. Messages sent by its publishers are delivered,
+    as they are, to all of its subscribers; *decode* can be given to turn the
+    sent (encoded) messages into message objects"""
+
+    def __init__(self, decode=None):
+        self.decode = decode
+        self.sent = []
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def publisher(self, *args, **kwargs):
+        """Get a publisher, the arguments of posttroll's Publish are ignored"""
+
+        return LocalPublisher(self)
+
+    def subscriber(self, services='', topics=None, *args, **kwargs):
+        """Get a subscriber to *topics*"""
+
+        subscriber = LocalSubscriber(self, topics)
+        with self._lock:
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def deliver(self, msg):
+        """Deliver *msg* to all the subscribers"""
+
+        if self.decode is not None:
+            msg = self.decode(msg)
+        with self._lock:
+            self.sent.append(msg)
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            if subscriber.accepts(msg):
+                subscriber.queue.put(msg)
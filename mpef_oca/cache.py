@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <adam.dybbroe@smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""On-disk cache of precomputed arrays (geolocation, resampling lookups),
+shared between slots and processes through memory mapping
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+CFG_DIR = os.environ.get('MPEF_OCA_CONFIG_DIR', './')
+CACHE_DIR = os.environ.get('MPEF_OCA_CACHE_DIR',
+                           os.path.join(CFG_DIR, 'cache'))
+
+#: Bump when the layout or meaning of the cached arrays changes
+CACHE_VERSION = 1
+
+_DIGESTS = {}
+
+
+def file_digest(filename):
+    """Get the sha1 hex digest of the content of *filename*. The digest is
+    memoized as long as the file modification time and size are unchanged"""
+
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_mtime, stat.st_size)
+    if key not in _DIGESTS:
+        sha = hashlib.sha1()
+        with open(filename, 'rb') as fpt:
+            for chunk in iter(lambda: fpt.read(1 << 20), b''):
+                sha.update(chunk)
+        _DIGESTS[key] = sha.hexdigest()
+    return _DIGESTS[key]
+
+
+def area_fingerprint(area_def):
+    """Get a string identifying the geometry of the area *area_def*"""
+
+    return '%s %s %s %s' % (area_def.area_id, area_def.proj4_string,
+                            area_def.shape, tuple(area_def.area_extent))
+
+
+def cache_key(*parts):
+    """Get a cache key from the string representation of *parts* and the
+    cache version"""
+
+    sha = hashlib.sha1()
+    sha.update(('v%d' % CACHE_VERSION).encode('ascii'))
+    for part in parts:
+        sha.update(b'\0')
+        sha.update(str(part).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def cache_path(kind, name, key, cache_dir=None):
+    """Get the directory holding the cached arrays *kind*/*name* for *key*"""
+
+    return os.path.join(cache_dir or CACHE_DIR, kind,
+                        '%s_%s' % (name, key[:16]))
+
+
+def load_arrays(path, names):
+    """Load the arrays *names* cached in *path* as read-only memory maps.
+    Returns None if the cache entry is missing or of another version"""
+
+    try:
+        with open(os.path.join(path, 'meta.json')) as fpt:
+            meta = json.load(fpt)
+    except (IOError, OSError, ValueError):
+        return None
+    if meta.get('version') != CACHE_VERSION:
+        return None
+
+    arrays = {}
+    for name in names:
+        try:
+            arrays[name] = np.load(os.path.join(path, name + '.npy'),
+                                   mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            return None
+    return arrays
+
+
+def save_arrays(path, arrays, **meta):
+    """Store the dict of *arrays* in *path*, atomically. If another process
+    stored the same entry meanwhile, its copy is kept"""
+
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+        try:
+            os.makedirs(parent)
+        except OSError:
+            if not os.path.isdir(parent):
+                raise
+
+    tmpdir = tempfile.mkdtemp(dir=parent, prefix='.tmp')
+    try:
+        for name, arr in arrays.items():
+            np.save(os.path.join(tmpdir, name + '.npy'), arr)
+        meta['version'] = CACHE_VERSION
+        meta['arrays'] = sorted(arrays.keys())
+        with open(os.path.join(tmpdir, 'meta.json'), 'w') as fpt:
+            json.dump(meta, fpt)
+        if os.path.isdir(path):
+            # A stale entry of another version
+            shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmpdir, path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <adam.dybbroe@smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Appendable time series store of projected OCA fields, one NetCDF file per
+area with an unlimited time dimension
+"""
+
+import os
+from datetime import timedelta
+import numpy as np
+
+from .utils import FIELDNAMES
+from .netcdf import field_metadata, get_packing, EPOCH
+
+
+def _seconds(timeslot):
+    """Get the seconds since EPOCH of *timeslot*"""
+
+    delta = timeslot - EPOCH
+    return delta.days * 86400. + delta.seconds
+
+
+class OCACube(object):
+
+    """Time series store of the projected OCA fields of one area. Each slot is
+    appended along the unlimited time dimension. The arrays are chunked as
+    (time_chunk, space_chunk, space_chunk), a compromise between reading
+    maps and reading pixel time series"""
+
+    def __init__(self, filename, area_def=None, time_chunk=32,
+                 space_chunk=64, zlib=True, complevel=4):
+        from netCDF4 import Dataset
+
+        self.filename = filename
+        if os.path.exists(filename):
+            self._nc = Dataset(filename, 'a')
+        elif area_def is None:
+            raise IOError('Cube %s does not exist, and no area given to '
+                          'create it' % filename)
+        else:
+            self._nc = Dataset(filename, 'w', format='NETCDF4')
+            self._create(area_def, time_chunk, space_chunk, zlib, complevel)
+
+        self.area_id = self._nc.area_id
+        self.shape = (len(self._nc.dimensions['y']),
+                      len(self._nc.dimensions['x']))
+
+    def _create(self, area_def, time_chunk, space_chunk, zlib, complevel):
+        """Create the dimensions and variables"""
+
+        nc_ = self._nc
+        nc_.title = 'MPEF OCA cloud parameters time series'
+        nc_.area_id = area_def.area_id
+        nc_.proj4 = area_def.proj4_string
+        nc_.area_extent = np.array(area_def.area_extent, dtype=np.float64)
+
+        nlines, ncols = area_def.shape
+        nc_.createDimension('time', None)
+        nc_.createDimension('y', nlines)
+        nc_.createDimension('x', ncols)
+
+        var = nc_.createVariable('time', 'f8', ('time', ),
+                                 chunksizes=(max(time_chunk, 512), ))
+        var.units = 'seconds since 1970-01-01 00:00:00'
+
+        chunksizes = (time_chunk, min(space_chunk, nlines),
+                      min(space_chunk, ncols))
+        for field in FIELDNAMES.keys():
+            params = field_metadata(field)
+            for attr, param, name in zip(['data', 'error'], params,
+                                         FIELDNAMES[field]):
+                if param is None:
+                    continue
+                encoding = get_packing(field, attr)
+                var = nc_.createVariable(self._varname(field, attr),
+                                         encoding.dtype, ('time', 'y', 'x'),
+                                         zlib=zlib, complevel=complevel,
+                                         shuffle=True, chunksizes=chunksizes,
+                                         fill_value=encoding.fill_value)
+                if encoding.scaled:
+                    var.scale_factor = encoding.scale_factor or 1.
+                    var.add_offset = encoding.add_offset or 0.
+                var.long_name = param[name]
+                if param.get('units'):
+                    var.units = param['units']
+
+    @staticmethod
+    def _varname(field, attr):
+        if attr == 'data':
+            return field
+        return field + '_error'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Close the store"""
+
+        if self._nc is not None:
+            self._nc.close()
+            self._nc = None
+
+    @property
+    def times(self):
+        """The time slots in the store"""
+
+        return [EPOCH + timedelta(seconds=float(sec))
+                for sec in self._nc.variables['time'][:]]
+
+    def append(self, scene):
+        """Append the fields of the projected OCAData *scene*. A time slot
+        already in the store is overwritten"""
+
+        if (scene.area_def.area_id != self.area_id or
+                scene.area_def.shape != self.shape):
+            raise ValueError('Scene area %s does not match the cube area %s' %
+                             (scene.area_def.area_id, self.area_id))
+
+        seconds = _seconds(scene.timeslot)
+        times = self._nc.variables['time'][:]
+        existing = np.flatnonzero(times == seconds)
+        if existing.size:
+            tidx = int(existing[0])
+        else:
+            tidx = len(times)
+
+        for field in FIELDNAMES.keys():
+            for attr, name in zip(['data', 'error'], FIELDNAMES[field]):
+                if not name:
+                    continue
+                data = getattr(scene, field).fetch(attr)
+                if data is None:
+                    continue
+                var = self._nc.variables[self._varname(field, attr)]
+                var.set_auto_maskandscale(False)
+                var[tidx, :, :] = get_packing(field, attr).encode(data)
+                del data
+
+        self._nc.variables['time'][tidx] = seconds
+        self._nc.sync()
+
+    def timeseries(self, field, lines, cols, start=None, end=None,
+                   attr='data'):
+        """Get the time series of the array *attr* of *field* in the pixel box
+        given by the slices *lines* and *cols*, for the slots between *start*
+        and *end* (inclusive). Returns the list of times and a masked array of
+        physical values of shape (time, lines, cols)"""
+
+        seconds = np.asarray(self._nc.variables['time'][:])
+        selected = np.ones(seconds.shape, dtype=bool)
+        if start is not None:
+            selected &= seconds >= _seconds(start)
+        if end is not None:
+            selected &= seconds <= _seconds(end)
+        tidx = np.flatnonzero(selected)
+        if tidx.size == 0:
+            return [], np.ma.masked_array(np.empty((0, 0, 0)))
+
+        var = self._nc.variables[self._varname(field, attr)]
+        var.set_auto_maskandscale(False)
+        tslice = slice(int(tidx[0]), int(tidx[-1]) + 1)
+        stored = var[tslice, lines, cols][tidx - tidx[0]]
+
+        encoding = get_packing(field, attr)
+        stored = np.ma.masked_equal(stored, encoding.fill_value)
+        times = [EPOCH + timedelta(seconds=float(sec))
+                 for sec in seconds[tidx]]
+        return times, encoding.decode(stored)
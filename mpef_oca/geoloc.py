@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <adam.dybbroe@smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Geolocation of the SEVIRI grid, computed once per area definition and
+shared between scenes and processes through a memory mapped cache
+"""
+
+import logging
+import numpy as np
+
+from .cache import (cache_key, cache_path, area_fingerprint, file_digest,
+                    load_arrays, save_arrays)
+from .metrics import measure
+
+LOG = logging.getLogger(__name__)
+
+_GEOLOCATIONS = {}
+
+
+class Geolocation(object):
+
+    """Longitudes and latitudes (float32) of an area, with a bit packed mask of
+    the pixels in space"""
+
+    def __init__(self, lons, lats, space_bits, shape):
+        self.lons = lons
+        self.lats = lats
+        self.space_bits = space_bits
+        self.shape = shape
+        self._space_mask = None
+
+    @property
+    def space_mask(self):
+        """Boolean mask, True for the pixels without a valid geolocation"""
+
+        if self._space_mask is None:
+            size = self.shape[0] * self.shape[1]
+            self._space_mask = np.unpackbits(
+                self.space_bits)[:size].reshape(self.shape).astype(bool)
+        return self._space_mask
+
+    def get_lonlats(self):
+        """Get the longitudes and latitudes as masked arrays"""
+
+        return (np.ma.masked_array(self.lons, self.space_mask),
+                np.ma.masked_array(self.lats, self.space_mask))
+
+
+def compute_geolocation(area_def):
+    """Compute the geolocation of *area_def*"""
+
+    lons, lats = area_def.get_lonlats()
+    space = ~(np.isfinite(lons) & np.isfinite(lats))
+    space |= (lons < -180) | (lons > 180) | (lats < -90) | (lats > 90)
+    lons = lons.astype(np.float32)
+    lats = lats.astype(np.float32)
+    return lons, lats, space
+
+
+def get_geolocation(area_def, area_file=None, cache_dir=None):
+    """Get the geolocation of *area_def*, from the process memory or the disk
+    cache, computing and storing it first if needed"""
+
+    parts = [area_fingerprint(area_def)]
+    if area_file:
+        parts.append(file_digest(area_file))
+    key = cache_key(*parts)
+
+    if key not in _GEOLOCATIONS:
+        path = cache_path('geoloc', area_def.area_id, key, cache_dir)
+        names = ['lons', 'lats', 'space']
+        with measure('geolocation', area=area_def.area_id):
+            arrays = load_arrays(path, names)
+            if arrays is None:
+                LOG.info("Compute geolocation of %s", area_def.area_id)
+                lons, lats, space = compute_geolocation(area_def)
+                save_arrays(path, {'lons': lons, 'lats': lats,
+                                   'space': np.packbits(space.ravel())},
+                            area_id=area_def.area_id)
+                arrays = load_arrays(path, names)
+
+        _GEOLOCATIONS[key] = Geolocation(arrays['lons'], arrays['lats'],
+                                         arrays['space'], area_def.shape)
+
+    return _GEOLOCATIONS[key]
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <a000680@c20671.ad.smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""GRIB message access for the OCA products, from file or from memory
+"""
+
+import os
+import struct
+import logging
+import numpy as np
+
+from .metrics import measure
+
+LOG = logging.getLogger(__name__)
+
+
+def grib_message_length(buf, pos):
+    """Get the total length of the GRIB message starting at *pos* in *buf*, or
+    None if the length section is not (yet) available"""
+
+    if pos + 16 > len(buf):
+        return None
+    edition = struct.unpack_from('>B', buf, pos + 7)[0]
+    if edition == 1:
+        high, low = struct.unpack_from('>BH', buf, pos + 4)
+        return (high << 16) + low
+    return struct.unpack_from('>Q', buf, pos + 8)[0]
+
+
+def iter_grib_messages(buf, offset=0):
+    """Yield the (start, end) byte offsets of each complete GRIB message in
+    *buf*, starting the search at *offset*"""
+
+    pos = buf.find(b'GRIB', offset)
+    while pos >= 0:
+        length = grib_message_length(buf, pos)
+        if length is None or pos + length > len(buf):
+            return
+        yield pos, pos + length
+        pos = buf.find(b'GRIB', pos + length)
+
+
+def split_grib_messages(buf):
+    """Split a buffer holding a stream of GRIB messages into one memoryview
+    per message, without copying"""
+
+    view = memoryview(buf)
+    return [view[start:end] for start, end in iter_grib_messages(buf)]
+
+
+def decode_into(message, data, mask, window=None):
+    """Decode the GRIB *message* and write its values, flipped to the grid
+    orientation and cut to the *window* (line and column slices) if any,
+    into the preallocated arrays *data* and *mask*. Returns False if the
+    message has no bitmap, in which case *mask* is left untouched"""
+
+    import pygrib
+
+    if isinstance(message, memoryview):
+        message = message.tobytes()
+    values = pygrib.fromstring(bytes(message))['values'][::-1, ::-1]
+    if window is not None:
+        values = values[window]
+    np.copyto(data, np.ma.getdata(values), casting='same_kind')
+    if np.ma.getmask(values) is np.ma.nomask:
+        return False
+    mask[...] = np.ma.getmaskarray(values)
+    return True
+
+
+class Grib(object):
+
+    """Indexed access to the messages of a GRIB file. The file is opened once,
+    and a parameter name to message number index is built in a single pass"""
+
+    def __init__(self, fname=None, buf=None):
+
+        self._abspath = None
+        self._messages = None
+        self._offsets = None
+        if buf is not None:
+            self._offsets = list(iter_grib_messages(buf))
+            view = memoryview(buf)
+            self._messages = [view[start:end] for start, end in self._offsets]
+        else:
+            self._abspath = os.path.abspath(fname)
+        self._grbs = None
+        self._index = None
+        self._nmsgs = None
+
+    @classmethod
+    def frombuffer(cls, buf):
+        """Access the GRIB messages held in memory in *buf*"""
+
+        return cls(buf=buf)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *args):
+        self.close()
+
+    def open(self):
+        """Open the file and build the message index"""
+
+        if self._index is None:
+            if self._messages is None:
+                import pygrib
+                self._grbs = pygrib.open(self._abspath)
+            self._build_index()
+        return self
+
+    def close(self):
+        """Close the file handle"""
+
+        if self._grbs is not None:
+            self._grbs.close()
+            self._grbs = None
+            self._index = None
+
+    def _iter_messages(self):
+        """Iterate over the messages, without decoding the data values"""
+
+        import pygrib
+
+        if self._messages is not None:
+            for msg in self._messages:
+                yield pygrib.fromstring(msg.tobytes())
+        else:
+            self._grbs.seek(0)
+            for grb in self._grbs:
+                yield grb
+
+    def _message(self, mnbr):
+        """Get message number *mnbr* (starting at 1)"""
+
+        import pygrib
+
+        if self._messages is not None:
+            return pygrib.fromstring(self._messages[mnbr - 1].tobytes())
+        return self._grbs.message(mnbr)
+
+    def _message_size(self, mnbr):
+        """Length in bytes of message number *mnbr*, if in memory"""
+
+        if self._messages is not None:
+            return len(self._messages[mnbr - 1])
+        return 0
+
+    def _build_index(self):
+        """Map parameter names to message numbers, reading each header once"""
+
+        self._index = {}
+        nmsgs = 0
+        for grb in self._iter_messages():
+            nmsgs = nmsgs + 1
+            name = grb['parameterName']
+            if name not in self._index:
+                self._index[name] = nmsgs
+        self._nmsgs = nmsgs
+
+    @property
+    def index(self):
+        """Parameter name to message number mapping"""
+
+        self.open()
+        return self._index
+
+    @property
+    def nmsgs(self):
+        '''Number of GRIB messages in file.
+        '''
+
+        self.open()
+        return self._nmsgs
+
+    def _message_number(self, gmessage):
+        """Get the message number of a message number or parameter name"""
+
+        if isinstance(gmessage, int):
+            return gmessage
+
+        mnbr = self.index.get(gmessage)
+        if mnbr is None:
+            LOG.debug("No Grib message found with parameter name = %s",
+                      gmessage)
+        return mnbr
+
+    def message_span(self, gmessage):
+        """Get the (start, end) byte offsets in the buffer of a message number
+        or parameter name, or None if not found or not read from a buffer"""
+
+        mnbr = self._message_number(gmessage)
+        if mnbr is None or self._offsets is None:
+            return None
+        return self._offsets[mnbr - 1]
+
+    def get(self, gmessage, key='values'):
+        '''
+        Returns the value for the 'key' for a given message number 'gmessage' or
+        message field name 'gmessage'.
+        '''
+
+        mnbr = self._message_number(gmessage)
+        if mnbr is None:
+            return None
+
+        grb = self._message(mnbr)
+        if grb.valid_key(key):
+            with measure('decode', field=str(gmessage)) as stage:
+                stage.read(self._message_size(mnbr))
+                return grb[key]
+
+    def get_many(self, names, key='values'):
+        """Returns a dict with the value for the 'key' of each of the messages
+        in 'names', decoded in one sweep through the file. Messages not found
+        get the value None.
+        """
+
+        result = dict((name, None) for name in names)
+        result.update(self.iter_many(names, key))
+        return result
+
+    def iter_many(self, names, key='values'):
+        """Yield (name, value) for the 'key' of each of the messages in
+        'names' found, decoded one at a time in one sweep through the file.
+        """
+
+        wanted = {}
+        for name in names:
+            mnbr = self._message_number(name)
+            if mnbr is not None:
+                wanted[mnbr] = name
+
+        for mnbr, grb in enumerate(self._iter_messages(), 1):
+            if not wanted:
+                break
+            name = wanted.pop(mnbr, None)
+            if name is not None and grb.valid_key(key):
+                with measure('decode', field=name) as stage:
+                    stage.read(self._message_size(mnbr))
+                    value = grb[key]
+                yield name, value
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <a000680@c20671.ad.smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""LRIT segment headers and incremental assembly of the OCA GRIB stream
+"""
+
+import os
+import io
+import struct
+import logging
+from datetime import datetime, timedelta
+
+from .grib import iter_grib_messages
+
+LOG = logging.getLogger(__name__)
+
+
+LRIT_PATTERN = "L-000-{platform_name:_<5s}_-MPEF________-OCAE_____-{segment:_<9s}-{nominal_time:%Y%m%d%H%M}-{compressed:_<2s}"
+
+# LRIT header record types
+PRIMARY_HEADER = 0
+IMAGE_STRUCTURE = 1
+ANNOTATION = 4
+TIMESTAMP = 5
+SEGMENT_IDENTIFICATION = 128
+
+CDS_EPOCH = datetime(1958, 1, 1)
+
+
+def read_lrit_header(fpt):
+    """Parse the primary and secondary headers of the LRIT file open in *fpt*.
+    The file position is left at the start of the data field"""
+
+    primary = fpt.read(16)
+    if len(primary) < 16:
+        raise IOError('Truncated LRIT primary header')
+    (hdr_type, rec_len, file_type,
+     header_length, data_bits) = struct.unpack('>BHBIQ', primary)
+    if hdr_type != PRIMARY_HEADER or rec_len != 16:
+        raise IOError('Not an LRIT file: bad primary header')
+
+    header = {'file_type': file_type,
+              'header_length': header_length,
+              'data_length': data_bits // 8}
+
+    secondary = fpt.read(header_length - 16)
+    pos = 0
+    while pos + 3 <= len(secondary):
+        rec_type, rec_len = struct.unpack_from('>BH', secondary, pos)
+        if rec_len < 3:
+            break
+        record = secondary[pos + 3:pos + rec_len]
+        if rec_type == ANNOTATION:
+            header['annotation'] = record.decode('ascii', 'replace').strip()
+        elif rec_type == TIMESTAMP and len(record) >= 7:
+            days, msecs = struct.unpack_from('>HI', record, 1)
+            header['timestamp'] = CDS_EPOCH + timedelta(days=days,
+                                                        milliseconds=msecs)
+        elif rec_type == SEGMENT_IDENTIFICATION and len(record) >= 9:
+            (header['spacecraft_id'], header['channel_id'],
+             header['segment'], header['planned_start_segment'],
+             header['planned_end_segment']) = struct.unpack_from('>HBHHH',
+                                                                 record)
+        pos = pos + rec_len
+
+    return header
+
+
+def read_segment_info(filename):
+    """Get the LRIT header of the segment file *filename*, completed with the
+    platform, segment number and nominal time from the file name"""
+
+    from trollsift import parser
+
+    with io.open(filename, 'rb') as fpt:
+        header = read_lrit_header(fpt)
+
+    res = parser.Parser(LRIT_PATTERN).parse(os.path.basename(filename))
+    header.setdefault('segment', int(res['segment'].strip('_')))
+    header['platform_name'] = res['platform_name'].strip('_')
+    header['nominal_time'] = res['nominal_time']
+    header['filename'] = filename
+    return header
+
+
+def read_segment_data(filename, header=None, out=None):
+    """Read the data field of the LRIT segment *filename*. If *out* is given
+    the data are read into it and the number of bytes read is returned"""
+
+    with io.open(filename, 'rb') as fpt:
+        if header is None:
+            header = read_lrit_header(fpt)
+        else:
+            fpt.seek(header['header_length'])
+        if out is not None:
+            return fpt.readinto(out)
+        return fpt.read(header['data_length'])
+
+
+def check_segments(headers):
+    """Check that the LRIT segment *headers*, sorted by segment number, are
+    the complete and contiguous set planned in the headers (or, without the
+    segment identification record, have no gaps). Raises IOError
+    otherwise"""
+
+    if not headers:
+        raise IOError('No LRIT segments')
+    numbers = [header['segment'] for header in headers]
+    first = headers[0].get('planned_start_segment', numbers[0])
+    last = headers[0].get('planned_end_segment', numbers[-1])
+    missing = sorted(set(range(first, last + 1)) - set(numbers))
+    if missing:
+        raise IOError('Missing LRIT segments %s of %d to %d' %
+                      (', '.join(str(num) for num in missing), first, last))
+
+
+def read_stream_range(segments, start, end):
+    """Read bytes *start* to *end* of the stream made of the data fields of
+    the LRIT *segments* (headers as from read_segment_info, in stream order)
+    straight from the segment files, without assembling the stream"""
+
+    out = bytearray(end - start)
+    view = memoryview(out)
+    offset = 0
+    for header in segments:
+        size = header['data_length']
+        first = max(start, offset)
+        last = min(end, offset + size)
+        if first < last:
+            with io.open(header['filename'], 'rb') as fpt:
+                fpt.seek(header['header_length'] + first - offset)
+                nbytes = fpt.readinto(view[first - start:last - start])
+            if nbytes != last - first:
+                raise IOError('Short read of LRIT segment %s' %
+                              header['filename'])
+        offset = offset + size
+        if offset >= end:
+            break
+    if offset < end:
+        raise IOError('Bytes %d to %d are beyond the LRIT segments' %
+                      (start, end))
+    return out
+
+
+class SegmentAssembler(object):
+
+    """Incremental assembly of the GRIB stream of one OCA slot. Segments can be
+    added in any order, and the GRIB messages that are complete in the
+    contiguous prefix of the stream are decoded as soon as they arrive"""
+
+    def __init__(self, nsegments=None, first_segment=1):
+        self.nsegments = nsegments
+        self.buffer = bytearray()
+        self.fields = {}
+        self.timeslot = None
+        self.platform_name = None
+        self.filenames = []
+        self._next_segment = first_segment
+        self._pending = {}
+        self._offset = 0
+
+    @property
+    def complete(self):
+        """True when all the planned segments are in the contiguous prefix"""
+
+        if self.nsegments is None:
+            return False
+        return self._next_segment > self.nsegments and not self._pending
+
+    def add(self, filename):
+        """Add the LRIT segment *filename*. Returns the parameter names of the
+        GRIB messages that could be decoded thanks to this segment"""
+
+        if os.path.basename(filename).find('PRO') > 0:
+            LOG.debug("PRO file... %s: Skip it...", filename)
+            return []
+
+        header = read_segment_info(filename)
+        if self.timeslot is None:
+            self.timeslot = header['nominal_time']
+            self.platform_name = header['platform_name']
+        if self.nsegments is None and 'planned_end_segment' in header:
+            self.nsegments = header['planned_end_segment']
+        self.filenames.append(filename)
+
+        return self.add_segment(header['segment'],
+                                read_segment_data(filename, header))
+
+    def add_segment(self, segment, payload):
+        """Add the data field *payload* of segment number *segment*"""
+
+        if segment < self._next_segment or segment in self._pending:
+            LOG.debug("Segment %d already added: Skip it...", segment)
+            return []
+
+        self._pending[segment] = payload
+        while self._next_segment in self._pending:
+            self.buffer.extend(self._pending.pop(self._next_segment))
+            self._next_segment = self._next_segment + 1
+
+        return self._decode_available()
+
+    def _decode_available(self):
+        """Decode the GRIB messages completed since the last call"""
+
+        import pygrib
+
+        names = []
+        for start, end in iter_grib_messages(self.buffer, self._offset):
+            grb = pygrib.fromstring(bytes(self.buffer[start:end]))
+            name = grb['parameterName']
+            if name not in self.fields:
+                self.fields[name] = grb['values']
+                names.append(name)
+            self._offset = end
+        return names
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <a000680@c20671.ad.smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Per stage timing and throughput metrics. Each measured stage gives a
+record with its wall and CPU time, bytes read and written, and the resident
+memory of the process at its end and its growth during the stage. The
+records are logged as JSON at DEBUG level on the 'mpef_oca.metrics'
+logger, and summed per stage, area and field in a registry that can be
+written as a Prometheus text file (e.g. for the node exporter textfile
+collector). The records made by pool tasks are sent back to the parent
+with the task results, see capture and drain.
+
+Measuring is a couple of system calls per stage. It is switched off with
+the environment variable MPEF_OCA_METRICS=0
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import resource
+import threading
+from contextlib import contextmanager
+
+LOG = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('MPEF_OCA_METRICS', '1') != '0'
+
+PREFIX = 'mpef_oca'
+LABELS = ['stage', 'area', 'field']
+
+#: The scene tag and captured records of the task running in each thread
+_LOCAL = threading.local()
+
+
+def current_rss():
+    """Get the resident set size of this process, in bytes. Where there is
+    no /proc, this falls back to the peak over the process lifetime"""
+
+    try:
+        with open('/proc/self/statm') as fpt:
+            pages = int(fpt.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        # Peak RSS, in kilobytes on Linux and bytes on Mac OS X
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            return maxrss
+        return maxrss * 1024
+
+
+def cpu_time():
+    """Get the CPU time (user and system) used by this process so far"""
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def file_size(filename):
+    """Size of *filename* in bytes, or 0 if it can't be stat'ed"""
+
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+
+def set_scene(key):
+    """Tag the records made in this thread with the scene *key*"""
+
+    _LOCAL.scene = key
+
+
+def get_scene():
+    return getattr(_LOCAL, 'scene', None)
+
+
+class Stage(object):
+
+    """A running stage measurement. Bytes read and written are added with
+    read() and written()"""
+
+    def __init__(self, stage, **labels):
+        self.record = {'stage': stage,
+                       'scene': get_scene(),
+                       'bytes_read': 0,
+                       'bytes_written': 0}
+        self.record.update(labels)
+        self._tic = time.time()
+        self._cpu = cpu_time()
+        self._rss = current_rss()
+
+    def read(self, nbytes):
+        self.record['bytes_read'] = self.record['bytes_read'] + (nbytes or 0)
+
+    def written(self, nbytes):
+        self.record['bytes_written'] = (self.record['bytes_written'] +
+                                        (nbytes or 0))
+
+    def stop(self):
+        """Finish the measurement and get the record"""
+
+        self.record['wall_time'] = time.time() - self._tic
+        self.record['cpu_time'] = cpu_time() - self._cpu
+        self.record['rss'] = current_rss()
+        self.record['rss_growth'] = self.record['rss'] - self._rss
+        self.record['pid'] = os.getpid()
+        self.record['time'] = time.time()
+        return self.record
+
+
+class _NoStage(object):
+
+    """Stand in for Stage when the metrics are off"""
+
+    record = None
+
+    def read(self, nbytes):
+        pass
+
+    def written(self, nbytes):
+        pass
+
+
+@contextmanager
+def measure(stage, **labels):
+    """Measure the code in the with block as the stage *stage*, with the
+    extra *labels* (e.g. area and field) in the record. The stage is
+    recorded also if the block raises"""
+
+    if not ENABLED:
+        yield _NoStage()
+        return
+
+    running = Stage(stage, **labels)
+    try:
+        yield running
+    finally:
+        add(running.stop())
+
+
+def add(record):
+    """Log the *record*, add it to the registry, and keep it for drain if
+    this thread is capturing"""
+
+    LOG.debug(json.dumps(record, sort_keys=True, default=str))
+    REGISTRY.add(record)
+    captured = getattr(_LOCAL, 'captured', None)
+    if captured is not None:
+        captured.append(record)
+
+
+def merge(records):
+    """Add the *records* made in another process to the registry"""
+
+    for record in records or []:
+        REGISTRY.add(record)
+
+
+def capture(scene=None):
+    """Start keeping the records made in this thread (e.g. by a pool task
+    about the scene *scene*), for drain. Tasks running in other threads
+    keep their own records"""
+
+    _LOCAL.captured = []
+    set_scene(scene)
+
+
+def drain():
+    """Stop capturing in this thread, and get the records made since
+    capture"""
+
+    records = getattr(_LOCAL, 'captured', None) or []
+    _LOCAL.captured = None
+    set_scene(None)
+    return records
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+class Registry(object):
+
+    """Sums of the stage records, per stage, area and field"""
+
+    COUNTERS = [('wall_time', 'seconds_total',
+                 'Wall time spent in the stage'),
+                ('cpu_time', 'cpu_seconds_total',
+                 'CPU time spent in the stage'),
+                ('bytes_read', 'read_bytes_total',
+                 'Bytes read by the stage'),
+                ('bytes_written', 'written_bytes_total',
+                 'Bytes written by the stage')]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+        self._last = {}
+        self._rss = {}
+        self._rss_growth = {}
+
+    def add(self, record):
+        key = tuple(record.get(label) or '' for label in LABELS)
+        with self._lock:
+            totals = self._totals.setdefault(
+                key, dict((name, 0) for name, _, _ in self.COUNTERS + [
+                    ('count', None, None)]))
+            for name, _, _ in self.COUNTERS:
+                totals[name] = totals[name] + record.get(name, 0)
+            totals['count'] = totals['count'] + 1
+            self._last[key] = record.get('wall_time', 0)
+            self._rss[key] = record.get('rss', 0)
+            self._rss_growth[key] = record.get('rss_growth', 0)
+
+    def _series(self, name, key, value):
+        labels = ','.join('%s="%s"' % (label, _escape(val))
+                          for label, val in zip(LABELS, key) if val)
+        return '%s_stage_%s{%s} %s' % (PREFIX, name, labels, repr(value))
+
+    def text(self):
+        """Get the metrics in the Prometheus text format"""
+
+        with self._lock:
+            keys = sorted(self._totals)
+            lines = []
+            metrics = [(name, suffix, doc, 'counter')
+                       for name, suffix, doc in self.COUNTERS]
+            metrics.append(('count', 'runs_total',
+                            'Number of runs of the stage', 'counter'))
+            for name, suffix, doc, kind in metrics:
+                lines.append('# HELP %s_stage_%s %s' % (PREFIX, suffix, doc))
+                lines.append('# TYPE %s_stage_%s %s' % (PREFIX, suffix,
+                                                        kind))
+                for key in keys:
+                    lines.append(self._series(suffix, key,
+                                              self._totals[key][name]))
+
+            for suffix, values, doc in [
+                    ('last_seconds', self._last,
+                     'Wall time of the last run of the stage'),
+                    ('rss_bytes', self._rss,
+                     'Resident memory of the process at the end of the last '
+                     'run of the stage'),
+                    ('rss_growth_bytes', self._rss_growth,
+                     'Growth of the resident memory of the process during '
+                     'the last run of the stage')]:
+                lines.append('# HELP %s_stage_%s %s' % (PREFIX, suffix, doc))
+                lines.append('# TYPE %s_stage_%s gauge' % (PREFIX, suffix))
+                for key in keys:
+                    lines.append(self._series(suffix, key, values[key]))
+
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, filename):
+        """Write the metrics to the Prometheus text file *filename*, under a
+        temporary name renamed in place, so the exporter never reads a
+        partial file"""
+
+        tmpname = os.path.join(os.path.dirname(filename),
+                               '.%s.%d' % (os.path.basename(filename),
+                                           os.getpid()))
+        with open(tmpname, 'w') as fpt:
+            fpt.write(self.text())
+        os.rename(tmpname, filename)
+
+
+REGISTRY = Registry()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <adam.dybbroe@smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""NetCDF output of the OCA scenes: int16 scale/offset packing, chunking
+adapted to the area and configurable zlib/shuffle filtering
+"""
+
+import os
+import math
+from datetime import datetime
+import numpy as np
+
+from .utils import OCA_FIELDS, FIELDNAMES, NETCDF_PACKING, FieldEncoding
+from .metrics import measure, file_size
+
+EPOCH = datetime(1970, 1, 1)
+
+#: Storage of the fields written without packing
+UNPACKED = FieldEncoding(np.float32, fill_value=-999.)
+
+
+def chunk_shape(shape, max_chunk=512):
+    """Get chunk sizes for an array of *shape*, splitting each dimension in
+    as few equal chunks of at most *max_chunk* elements as possible"""
+
+    chunks = []
+    for size in shape:
+        nchunks = int(math.ceil(size / float(max_chunk)))
+        chunks.append(int(math.ceil(size / float(nchunks))))
+    return tuple(chunks)
+
+
+def field_metadata(field):
+    """Get the OCA_FIELDS entries of the value and error parameters of
+    *field*"""
+
+    params = []
+    for name in FIELDNAMES[field]:
+        if name:
+            params.append([s for s in OCA_FIELDS if name in s][0])
+        else:
+            params.append(None)
+    return params
+
+
+def get_packing(field, attr):
+    """Get the NetCDF packing of the array *attr* of *field*"""
+
+    return NETCDF_PACKING.get((field, attr), UNPACKED)
+
+
+def write_netcdf(scene, filename, zlib=True, complevel=4, shuffle=True,
+                 chunksizes=None, packing=True):
+    """Write the data and error fields of the projected OCAData *scene* to
+    *filename*. With *packing* the fields are stored as int16 with scale
+    factor and offset. Fields are written one at a time, so that only one
+    field's encoded buffer is held; fields not loaded in *scene* are read for
+    the writing only. The file is written under a temporary name and renamed
+    in place"""
+
+    with measure('write', area=scene.area_def.area_id) as stage:
+        _write_netcdf(scene, filename, zlib, complevel, shuffle, chunksizes,
+                      packing)
+        stage.written(file_size(filename))
+
+
+def _write_netcdf(scene, filename, zlib, complevel, shuffle, chunksizes,
+                  packing):
+    from netCDF4 import Dataset
+
+    area_def = scene.area_def
+    nlines, ncols = area_def.shape
+    if chunksizes is None:
+        chunksizes = chunk_shape(area_def.shape)
+
+    tmpname = os.path.join(os.path.dirname(filename),
+                           '.' + os.path.basename(filename))
+    nc_ = Dataset(tmpname, 'w', format='NETCDF4')
+    try:
+        nc_.Conventions = 'CF-1.6'
+        nc_.title = 'MPEF OCA cloud parameters'
+        nc_.area_id = area_def.area_id
+        if scene.timeslot:
+            nc_.nominal_time = scene.timeslot.isoformat()
+
+        nc_.createDimension('y', nlines)
+        nc_.createDimension('x', ncols)
+
+        xmin, ymin, xmax, ymax = area_def.area_extent
+        xsize = (xmax - xmin) / ncols
+        ysize = (ymax - ymin) / nlines
+        var = nc_.createVariable('x', 'f8', ('x', ))
+        var[:] = xmin + xsize * (np.arange(ncols) + 0.5)
+        var.units = 'm'
+        var.standard_name = 'projection_x_coordinate'
+        var = nc_.createVariable('y', 'f8', ('y', ))
+        var[:] = ymax - ysize * (np.arange(nlines) + 0.5)
+        var.units = 'm'
+        var.standard_name = 'projection_y_coordinate'
+
+        var = nc_.createVariable('projection', 'i4')
+        var.proj4 = area_def.proj4_string
+
+        if scene.timeslot:
+            var = nc_.createVariable('time', 'f8')
+            var.units = 'seconds since 1970-01-01 00:00:00'
+            delta = scene.timeslot - EPOCH
+            var.assignValue(delta.days * 86400. + delta.seconds)
+
+        for field in FIELDNAMES.keys():
+            params = field_metadata(field)
+            for attr, param, name in zip(['data', 'error'], params,
+                                         FIELDNAMES[field]):
+                if param is None:
+                    continue
+                data = getattr(scene, field).fetch(attr)
+                if data is None:
+                    continue
+
+                if packing:
+                    encoding = get_packing(field, attr)
+                else:
+                    encoding = UNPACKED
+                varname = field if attr == 'data' else field + '_error'
+                var = nc_.createVariable(varname, encoding.dtype, ('y', 'x'),
+                                         zlib=zlib, complevel=complevel,
+                                         shuffle=shuffle,
+                                         chunksizes=chunksizes,
+                                         fill_value=encoding.fill_value)
+                var.set_auto_maskandscale(False)
+                if encoding.scaled:
+                    var.scale_factor = encoding.scale_factor or 1.
+                    var.add_offset = encoding.add_offset or 0.
+                var.long_name = param[name]
+                if param.get('units'):
+                    var.units = param['units']
+                if 'abbrev' in param:
+                    var.short_name = param['abbrev']
+                var.grid_mapping = 'projection'
+
+                stored = encoding.encode(data, varname)
+                del data
+                var[:] = stored
+                del stored
+    finally:
+        nc_.close()
+
+    os.rename(tmpname, filename)
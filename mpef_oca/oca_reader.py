@@ -23,127 +23,173 @@
 """Reader for the OCA products
 """
 
-"""
-How to gather the LRIT files and skip the header:
-
-for file in `ls /disk2/testdata/OCA/L-000-MSG3__-MPEF________-OCAE_____-0000??___-*-__`;do echo $file; dd if=$file bs=1c skip=103 >> tmp;done
-
-"""
+# How to gather the LRIT files and skip the header:
+#
+# for file in \
+#   `ls /disk2/testdata/OCA/L-000-MSG3__-MPEF________-OCAE_____-0000??___-*-__`
+# do echo $file; dd if=$file bs=1c skip=103 >> tmp; done
 
 import os
-import pygrib
+import io
+import logging
 import numpy as np
 import os.path
-from glob import glob
-import tempfile
-import pyresample as pr
-from trollsift import parser
-from mpop.imageo import geo_image
-from mpop.imageo import palettes
+import multiprocessing
+from functools import partial
+from multiprocessing.pool import ThreadPool
+from multiprocessing.sharedctypes import RawArray
 
+from .areas import (CFG_DIR,  # noqa: F401, kept for compatibility
+                    AREA_DEF_FILE, FULL_DISK, load_area, load_areas)
+from .grib import Grib, decode_into
+from .metrics import measure
+from .resample import get_resampler, crop_area
+from .geoloc import get_geolocation
+from .points import get_point_index, extract
+from .lrit import (LRIT_PATTERN,  # noqa: F401, kept for compatibility
+                   read_segment_info, read_segment_data, check_segments)
+from .utils import (OCA_FIELDS, FIELDNAMES,
+                    PackedArray, get_encoding,
+                    PALETTE_FUNCS, get_palette, palette_index)
 
-CFG_DIR = os.environ.get('MPEF_OCA_CONFIG_DIR', './')
-AREA_DEF_FILE = os.path.join(CFG_DIR, "areas.def")
-if not os.path.exists(AREA_DEF_FILE):
-    raise IOError('Config file %s does not exist!' % AREA_DEF_FILE)
 
+LOG = logging.getLogger(__name__)
 
-LRIT_PATTERN = "L-000-{platform_name:_<5s}_-MPEF________-OCAE_____-{segment:_<9s}-{nominal_time:%Y%m%d%H%M}-{compressed:_<2s}"
+palette_func = PALETTE_FUNCS
 
-from .utils import (SCENE_TYPE_LAYERS, OCA_FIELDS, FIELDNAMES,
-                    get_reff_legend,
-                    get_cot_legend,
-                    get_scenetype_legend,
-                    get_ctp_legend)
+#: The GRIB stream and output buffers of the decoding processes, see
+#: OCAData._load_parallel
+_DECODER = {}
 
 
-palette_func = {'ll_ctp': get_ctp_legend,
-                'ul_ctp': get_ctp_legend,
-                'ul_cot': get_cot_legend,
-                'll_cot': get_cot_legend,
-                'reff': get_reff_legend,
-                'scenetype': get_scenetype_legend}
+def _init_decoder(gribbuffer, outputs, shape, window):
+    _DECODER.update(buffer=gribbuffer, outputs=outputs, shape=shape,
+                    window=window)
 
 
-class Grib(object):
+def _shared_arrays(data, mask, shape):
+    """Numpy views of the shared *data* and *mask* buffers"""
 
-    def __init__(self, fname):
+    return (np.frombuffer(data, np.float64).reshape(shape),
+            np.frombuffer(mask, np.bool_).reshape(shape))
 
-        self._abspath = os.path.abspath(fname)
 
-    @property
-    def nmsgs(self):
-        '''Number of GRIB messages in file.
-        '''
-
-        prop = 'nmsgs'
-        attr = '_{}'.format(prop)
-
-        if not hasattr(self, attr):
-            grbs = pygrib.open(self._abspath)
-            nmsgs = grbs.messages
-            grbs.close()
-
-            setattr(self, attr, nmsgs)
-
-        return getattr(self, attr)
-
-    def get(self, gmessage, key='values'):
-        '''
-        Returns the value for the 'key' for a given message number 'gmessage' or
-        message field name 'gmessage'.
-        '''
-
-        grbs = pygrib.open(self._abspath)
-
-        if type(gmessage) == int:
-            mnbr = gmessage
-        elif type(gmessage) == str:
-            msg_found = False
-            msgnum = 1
-            while msgnum < self.nmsgs + 1:
-                if grbs[msgnum]['parameterName'] == gmessage:
-                    msg_found = True
-                    break
-                msgnum = msgnum + 1
-
-            if msg_found:
-                mnbr = msgnum
-            else:
-                print("No Grib message found with parameter name = %s" %
-                      gmessage)
-                return None
+def _decode_shared(task):
+    """Decode the message *name*, at bytes *start* to *end* of the GRIB
+    stream, into its shared output buffers. *task* is (name, start, end)"""
 
-        if grbs[mnbr].valid_key(key):
-
-            arr = grbs[mnbr][key]
-            grbs.close()
-            return arr
-        else:
-            grbs.close()
-            return
+    name, start, end = task
+    data, mask = _shared_arrays(*_DECODER['outputs'][name],
+                                shape=_DECODER['shape'])
+    view = memoryview(_DECODER['buffer'])[start:end]
+    return name, decode_into(view, data, mask, _DECODER['window'])
 
 
 class OCAField(object):
 
-    """One OCA data field with metadata"""
+    """One OCA data field with metadata. The data and error arrays can be
+    given a loader, so that they are only read on first access. They can be
+    held in a compact storage type (utils.PackedArray), in which case the
+    data and error properties return the physical values and stored() the
+    stored array"""
 
     def __init__(self, units=None, longname='', shortname=''):
         self.units = units
-        self.data = None
-        self.error = None
+        self._data = None
+        self._error = None
+        self._loaders = {}
         self.longname = None
         self.shortname = None
 
+    def set_loader(self, attr, loader):
+        """Set the callable *loader* returning the array *attr* ('data' or
+        'error') when it is first accessed"""
+
+        self._loaders[attr] = loader
+
+    def loaded(self, attr='data'):
+        """Check whether the array *attr* is in memory (or not available)"""
+
+        return attr not in self._loaders
+
+    def load(self):
+        """Load the data and error arrays not yet loaded"""
+
+        for attr in list(self._loaders.keys()):
+            getattr(self, attr)
+
+    def stored(self, attr='data'):
+        """Get the array *attr* as stored, without converting a PackedArray to
+        physical values"""
+
+        loader = self._loaders.pop(attr, None)
+        if loader is not None:
+            setattr(self, '_' + attr, loader())
+        return getattr(self, '_' + attr)
+
+    def fetch(self, attr='data'):
+        """Get the physical values of the array *attr*. If it is not loaded, it
+        is read but not kept in memory"""
+
+        loader = self._loaders.get(attr)
+        if loader is not None:
+            value = loader()
+        else:
+            value = getattr(self, '_' + attr)
+        if isinstance(value, PackedArray):
+            return value.physical()
+        return value
+
+    def _get(self, attr):
+        value = self.stored(attr)
+        if isinstance(value, PackedArray):
+            return value.physical()
+        return value
+
+    def _set(self, attr, value):
+        self._loaders.pop(attr, None)
+        setattr(self, '_' + attr, value)
+
+    @property
+    def data(self):
+        """The data array"""
+        return self._get('data')
+
+    @data.setter
+    def data(self, value):
+        self._set('data', value)
+
+    @property
+    def error(self):
+        """The error array"""
+        return self._get('error')
+
+    @error.setter
+    def error(self, value):
+        self._set('error', value)
+
+
+def _project_lazy(resampler, field, attr):
+    """Project the array *attr* of *field*, for a lazy loader"""
+
+    value = getattr(field, attr)
+    if value is None:
+        return None
+    with measure('resample', area=resampler.target_area.area_id,
+                 field=field.shortname):
+        return resampler.resample(value)
+
 
 class OCAData(object):
 
     """The OCA scene data"""
 
-    def __init__(self):
+    def __init__(self, area_def=None, compact=False, scaled=False):
         self._lritfiles = None
+        self._segments = None
         self._gribfilename = None
-        self._store_grib = False
+        self._gribbuffer = None
+        self._grib = None
 
         self.scenetype = OCAField()
         self.cost = OCAField()
@@ -157,19 +203,193 @@ class OCAData(object):
             self._projectables.append(field)
 
         self.timeslot = None
-        self.area_def = pr.utils.load_area(AREA_DEF_FILE, 'met09globeFull')
+        if area_def is None:
+            area_def = load_area(FULL_DISK)
+        self.area_def = area_def
+        self._grid_area_def = area_def
+        self._window = None
+        self._compact = compact or scaled
+        self._scaled = scaled
+
+    def readgrib(self, area_ids=None):
+        """Read the data. The GRIB messages are indexed, and each field is only
+        decoded on first access (or by load). If *area_ids* are given, only
+        the window of the full disk needed to project to those areas is
+        kept"""
+
+        if area_ids:
+            self._set_window(area_ids)
+
+        if self._gribbuffer is not None:
+            grib = Grib.frombuffer(self._gribbuffer)
+        else:
+            grib = Grib(self._gribfilename)
+
+        self._set_fields(grib.open())
+
+    def load(self, fields=None, nprocs=None):
+        """Decode the data and error arrays of *fields* (default all) not yet
+        loaded, in one sweep through the GRIB messages. With *nprocs*, and
+        the messages in memory, the messages are decoded concurrently, see
+        _load_parallel"""
+
+        if fields is None:
+            fields = self._projectables
+
+        pending = {}
+        for item in fields:
+            field = getattr(self, item)
+            for attr, name in zip(['data', 'error'], FIELDNAMES[item]):
+                if name and not field.loaded(attr):
+                    pending[name] = (item, attr)
+
+        if (self._grib is not None and pending and nprocs and nprocs > 1 and
+                self._gribbuffer is not None):
+            if multiprocessing.current_process().daemon:
+                LOG.debug("Daemonic process, decoding serially")
+            else:
+                self._load_parallel(pending, nprocs)
+                pending = {}
+
+        if self._grib is not None and pending:
+            for name, value in self._grib.iter_many(list(pending.keys())):
+                item, attr = pending[name]
+                setattr(getattr(self, item), attr,
+                        self._store(item, attr, value))
+
+        for item in fields:
+            getattr(self, item).load()
+
+    def _load_parallel(self, pending, nprocs):
+        """Decode the messages *pending* (parameter name to (field, attr)) in
+        a pool of *nprocs* processes, each straight into a preallocated,
+        flipped, cropped and contiguous array in shared memory. The GRIB
+        stream is inherited by the workers, and pygrib still allocates the
+        full disk array of each message it decodes"""
+
+        shape = self.area_def.shape
+        size = shape[0] * shape[1]
+        spans = {}
+        outputs = {}
+        for name in pending:
+            span = self._grib.message_span(name)
+            if span is not None:
+                spans[name] = span
+                outputs[name] = (RawArray('d', size), RawArray('b', size))
+
+        with measure('decode', field='parallel') as stage:
+            stage.read(sum(end - start for start, end in spans.values()))
+            pool = multiprocessing.Pool(min(nprocs, max(len(spans), 1)),
+                                        _init_decoder,
+                                        (self._gribbuffer, outputs, shape,
+                                         self._window))
+            try:
+                results = pool.map(_decode_shared,
+                                   [(name, start, end)
+                                    for name, (start, end) in spans.items()])
+            finally:
+                pool.close()
+                pool.join()
+
+        for name, masked in results:
+            item, attr = pending[name]
+            data, mask = _shared_arrays(*outputs[name], shape=shape)
+            if masked:
+                data = np.ma.masked_array(data, mask)
+            setattr(getattr(self, item), attr,
+                    self._compacted(item, attr, data))
+
+    def close(self):
+        """Release the GRIB messages. Fields not loaded so far are dropped"""
+
+        if self._grib is not None:
+            self._grib.close()
+            self._grib = None
+        self._gribbuffer = None
+        for item in self._projectables:
+            field = getattr(self, item)
+            for attr in ['data', 'error']:
+                if not field.loaded(attr):
+                    setattr(field, attr, None)
+
+    def _load_message(self, item, attr, name):
+        """Decode the GRIB message with parameter name *name*, for the array
+        *attr* of the field *item*"""
+
+        return self._store(item, attr, self._grib.get(name))
+
+    def _store(self, item, attr, arr):
+        """Get the decoded GRIB array *arr* of the field *item* as it is to be
+        held in memory: flipped, cropped and possibly compact"""
+
+        return self._compacted(item, attr, self._crop(arr))
+
+    def _compacted(self, item, attr, arr):
+        """Get the flipped and cropped array *arr* of the field *item* as it
+        is to be held in memory, possibly compact"""
+
+        if arr is None or not self._compact:
+            return arr
+        return PackedArray(arr, get_encoding(item, attr, self._scaled))
+
+    def _set_window(self, area_ids):
+        """Restrict the scene to the smallest window of the full disk covering
+        the neighbours of all the areas *area_ids*"""
+
+        window = None
+        for area_def in self._load_areas(area_ids):
+            resampler = get_resampler(self._grid_area_def, area_def,
+                                      radius_of_influence=20000,
+                                      area_file=AREA_DEF_FILE)
+            win = resampler.source_window()
+            if win is None:
+                continue
+            if window is None:
+                window = win
+            else:
+                window = (slice(min(window[0].start, win[0].start),
+                                max(window[0].stop, win[0].stop)),
+                          slice(min(window[1].start, win[1].start),
+                                max(window[1].stop, win[1].stop)))
+
+        self._window = window
+        if window is None:
+            self.area_def = self._grid_area_def
+        else:
+            self.area_def = crop_area(self._grid_area_def, *window)
+
+    def _crop(self, arr):
+        """Flip the decoded GRIB array to the grid orientation and cut out the
+        window, if any"""
+
+        if arr is None:
+            return None
+        arr = arr[::-1, ::-1]
+        if self._window is None:
+            return arr
+        return arr[self._window].copy()
 
-    def readgrib(self):
-        """Read the data"""
+    def _set_fields(self, grib, values=None):
+        """Set the fields from the GRIB messages in *grib*. Fields already
+        decoded are taken from *values*, keyed by parameter name, the others
+        get a loader"""
 
-        oca = Grib(self._gribfilename)
-        self.scenetype.data = oca.get('Pixel scene type')[::-1, ::-1]
-        self.scenetype.longname = OCA_FIELDS[0]['Pixel scene type']
+        self._grib = grib
+        if values is None:
+            values = {}
 
         for field in FIELDNAMES.keys():
 
-            setattr(getattr(self, field), 'data', oca.get(
-                FIELDNAMES[field][0])[::-1, ::-1])
+            for attr, name in zip(['data', 'error'], FIELDNAMES[field]):
+                if not name:
+                    continue
+                if name in values:
+                    setattr(getattr(self, field), attr,
+                            self._store(field, attr, values[name]))
+                else:
+                    getattr(self, field).set_loader(
+                        attr, partial(self._load_message, field, attr, name))
+
             param = [s for s in OCA_FIELDS if FIELDNAMES[field][0] in s][0]
             if 'units' in param:
                 setattr(getattr(self, field), 'units', param['units'])
@@ -177,91 +397,210 @@ class OCAData(object):
                 setattr(getattr(self, field), 'shortname', param['abbrev'])
             setattr(getattr(self, field), 'longname',
                     param[FIELDNAMES[field][0]])
-            param_name = FIELDNAMES[field][1]
-            if param_name:
-                setattr(
-                    getattr(self, field), 'error', oca.get(param_name)[::-1, ::-1])
-
-        if not self._store_grib:
-            os.remove(self._gribfilename)
 
-    def read_from_lrit(self, filenames, gribfilename=None):
-        """Read and concatenate the LRIT segments"""
+    def read_from_lrit(self, filenames, gribfilename=None, area_ids=None):
+        """Read and concatenate the LRIT segments in memory and decode the GRIB
+        messages from there. The GRIB stream is written to *gribfilename* only
+        if it is given. With *area_ids*, only the window of the full disk
+        needed for these areas is kept. Raises IOError if segments are
+        missing or truncated"""
 
         self._lritfiles = filenames
 
         if len(filenames) == 0:
-            print("No files provided!")
+            LOG.warning("No files provided!")
             return
 
+        with measure('segments') as stage:
+            segments = {}
+            for lritfile in self._lritfiles:
+                if os.path.basename(lritfile).find('PRO') > 0:
+                    LOG.debug("PRO file... %s: Skip it...", lritfile)
+                    continue
+
+                header = read_segment_info(lritfile)
+                if not self.timeslot:
+                    self.timeslot = header['nominal_time']
+                LOG.debug("Segment = %d", header['segment'])
+                segments[header['segment']] = header
+
+            headers = [segments[segm] for segm in sorted(segments)]
+            check_segments(headers)
+            self._segments = headers
+            self._gribbuffer = bytearray(sum([hdr['data_length']
+                                              for hdr in headers]))
+            view = memoryview(self._gribbuffer)
+            offset = 0
+            for header in headers:
+                size = header['data_length']
+                nbytes = read_segment_data(header['filename'], header,
+                                           out=view[offset:offset + size])
+                if nbytes != size:
+                    raise IOError('Short read of LRIT segment %s: %d of %d '
+                                  'bytes' % (header['filename'], nbytes,
+                                             size))
+                offset = offset + size
+            stage.read(offset)
+
         if gribfilename:
-            self._store_grib = True
             self._gribfilename = gribfilename
-        else:
-            self._store_grib = False
-            self._gribfilename = tempfile.mktemp(suffix='.grb')
+            with io.open(self._gribfilename, 'wb') as fpt:
+                fpt.write(view)
 
-        p__ = parser.Parser(LRIT_PATTERN)
+        self.readgrib(area_ids)
 
-        bstr = {}
-        nsegments = 0
-        for lritfile in self._lritfiles:
-            if os.path.basename(lritfile).find('PRO') > 0:
-                print("PRO file... %s: Skip it..." % lritfile)
-                continue
+    def read_from_segments(self, assembler, area_ids=None):
+        """Take the fields already decoded by the lrit.SegmentAssembler
+        *assembler* as segments arrived. The other fields are decoded from a
+        copy of its buffer on first access, so the assembler can still be
+        added to (and its buffer resized) afterwards"""
 
-            res = p__.parse(os.path.basename(lritfile))
-            segm = int(res['segment'].strip('_'))
-            if not self.timeslot:
-                self.timeslot = res['nominal_time']
-            print("Segment = %d" % segm)
-            nsegments = nsegments + 1
+        if area_ids:
+            self._set_window(area_ids)
 
-            with open(lritfile) as fpt:
-                fpt.seek(103)
-                bstr[segm] = fpt.read()
+        self._lritfiles = assembler.filenames
+        self.timeslot = assembler.timeslot
 
-        fstr = bstr[1]
-        for idx in range(2, nsegments + 1):
-            fstr = fstr + bstr[idx]
+        self._gribbuffer = bytes(assembler.buffer)
+        self._set_fields(Grib.frombuffer(self._gribbuffer).open(),
+                         assembler.fields)
 
-        with open(self._gribfilename, 'wb') as fpt:
-            fpt.write(fstr)
+    def get_lonlats(self):
+        """Get the longitudes and latitudes of the scene area as float32 masked
+        arrays, from the shared geolocation cache"""
 
-        self.readgrib()
+        return get_geolocation(self.area_def, AREA_DEF_FILE).get_lonlats()
 
     def project(self, areaid):
-        """Project the data"""
-
-        lons, lats = self.area_def.get_lonlats()
-        lons = np.ma.masked_outside(lons, -180, 180)
-        lats = np.ma.masked_outside(lats, -90, 90)
-
-        swath_def = pr.geometry.SwathDefinition(lons, lats)
-
-        out_area_def = pr.utils.load_area(AREA_DEF_FILE, areaid)
+        """Project the data and error fields, in one go using the cached
+        neighbour lookup from the full disk to the area *areaid*"""
 
+        self.load()
+        scene = self.project_many([areaid])[0]
+        scene.load()
         for item in self._projectables:
-            data = getattr(getattr(self, item), 'data')
-            result = pr.kd_tree.resample_nearest(swath_def, data, out_area_def,
-                                                 radius_of_influence=20000,
-                                                 fill_value=None)
-            setattr(getattr(self, item), 'data', result)
-
-        self.area_def = out_area_def
+            field = getattr(self, item)
+            field.data = getattr(scene, item).data
+            field.error = getattr(scene, item).error
+
+        self.area_def = scene.area_def
+        self._grid_area_def = scene.area_def
+        self._window = None
+
+    def project_many(self, area_ids, nthreads=None):
+        """Project the data and error fields to each of the areas *area_ids*,
+        leaving this scene untouched. Returns one projected scene per area.
+        The fields loaded so far are projected together, the others are
+        projected on first access. With *nthreads* the areas are processed
+        concurrently"""
+
+        area_defs = self._load_areas(area_ids)
+
+        if nthreads and nthreads > 1 and len(area_defs) > 1:
+            pool = ThreadPool(min(nthreads, len(area_defs)))
+            try:
+                return pool.map(self._project_area, area_defs)
+            finally:
+                pool.close()
+                pool.join()
+
+        return [self._project_area(area_def) for area_def in area_defs]
+
+    @staticmethod
+    def _load_areas(area_ids):
+        """Get the area definitions of *area_ids*, from the registry"""
+
+        return load_areas(area_ids)
+
+    def _project_area(self, area_def):
+        """Make a new scene with the fields projected to *area_def*"""
+
+        resampler = get_resampler(self._grid_area_def, area_def,
+                                  radius_of_influence=20000,
+                                  area_file=AREA_DEF_FILE)
+        if self._window is not None:
+            resampler = resampler.cropped(*self._window)
+
+        scene = OCAData(area_def=area_def)
+        scene.timeslot = self.timeslot
+        scene._lritfiles = self._lritfiles
+
+        fields = []
+        arrays = []
+        encodings = []
+        for item in self._projectables:
+            source = getattr(self, item)
+            target = getattr(scene, item)
+            target.units = source.units
+            target.longname = source.longname
+            target.shortname = source.shortname
+            for attr in ['data', 'error']:
+                if not source.loaded(attr):
+                    target.set_loader(attr, partial(_project_lazy, resampler,
+                                                    source, attr))
+                elif source.stored(attr) is not None:
+                    value = source.stored(attr)
+                    fields.append((target, attr))
+                    if isinstance(value, PackedArray):
+                        arrays.append(value.masked())
+                        encodings.append(value.encoding)
+                    else:
+                        arrays.append(value)
+                        encodings.append(None)
+
+        if arrays:
+            with measure('resample', area=area_def.area_id):
+                results = resampler.resample_stack(arrays)
+            for (field, attr), result, encoding in zip(fields, results,
+                                                       encodings):
+                if encoding is not None:
+                    result = encoding.decode(result)
+                setattr(field, attr, result)
+
+        return scene
+
+    def extract_points(self, lons, lats, fields=None, ids=None):
+        """Get the values and errors of *fields* (default all) at the points
+        *lons*, *lats*, as a structured array with one row per point. The
+        mapping of the points to the grid is cached on disk per point list,
+        so each slot only costs a gather"""
+
+        index = get_point_index(self.area_def, lons, lats,
+                                area_file=AREA_DEF_FILE)
+        return extract(self, index, lons, lats, fields=fields, ids=ids)
+
+    def to_netcdf(self, filename, zlib=True, complevel=4, shuffle=True,
+                  chunksizes=None, packing=True):
+        """Write the data and error fields to the NetCDF file *filename*, see
+        netcdf.write_netcdf"""
+
+        from .netcdf import write_netcdf
+        write_netcdf(self, filename, zlib=zlib, complevel=complevel,
+                     shuffle=shuffle, chunksizes=chunksizes, packing=packing)
 
     def make_image(self, fieldname):
         """Make an mpop GeoImage image of the oca parameter 'fieldname'"""
 
-        palette = palette_func[fieldname]()
-        data = getattr(getattr(self, fieldname), 'data')
-        if fieldname in ['ul_ctp', 'll_ctp']:
-            data = (22. - data / 5000.).astype('Int16')
+        from mpop.imageo import geo_image
 
-        elif fieldname in ['reff']:
-            data = (data * 1000000. + 0.5).astype('uint8')
+        palette = get_palette(fieldname)
+        data = getattr(getattr(self, fieldname), 'data')
+        data = np.ma.masked_array(palette_index(fieldname, data),
+                                  np.ma.getmask(data))
 
         img = geo_image.GeoImage(data, self.area_def.area_id,
                                  self.timeslot, fill_value=(0), mode="P",
                                  palette=palette)
         return img
+
+
+def warm_up(area_ids):
+    """Load the full disk area, its geolocation and the neighbour lookups to
+    the areas *area_ids* into this process, so that the following scenes find
+    them in memory"""
+
+    full_area = load_area(FULL_DISK)
+    get_geolocation(full_area, AREA_DEF_FILE)
+    for area_def in OCAData._load_areas(area_ids):
+        get_resampler(full_area, area_def, radius_of_influence=20000,
+                      area_file=AREA_DEF_FILE).lookup()
@@ -0,0 +1,587 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <adam.dybbroe@smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Stage parallel processing of OCA scenes on a worker pool: the scene is
+decoded once, one GRIB message per task, projected per area, and rendered
+and written per field. The stages exchange the scenes through a spool
+directory of memory mappable arrays, and the stages of consecutive scenes
+overlap
+"""
+
+import os
+import time
+import shutil
+import pickle
+import logging
+import tempfile
+import threading
+from collections import deque
+import numpy as np
+
+from .utils import FIELDNAMES
+from .archive import output_prefix
+from .render import DEFAULT_FIELDS
+from . import metrics
+
+LOG = logging.getLogger(__name__)
+
+if os.path.isdir('/dev/shm'):
+    _DEFAULT_SPOOL = '/dev/shm'
+else:
+    _DEFAULT_SPOOL = tempfile.gettempdir()
+SPOOL_DIR = os.environ.get('MPEF_OCA_SPOOL_DIR', _DEFAULT_SPOOL)
+
+DECODE, PROJECT, WRITE = 'decode', 'project', 'write'
+
+FILE_FORMATS = {'.nc': 'netCDF',
+                '.tif': 'GeoTIFF',
+                '.png': 'PNG'}
+
+
+def _product(filename, tic, **info):
+    """Describe the product *filename*, written by a task started at *tic*"""
+
+    info['filename'] = filename
+    info['format'] = FILE_FORMATS.get(os.path.splitext(filename)[1],
+                                      'unknown')
+    info['written_at'] = time.time()
+    info['task_time'] = info['written_at'] - tic
+    return info
+
+
+def _measured(key, func, *args):
+    """Run the stage *func* in a pool worker, and return its result with the
+    metrics records made on the way"""
+
+    metrics.capture(key)
+    try:
+        result = func(*args)
+    finally:
+        records = metrics.drain()
+    return result, records
+
+
+def _scene_meta(scene):
+    """Description of the OCAData *scene*, without the arrays"""
+
+    meta = {'area_def': scene.area_def,
+            'grid_area_def': scene._grid_area_def,
+            'window': scene._window,
+            'timeslot': scene.timeslot,
+            'lritfiles': scene._lritfiles,
+            'fields': {}}
+    for item in FIELDNAMES.keys():
+        field = getattr(scene, item)
+        meta['fields'][item] = (field.units, field.longname, field.shortname)
+    return meta
+
+
+def save_scene(scene, path):
+    """Spool the OCAData *scene* to the directory *path*, one field at a
+    time"""
+
+    os.makedirs(path)
+    meta = _scene_meta(scene)
+
+    for item in FIELDNAMES.keys():
+        field = getattr(scene, item)
+        for attr in ['data', 'error']:
+            data = field.fetch(attr)
+            if data is None:
+                continue
+            name = os.path.join(path, '%s.%s' % (item, attr))
+            np.save(name + '.npy', np.ma.getdata(data))
+            if np.ma.getmask(data) is not np.ma.nomask:
+                np.save(name + '.mask.npy', np.ma.getmaskarray(data))
+
+    with open(os.path.join(path, 'scene.pickle'), 'wb') as fpt:
+        pickle.dump(meta, fpt, pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def _load_spooled(name):
+    """Memory map a spooled array and its mask"""
+
+    data = np.load(name + '.npy', mmap_mode='r')
+    if os.path.exists(name + '.mask.npy'):
+        return np.ma.masked_array(data, np.load(name + '.mask.npy',
+                                                mmap_mode='r'))
+    return data
+
+
+def load_scene(path):
+    """Get the OCAData scene spooled in *path*. The arrays are memory mapped
+    on first access"""
+
+    from .oca_reader import OCAData
+    from functools import partial
+
+    with open(os.path.join(path, 'scene.pickle'), 'rb') as fpt:
+        meta = pickle.load(fpt)
+
+    scene = OCAData(area_def=meta['area_def'])
+    scene._grid_area_def = meta['grid_area_def']
+    scene._window = meta['window']
+    scene.timeslot = meta['timeslot']
+    scene._lritfiles = meta['lritfiles']
+
+    for item, (units, longname, shortname) in meta['fields'].items():
+        field = getattr(scene, item)
+        field.units = units
+        field.longname = longname
+        field.shortname = shortname
+        for attr in ['data', 'error']:
+            name = os.path.join(path, '%s.%s' % (item, attr))
+            if os.path.exists(name + '.npy'):
+                field.set_loader(attr, partial(_load_spooled, name))
+
+    return scene
+
+
+def decode_stage(filenames, area_ids, path):
+    """Decode the LRIT segments *filenames*, keeping the window needed for
+    *area_ids*, and spool the scene to *path*"""
+
+    from .oca_reader import OCAData
+
+    scene = OCAData()
+    scene.read_from_lrit(filenames, area_ids=area_ids)
+    save_scene(scene, path)
+    scene.close()
+    return path
+
+
+def index_stage(filenames, area_ids, path):
+    """Read the LRIT segments *filenames*, keeping the window needed for
+    *area_ids*, and lay out the spool *path* for decoding the GRIB messages
+    in parallel. Only the scene description is spooled: each message is
+    read again from the segment files by its decode task. Returns *path*
+    and the decode_message_stage arguments of each message"""
+
+    from .oca_reader import OCAData
+
+    scene = OCAData()
+    scene.read_from_lrit(filenames, area_ids=area_ids)
+    os.makedirs(path)
+
+    tasks = []
+    for item in FIELDNAMES.keys():
+        for attr, name in zip(['data', 'error'], FIELDNAMES[item]):
+            span = scene._grib.message_span(name) if name else None
+            if span is None:
+                continue
+            prefix = os.path.join(path, '%s.%s' % (item, attr))
+            tasks.append((name, scene._segments, span[0], span[1], prefix,
+                          scene.area_def.shape, scene._window))
+
+    with open(os.path.join(path, 'scene.pickle'), 'wb') as fpt:
+        pickle.dump(_scene_meta(scene), fpt, pickle.HIGHEST_PROTOCOL)
+    scene.close()
+    return path, tasks
+
+
+def decode_message_stage(name, segments, start, end, prefix, shape, window):
+    """Decode the GRIB message *name*, at bytes *start* to *end* of the
+    stream in the LRIT *segments*, straight into a preallocated *prefix*.npy
+    file of *shape*, flipped to the grid orientation and cut to the *window*,
+    if any. The mask is spooled as *prefix*.mask.npy if there is one"""
+
+    from .grib import decode_into
+    from .lrit import read_stream_range
+
+    with metrics.measure('decode', field=name) as stage:
+        message = read_stream_range(segments, start, end)
+        stage.read(len(message))
+        data = np.lib.format.open_memmap(prefix + '.npy', mode='w+',
+                                         dtype=np.float64, shape=shape)
+        mask = np.empty(shape, bool)
+        masked = decode_into(message, data, mask, window)
+        data.flush()
+        del data
+        if masked:
+            np.save(prefix + '.mask.npy', mask)
+    return name
+
+
+def project_stage(scene_path, area_id, path):
+    """Project the spooled scene *scene_path* to *area_id*, and spool the
+    result to *path*"""
+
+    scene = load_scene(scene_path)
+    scene.load()
+    save_scene(scene.project_many([area_id])[0], path)
+    return path
+
+
+def netcdf_stage(scene_path, filename):
+    """Write the spooled projected scene *scene_path* to NetCDF. Returns the
+    list of products written"""
+
+    tic = time.time()
+    scene = load_scene(scene_path)
+    scene.to_netcdf(filename)
+    return [_product(filename, tic, area_id=scene.area_def.area_id,
+                     field=None)]
+
+
+def render_stage(scene_path, field, prefix, render_func=None):
+    """Render the *field* of the spooled projected scene *scene_path*. The
+    default *render_func* is render.render_field; it should write each file
+    atomically. Returns the list of products written"""
+
+    if render_func is None:
+        from .render import render_field as render_func
+    tic = time.time()
+    scene = load_scene(scene_path)
+    result = render_func(scene, field, prefix)
+    if not isinstance(result, (list, tuple)):
+        result = [result]
+    return [_product(filename, tic, area_id=scene.area_def.area_id,
+                     field=field) for filename in result]
+
+
+class _SceneJob(object):
+
+    """Book keeping of one scene in the pipeline"""
+
+    def __init__(self, key, scene, spool):
+        self.key = key
+        self.scene = scene
+        self.spool = spool
+        self.submitted = time.time()
+        self.pending = 0
+        self.running = {}
+        self.products = []
+        self.failed = False
+        self.timed_out = False
+        self.done = False
+        self.decoding = 0
+
+
+class ScenePipeline(object):
+
+    """Process scenes on *pool* (a WarmPool, or any pool with apply_async
+    taking callback and error_callback) as a pipeline of stages: decode once,
+    project per area, then write the NetCDF file and render each field. At
+    most *max_scenes* scenes are in the pipeline, so that stages of
+    consecutive scenes overlap; submit blocks when it is full. At most
+    *max_tasks* tasks per stage are on the pool at a time, the others wait
+    in the queue of their stage, the later stages being served first.
+
+    The stage queues are bounded by *max_queued* (default 4 * *max_tasks*)
+    tasks: no task of a stage is started while the queue of the next stage
+    is full, and submit waits while the decode queue is full (see full).
+    Called from a pipeline callback, such as on_scene, submit does not wait
+    for the queue, as that would hold up the results draining it.
+
+    *on_product(key, scene, product)* is called in the parent as soon as
+    each product is in place, with a dict describing it (filename, format,
+    area_id, field and timings), and *on_scene(key, products, failed)* when
+    all products of a scene are done.
+
+    With *parallel_decode* the GRIB messages of a scene are decoded as
+    separate tasks, each reading its message straight from the LRIT
+    segments, so that the decoding of one slot spreads over the workers;
+    otherwise a single task decodes the scene.
+
+    A scene not done *scene_timeout* seconds after it was submitted is
+    failed and its slot freed, so that tasks that never complete cannot
+    block the pipeline. The results of its remaining tasks are dropped. The
+    timeout watchdog thread is stopped by close"""
+
+    def __init__(self, pool, area_ids, output_dir, fields=None,
+                 render_func=None, max_scenes=2, max_tasks=6, spool_dir=None,
+                 on_product=None, on_scene=None, parallel_decode=True,
+                 scene_timeout=None, max_queued=None):
+        self.pool = pool
+        self.area_ids = area_ids
+        self.output_dir = output_dir
+        self.fields = fields or DEFAULT_FIELDS
+        self.render_func = render_func
+        self.max_tasks = max_tasks
+        self.max_queued = max_queued or 4 * max_tasks
+        self.spool_dir = spool_dir or SPOOL_DIR
+        self.on_product = on_product
+        self.on_scene = on_scene
+        self.parallel_decode = parallel_decode
+        self.scene_timeout = scene_timeout
+
+        self.max_scenes = max_scenes
+        self._slots = threading.BoundedSemaphore(max_scenes)
+        self._lock = threading.Lock()
+        self._queues = dict((stage, deque())
+                            for stage in [DECODE, PROJECT, WRITE])
+        self._inflight = dict((stage, 0) for stage in [DECODE, PROJECT, WRITE])
+        self._idle = threading.Condition(self._lock)
+        self._room = threading.Condition(self._lock)
+        self._local = threading.local()
+        self._njobs = 0
+        self._jobs = set()
+        self._task_counter = 0
+
+        self._stop = threading.Event()
+        self._watchdog = None
+        if scene_timeout:
+            self._watchdog = threading.Thread(target=self._watch)
+            self._watchdog.daemon = True
+            self._watchdog.start()
+
+    @property
+    def full(self):
+        """True while the decode stage queue is at its bound, when submit
+        would wait"""
+
+        return len(self._queues[DECODE]) >= self.max_queued
+
+    def submit(self, key, scene):
+        """Process *scene*, a dict with the 'platform_name', 'starttime' and
+        'filenames' of the slot *key*. Blocks while the pipeline is full"""
+
+        self._slots.acquire()
+        if not getattr(self._local, 'callback', False):
+            with self._room:
+                while self.full:
+                    self._room.wait(1.0)
+        try:
+            spool = tempfile.mkdtemp(dir=self.spool_dir,
+                                     prefix='oca_%s_' % key)
+        except Exception:
+            self._slots.release()
+            raise
+        job = _SceneJob(key, scene, spool)
+        with self._lock:
+            self._njobs = self._njobs + 1
+            self._jobs.add(job)
+        if self.parallel_decode:
+            self._enqueue(job, DECODE, index_stage,
+                          (scene['filenames'], self.area_ids,
+                           os.path.join(spool, 'full')),
+                          self._indexed)
+        else:
+            self._enqueue(job, DECODE, decode_stage,
+                          (scene['filenames'], self.area_ids,
+                           os.path.join(spool, 'full')),
+                          self._decoded)
+
+    def join(self):
+        """Wait until all the submitted scenes are done"""
+
+        with self._idle:
+            while self._njobs:
+                self._idle.wait(1.0)
+
+    def close(self):
+        """Stop the timeout watchdog. Scenes still in the pipeline are no
+        longer timed out"""
+
+        self._stop.set()
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+
+    def _enqueue(self, job, stage, func, args, on_done):
+        with self._lock:
+            if job.done:
+                return
+            job.pending = job.pending + 1
+            self._queues[stage].append((job, stage, func, args, on_done))
+        self._dispatch()
+
+    def _dispatch(self):
+        """Start the queued tasks there is room for, later stages first"""
+
+        tasks = []
+        with self._lock:
+            for stage, downstream in [(WRITE, None), (PROJECT, WRITE),
+                                      (DECODE, PROJECT)]:
+                queue = self._queues[stage]
+                while (queue and self._inflight[stage] < self.max_tasks and
+                       (downstream is None or len(self._queues[downstream]) <
+                        self.max_queued)):
+                    job, stage, func, args, on_done = queue.popleft()
+                    self._inflight[stage] = self._inflight[stage] + 1
+                    self._task_counter = self._task_counter + 1
+                    job.running[self._task_counter] = stage
+                    tasks.append((self._task_counter, job, stage, func, args,
+                                  on_done))
+            if tasks:
+                self._room.notify_all()
+
+        for task_id, job, stage, func, args, on_done in tasks:
+            self.pool.apply_async(
+                _measured, (job.key, func) + tuple(args),
+                callback=self._callback(task_id, job, stage, on_done),
+                error_callback=self._callback(task_id, job, stage, None))
+
+    def _callback(self, task_id, job, stage, on_done):
+        def _done(result):
+            nested = getattr(self._local, 'callback', False)
+            self._local.callback = True
+            try:
+                _handle(result)
+            finally:
+                self._local.callback = nested
+
+        def _handle(result):
+            with self._lock:
+                # The task was already let go if its scene timed out
+                if job.running.pop(task_id, None) is not None:
+                    self._inflight[stage] = self._inflight[stage] - 1
+                done = job.done
+            if done:
+                LOG.warning("Dropping the %s stage result of %s, which "
+                            "timed out", stage, job.key)
+            elif on_done is None:
+                LOG.error("Stage %s failed for %s:\n%s", stage, job.key,
+                          result)
+                job.failed = True
+            else:
+                result, records = result
+                metrics.merge(records)
+                try:
+                    on_done(job, result)
+                except Exception:
+                    LOG.exception("Failed handling the %s stage of %s",
+                                  stage, job.key)
+                    job.failed = True
+            if not done:
+                self._task_done(job)
+            self._dispatch()
+        return _done
+
+    def _watch(self):
+        """Fail the scenes running longer than the scene timeout"""
+
+        interval = min(self.scene_timeout / 4., 5.)
+        self._local.callback = True
+        while not self._stop.wait(interval):
+            try:
+                self._check_timeouts()
+            except Exception:
+                LOG.exception("Failed checking the scene timeouts")
+
+    def _check_timeouts(self):
+        now = time.time()
+        expired = []
+        with self._lock:
+            for job in list(self._jobs):
+                if job.done or now - job.submitted <= self.scene_timeout:
+                    continue
+                job.done = True
+                job.failed = True
+                job.timed_out = True
+                for stage, queue in self._queues.items():
+                    self._queues[stage] = deque(
+                        task for task in queue if task[0] is not job)
+                for stage in job.running.values():
+                    self._inflight[stage] = self._inflight[stage] - 1
+                job.running.clear()
+                expired.append(job)
+            if expired:
+                self._room.notify_all()
+
+        for job in expired:
+            LOG.error("Scene %s timed out after %d s", job.key,
+                      self.scene_timeout)
+            self._finish(job)
+        if expired:
+            self._dispatch()
+
+    def _indexed(self, job, result):
+        path, tasks = result
+        if not tasks:
+            self._decoded(job, path)
+            return
+
+        with self._lock:
+            job.decoding = len(tasks)
+        for args in tasks:
+            self._enqueue(job, DECODE, decode_message_stage, args,
+                          self._message_decoded(path))
+
+    def _message_decoded(self, path):
+        def _on_done(job, name):
+            with self._lock:
+                job.decoding = job.decoding - 1
+                last = job.decoding == 0
+            if last:
+                self._decoded(job, path)
+        return _on_done
+
+    def _decoded(self, job, path):
+        for area_id in self.area_ids:
+            self._enqueue(job, PROJECT, project_stage,
+                          (path, area_id,
+                           os.path.join(job.spool, area_id)),
+                          self._projected(area_id))
+
+    def _projected(self, area_id):
+        def _on_done(job, path):
+            prefix = os.path.join(self.output_dir, output_prefix(
+                job.scene['platform_name'], job.scene['starttime'], area_id))
+            self._enqueue(job, WRITE, netcdf_stage, (path, prefix + '.nc'),
+                          self._written)
+            for field in self.fields:
+                self._enqueue(job, WRITE, render_stage,
+                              (path, field, prefix, self.render_func),
+                              self._written)
+        return _on_done
+
+    def _written(self, job, products):
+        for product in products:
+            product['scene_latency'] = product['written_at'] - job.submitted
+            job.products.append(product['filename'])
+            if self.on_product is not None:
+                self.on_product(job.key, job.scene, product)
+
+    def _task_done(self, job):
+        with self._lock:
+            job.pending = job.pending - 1
+            finished = job.pending == 0 and not job.done
+            if finished:
+                job.done = True
+        if finished:
+            self._finish(job)
+
+    def _finish(self, job):
+        """Clean up after the scene *job* and free its slot"""
+
+        with self._lock:
+            self._jobs.discard(job)
+        shutil.rmtree(job.spool, ignore_errors=True)
+        if metrics.ENABLED:
+            metrics.add({'stage': 'scene', 'scene': job.key,
+                         'wall_time': time.time() - job.submitted,
+                         'products': len(job.products),
+                         'failed': job.failed,
+                         'timed_out': job.timed_out})
+        # Free the slot first, so that on_scene may submit the next scene
+        self._slots.release()
+        if self.on_scene is not None:
+            try:
+                self.on_scene(job.key, job.products, job.failed)
+            except Exception:
+                LOG.exception("Failed in scene callback for %s", job.key)
+        with self._idle:
+            self._njobs = self._njobs - 1
+            self._idle.notify_all()
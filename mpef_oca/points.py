@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <adam.dybbroe@smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Extraction of OCA values at points (e.g. synoptic stations), through a
+precomputed and cached mapping of the points to grid lines and columns
+"""
+
+import hashlib
+import logging
+import numpy as np
+
+from .cache import (cache_key, cache_path, area_fingerprint, file_digest,
+                    load_arrays, save_arrays)
+from .utils import FIELDNAMES
+
+LOG = logging.getLogger(__name__)
+
+_POINT_INDICES = {}
+
+
+def lonlat2pixel(area_def, lons, lats):
+    """Get the flat grid index in *area_def* of the points *lons*, *lats*, -1
+    for points outside the area or not seen by the satellite"""
+
+    from pyproj import Proj
+
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    proj = Proj(area_def.proj4_string)
+    xcoord, ycoord = proj(lons, lats)
+    xcoord = np.asarray(xcoord)
+    ycoord = np.asarray(ycoord)
+
+    nlines, ncols = area_def.shape
+    xmin, ymin, xmax, ymax = area_def.area_extent
+    with np.errstate(invalid='ignore', over='ignore'):
+        cols = np.floor((xcoord - xmin) / ((xmax - xmin) / ncols))
+        lines = np.floor((ymax - ycoord) / ((ymax - ymin) / nlines))
+        valid = (np.isfinite(cols) & np.isfinite(lines) &
+                 (cols >= 0) & (cols < ncols) &
+                 (lines >= 0) & (lines < nlines))
+
+    index = np.empty(lons.shape, dtype=np.int64)
+    index.fill(-1)
+    index[valid] = lines[valid].astype(np.int64) * ncols + cols[valid]
+    return index
+
+
+def get_point_index(area_def, lons, lats, area_file=None, cache_dir=None):
+    """Get the flat grid index of the points *lons*, *lats* in *area_def*,
+    cached on disk per point list and area"""
+
+    lons = np.ascontiguousarray(lons, dtype=np.float64)
+    lats = np.ascontiguousarray(lats, dtype=np.float64)
+    points = hashlib.sha1(lons.tobytes() + lats.tobytes()).hexdigest()
+    parts = [area_fingerprint(area_def), points]
+    if area_file:
+        parts.append(file_digest(area_file))
+    key = cache_key(*parts)
+
+    if key not in _POINT_INDICES:
+        path = cache_path('points', area_def.area_id, key, cache_dir)
+        arrays = load_arrays(path, ['index'])
+        if arrays is None:
+            LOG.info("Map %d points to the %s grid", lons.size,
+                     area_def.area_id)
+            save_arrays(path, {'index': lonlat2pixel(area_def, lons, lats)},
+                        area_id=area_def.area_id, npoints=int(lons.size))
+            arrays = load_arrays(path, ['index'])
+        _POINT_INDICES[key] = np.asarray(arrays['index'])
+
+    return _POINT_INDICES[key]
+
+
+def extract(scene, index, lons, lats, fields=None, ids=None):
+    """Gather the values and errors of *fields* (default all) of the OCAData
+    *scene* at the flat grid *index*. Returns a structured array with one row
+    per point, NaN where there is no valid value"""
+
+    if fields is None:
+        fields = list(FIELDNAMES.keys())
+
+    columns = []
+    for field in fields:
+        for attr, name in zip(['data', 'error'], FIELDNAMES[field]):
+            if name:
+                columns.append((field, attr))
+
+    dtype = [('lon', 'f4'), ('lat', 'f4'), ('line', 'i4'), ('col', 'i4')]
+    if ids is not None:
+        ids = np.asarray(ids).astype(str)
+        dtype.insert(0, ('station', ids.dtype.str))
+    dtype.extend([(field if attr == 'data' else field + '_error', 'f4')
+                  for field, attr in columns])
+
+    table = np.zeros(index.shape, dtype=dtype)
+    if ids is not None:
+        table['station'] = ids
+    table['lon'] = lons
+    table['lat'] = lats
+
+    ncols = scene.area_def.shape[1]
+    inside = index >= 0
+    take = np.where(inside, index, 0)
+    table['line'] = np.where(inside, take // ncols, -1)
+    table['col'] = np.where(inside, take % ncols, -1)
+
+    for field, attr in columns:
+        data = getattr(scene, field).fetch(attr)
+        colname = field if attr == 'data' else field + '_error'
+        if data is None:
+            table[colname] = np.nan
+            continue
+        values = np.take(np.ma.getdata(data).ravel(), take).astype(np.float32)
+        invalid = ~inside
+        if np.ma.getmask(data) is not np.ma.nomask:
+            invalid |= np.take(np.ma.getmaskarray(data).ravel(), take)
+        values[invalid] = np.nan
+        table[colname] = values
+
+    return table
+
+
+def save_points(table, filename, fmt='%.6g'):
+    """Write the point *table* to a CSV file"""
+
+    names = table.dtype.names
+    with open(filename, 'w') as fpt:
+        fpt.write(','.join(names) + '\n')
+        for row in table:
+            fpt.write(','.join([str(row[name])
+                                if table.dtype[name].kind in 'iSU'
+                                else fmt % row[name]
+                                for name in names]) + '\n')
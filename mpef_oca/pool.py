@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <adam.dybbroe@smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""A pool of long lived worker processes, keeping their caches from one
+scene to the next, and recycled when their memory use grows too large
+"""
+
+import os
+import logging
+import threading
+import traceback
+import multiprocessing
+from collections import deque
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .metrics import current_rss
+
+LOG = logging.getLogger(__name__)
+
+
+def _worker(tasks, results, initializer, initargs, max_rss):
+    """Worker process loop. The tasks come one at a time on the pipe
+    *tasks*; the worker leaves the loop, and is replaced, when its resident
+    memory exceeds *max_rss*"""
+
+    if initializer is not None:
+        initializer(*initargs)
+
+    while True:
+        try:
+            task = tasks.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        job_id, func, args, kwargs = task
+        try:
+            result = (True, func(*args, **kwargs))
+        except Exception:
+            result = (False, traceback.format_exc())
+        # The recycling is announced with the result, so that no task is
+        # handed to this worker meanwhile
+        recycle = bool(max_rss) and current_rss() > max_rss
+        results.put((job_id, os.getpid(), result, recycle))
+        if recycle:
+            break
+
+
+class _Worker(object):
+
+    """A worker process, the sending end of its task pipe, the job it is
+    running, if any, and whether it is on its way out (recycled or told to
+    stop)"""
+
+    def __init__(self, process, tasks):
+        self.process = process
+        self.tasks = tasks
+        self.job_id = None
+        self.stopping = False
+
+
+class AsyncResult(object):
+
+    """The result of a task submitted to the WarmPool"""
+
+    def __init__(self, callback=None, error_callback=None):
+        self._event = threading.Event()
+        self._callback = callback
+        self._error_callback = error_callback
+        self._success = None
+        self._value = None
+
+    def _set(self, success, value):
+        self._success = success
+        self._value = value
+        self._event.set()
+        if success and self._callback is not None:
+            self._callback(value)
+        elif not success and self._error_callback is not None:
+            self._error_callback(value)
+
+    def ready(self):
+        return self._event.is_set()
+
+    def successful(self):
+        return self._success
+
+    def wait(self, timeout=None):
+        self._event.wait(timeout)
+
+    def get(self, timeout=None):
+        """Get the return value of the task. Raises RuntimeError with the
+        worker traceback if the task failed"""
+
+        self._event.wait(timeout)
+        if not self._event.is_set():
+            raise multiprocessing.TimeoutError()
+        if not self._success:
+            raise RuntimeError('Task failed in worker:\n%s' % self._value)
+        return self._value
+
+
+class WarmPool(object):
+
+    """Pool of *processes* long lived workers. Each worker runs *initializer*
+    once, then keeps its state (imports, area definitions, geolocation,
+    neighbour lookups) across tasks. A worker whose resident memory exceeds
+    *max_rss* bytes after a task is replaced by a fresh one.
+
+    The tasks are handed to idle workers one at a time, so the pool knows
+    which task each worker runs. The workers are checked every
+    *poll_interval* seconds: one that died (killed by the OOM killer, a
+    segfault) fails the task it was running and is replaced"""
+
+    def __init__(self, processes, initializer=None, initargs=(),
+                 max_rss=None, poll_interval=0.5):
+        self._processes = processes
+        self._initializer = initializer
+        self._initargs = initargs
+        self._max_rss = max_rss
+        self._poll_interval = poll_interval
+        self._results = multiprocessing.Queue()
+        self._workers = {}
+        self._pending = deque()
+        self._jobs = {}
+        self._job_counter = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+        for _ in range(processes):
+            self._start_worker()
+
+        self._handler = threading.Thread(target=self._handle_results)
+        self._handler.daemon = True
+        self._handler.start()
+
+    def _start_worker(self):
+        reader, writer = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=_worker,
+                                          args=(reader, self._results,
+                                                self._initializer,
+                                                self._initargs,
+                                                self._max_rss))
+        process.daemon = True
+        process.start()
+        reader.close()
+        self._workers[process.pid] = _Worker(process, writer)
+
+    def _handle_results(self):
+        """Collect the results, and replace the dead and recycled workers.
+        Stops when the pool is closed and all the workers are gone"""
+
+        while True:
+            try:
+                message = self._results.get(timeout=self._poll_interval)
+            except queue.Empty:
+                pass
+            else:
+                self._handle(*message)
+            self._check_workers()
+            with self._lock:
+                if self._closed and not self._workers:
+                    break
+
+    def _handle(self, job_id, pid, result, recycle):
+        """Handle the *result* of task *job_id* from worker *pid*"""
+
+        with self._lock:
+            worker = self._workers.get(pid)
+            if worker is not None:
+                if worker.job_id == job_id:
+                    worker.job_id = None
+                if recycle:
+                    LOG.info("Recycle worker %d, above the RSS limit", pid)
+                    worker.stopping = True
+            async_result = self._jobs.pop(job_id, None)
+
+        if async_result is not None:
+            try:
+                async_result._set(*result)
+            except Exception:
+                LOG.exception("Failed in result callback")
+        self._dispatch()
+
+    def _check_workers(self):
+        """Fail the task of each worker that died, and start the
+        replacements"""
+
+        with self._lock:
+            dead = [worker for worker in self._workers.values()
+                    if worker.process.exitcode is not None]
+        if not dead:
+            return
+
+        # The results sent before exiting are in the queue once the exit
+        # code is set
+        while True:
+            try:
+                message = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._handle(*message)
+
+        lost = []
+        with self._lock:
+            for worker in dead:
+                pid = worker.process.pid
+                self._workers.pop(pid, None)
+                worker.tasks.close()
+                worker.process.join()
+                if worker.job_id is not None:
+                    lost.append((worker.job_id, pid,
+                                 worker.process.exitcode))
+                    worker.job_id = None
+                elif not worker.stopping:
+                    LOG.warning("Worker %d died with exit code %s", pid,
+                                worker.process.exitcode)
+                if not self._closed or self._pending:
+                    self._start_worker()
+
+        for job_id, pid, exitcode in lost:
+            LOG.error("Worker %d died with exit code %s while running "
+                      "task %d", pid, exitcode, job_id)
+            self._fail(job_id, 'Worker %d died with exit code %s' %
+                       (pid, exitcode))
+        self._dispatch()
+
+    def _fail(self, job_id, message):
+        """Fail the task *job_id* with the error *message*"""
+
+        with self._lock:
+            async_result = self._jobs.pop(job_id, None)
+        if async_result is not None:
+            try:
+                async_result._set(False, message)
+            except Exception:
+                LOG.exception("Failed in error callback")
+
+    def _dispatch(self):
+        """Hand the pending tasks to the idle workers. Once the pool is closed
+        and there is nothing left to do, the idle workers are stopped"""
+
+        sends = []
+        with self._lock:
+            for worker in self._workers.values():
+                if worker.job_id is not None or worker.stopping:
+                    continue
+                if worker.process.exitcode is not None:
+                    continue
+                if self._pending:
+                    task = self._pending.popleft()
+                    worker.job_id = task[0]
+                    sends.append((worker, task))
+                elif self._closed:
+                    worker.stopping = True
+                    sends.append((worker, None))
+
+        for worker, task in sends:
+            try:
+                worker.tasks.send(task)
+            except Exception:
+                if task is None:
+                    continue
+                LOG.exception("Failed sending task %d to worker %d", task[0],
+                              worker.process.pid)
+                with self._lock:
+                    worker.job_id = None
+                self._fail(task[0], traceback.format_exc())
+
+    def apply_async(self, func, args=(), kwds=None, callback=None,
+                    error_callback=None):
+        """Submit *func(*args, **kwds)* to the workers. Returns an
+        AsyncResult. *callback* is called with the return value, or
+        *error_callback* with the worker traceback if the task failed or the
+        worker died"""
+
+        if self._closed:
+            raise ValueError('Pool is closed')
+
+        async_result = AsyncResult(callback, error_callback)
+        with self._lock:
+            self._job_counter = self._job_counter + 1
+            job_id = self._job_counter
+            self._jobs[job_id] = async_result
+            self._pending.append((job_id, func, args, kwds or {}))
+        self._dispatch()
+        return async_result
+
+    def close(self):
+        """Stop accepting tasks; the workers stop when the queue is empty"""
+
+        self._closed = True
+        self._dispatch()
+
+    def join(self):
+        """Wait for the workers to stop"""
+
+        self._handler.join()
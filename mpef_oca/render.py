@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <adam.dybbroe@smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Batch rendering of OCA fields to palette indexed GeoTIFF and PNG images,
+written directly from uint8 arrays without going through mpop
+"""
+
+import os
+import logging
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+from .utils import get_palette, palette_index
+from .metrics import measure, file_size
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_FIELDS = ['scenetype', 'reff', 'ul_ctp', 'ul_cot', 'll_ctp', 'll_cot',
+                  'cost']
+
+
+def palette_rgb(palette):
+    """Get *palette* as a (N, 3) uint8 array. mpop palettes are floats in the
+    range 0-1"""
+
+    pal = np.asarray(palette)
+    if pal.dtype.kind == 'f' and pal.max() <= 1.0:
+        pal = pal * 255.
+    return np.clip(np.rint(pal), 0, 255).astype(np.uint8)[:, :3]
+
+
+def geotransform(area_def):
+    """Get the GDAL geotransform of *area_def*"""
+
+    nlines, ncols = area_def.shape
+    xmin, ymin, xmax, ymax = area_def.area_extent
+    return (xmin, (xmax - xmin) / ncols, 0,
+            ymax, 0, -(ymax - ymin) / nlines)
+
+
+def write_geotiff(filename, index, palette, area_def, compress='DEFLATE',
+                  tile_size=256):
+    """Write the palette index array *index* to a tiled and compressed
+    GeoTIFF file, georeferenced with *area_def*"""
+
+    try:
+        from osgeo import gdal, osr
+    except ImportError:
+        raise ImportError('Writing GeoTIFF files needs the GDAL Python '
+                          'bindings (osgeo), see setup.py')
+
+    nlines, ncols = index.shape
+    options = ['TILED=YES',
+               'BLOCKXSIZE=%d' % tile_size,
+               'BLOCKYSIZE=%d' % tile_size]
+    if compress:
+        options.append('COMPRESS=%s' % compress)
+
+    driver = gdal.GetDriverByName('GTiff')
+    dst = driver.Create(filename, ncols, nlines, 1, gdal.GDT_Byte, options)
+    dst.SetGeoTransform(geotransform(area_def))
+    srs = osr.SpatialReference()
+    srs.ImportFromProj4(area_def.proj4_string)
+    dst.SetProjection(srs.ExportToWkt())
+
+    band = dst.GetRasterBand(1)
+    colors = gdal.ColorTable()
+    for idx, rgb in enumerate(palette_rgb(palette)):
+        colors.SetColorEntry(idx, (int(rgb[0]), int(rgb[1]), int(rgb[2]),
+                                   255))
+    band.SetRasterColorTable(colors)
+    band.SetRasterColorInterpretation(gdal.GCI_PaletteIndex)
+    band.SetNoDataValue(0)
+    band.WriteArray(index)
+    band.FlushCache()
+    dst = None
+
+
+def write_png(filename, index, palette, compress_level=6):
+    """Write the palette index array *index* to a PNG file"""
+
+    from PIL import Image
+
+    img = Image.fromarray(index, 'P')
+    rgb = palette_rgb(palette)
+    flat = np.zeros((256, 3), dtype=np.uint8)
+    flat[:min(len(rgb), 256)] = rgb[:256]
+    img.putpalette(flat.ravel().tolist())
+    img.save(filename, 'PNG', compress_level=compress_level)
+
+
+WRITERS = {'tif': write_geotiff,
+           'png': write_png}
+
+
+def render_field(scene, field, prefix, formats=('tif', ), **kwargs):
+    """Render the field *field* of *scene* to the files
+    <prefix>_<field>.<format>. Each file is written under a temporary name
+    and renamed in place. Returns the list of files written"""
+
+    with measure('render', area=scene.area_def.area_id,
+                 field=field) as stage:
+        data = getattr(scene, field).data
+        index = palette_index(field, data)
+        palette = get_palette(field)
+
+        filenames = []
+        for fmt in formats:
+            filename = '%s_%s.%s' % (prefix, field, fmt)
+            tmpname = os.path.join(os.path.dirname(filename),
+                                   '.' + os.path.basename(filename))
+            if fmt == 'tif':
+                write_geotiff(tmpname, index, palette, scene.area_def,
+                              **kwargs)
+            else:
+                WRITERS[fmt](tmpname, index, palette)
+            os.rename(tmpname, filename)
+            stage.written(file_size(filename))
+            filenames.append(filename)
+    return filenames
+
+
+def render(scene, prefix, fields=None, formats=('tif', ), nthreads=4,
+           **kwargs):
+    """Render the *fields* (default DEFAULT_FIELDS) of the projected OCAData
+    *scene* to palette indexed images named <prefix>_<field>.<format>. The
+    fields are encoded in parallel threads. Returns the list of files
+    written"""
+
+    if fields is None:
+        fields = DEFAULT_FIELDS
+
+    def _render(field):
+        return render_field(scene, field, prefix, formats, **kwargs)
+
+    if nthreads and nthreads > 1 and len(fields) > 1:
+        pool = ThreadPool(min(nthreads, len(fields)))
+        try:
+            results = pool.map(_render, fields)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_render(field) for field in fields]
+
+    filenames = []
+    for files in results:
+        filenames.extend(files)
+    return filenames
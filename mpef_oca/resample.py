@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <adam.dybbroe@smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Nearest neighbour resampling of the full disk OCA fields, with the
+neighbour lookup cached on disk per source area, target area and radius
+"""
+
+import logging
+import numpy as np
+
+from .cache import (cache_key, cache_path, area_fingerprint, file_digest,
+                    load_arrays, save_arrays)
+from .geoloc import get_geolocation
+
+LOG = logging.getLogger(__name__)
+
+_RESAMPLERS = {}
+
+
+def crop_area(area_def, lines, cols):
+    """Get the sub area of *area_def* covering the line slice *lines* and the
+    column slice *cols*"""
+
+    import pyresample as pr
+
+    nlines, ncols = area_def.shape
+    xmin, ymin, xmax, ymax = area_def.area_extent
+    xsize = (xmax - xmin) / ncols
+    ysize = (ymax - ymin) / nlines
+    extent = (xmin + cols.start * xsize, ymax - lines.stop * ysize,
+              xmin + cols.stop * xsize, ymax - lines.start * ysize)
+    area_id = '%s_%d-%d_%d-%d' % (area_def.area_id, lines.start, lines.stop,
+                                  cols.start, cols.stop)
+    return pr.geometry.AreaDefinition(area_id, area_def.name,
+                                      area_def.proj_id, area_def.proj_dict,
+                                      cols.stop - cols.start,
+                                      lines.stop - lines.start, extent)
+
+
+class NearestResampler(object):
+
+    """Nearest neighbour resampling from *source_area* to *target_area*. The
+    lookup is an array of target shape holding, for each target pixel, the
+    flat index of its neighbour in the source grid (-1 if there is none
+    within the radius of influence)"""
+
+    def __init__(self, source_area, target_area, radius_of_influence=20000,
+                 area_file=None, cache_dir=None):
+        self.source_area = source_area
+        self.target_area = target_area
+        self.radius_of_influence = radius_of_influence
+        self.area_file = area_file
+        self.cache_dir = cache_dir
+
+        parts = [area_fingerprint(source_area), area_fingerprint(target_area),
+                 radius_of_influence]
+        if area_file:
+            parts.append(file_digest(area_file))
+        self.key = cache_key(*parts)
+        self._path = cache_path('resample', '%s_%s_%d' % (
+            source_area.area_id, target_area.area_id, radius_of_influence),
+            self.key, cache_dir)
+
+        self.index = None
+        self._take_index = None
+        self._nodata = None
+
+    def lookup(self):
+        """Load the neighbour lookup from the cache, computing and storing it
+        first if needed"""
+
+        if self.index is not None:
+            return self.index
+
+        arrays = load_arrays(self._path, ['index'])
+        if arrays is None:
+            LOG.info("Compute neighbour lookup %s -> %s",
+                     self.source_area.area_id, self.target_area.area_id)
+            save_arrays(self._path, {'index': self._compute()},
+                        source=self.source_area.area_id,
+                        target=self.target_area.area_id,
+                        radius_of_influence=self.radius_of_influence)
+            arrays = load_arrays(self._path, ['index'])
+
+        self._set_index(arrays['index'])
+        return self.index
+
+    def _set_index(self, index):
+        """Set the neighbour lookup"""
+
+        self.index = index
+        self._nodata = self.index < 0
+        self._take_index = np.where(self._nodata, 0, self.index)
+
+    def source_window(self):
+        """Get the (line, column) slices of the smallest window of the source
+        grid holding all the neighbours, or None if there are none"""
+
+        index = self.lookup()
+        index = index[index >= 0]
+        if index.size == 0:
+            return None
+        ncols = self.source_area.shape[1]
+        lines = index // ncols
+        cols = index % ncols
+        return (slice(int(lines.min()), int(lines.max()) + 1),
+                slice(int(cols.min()), int(cols.max()) + 1))
+
+    def cropped(self, lines, cols):
+        """Get the resampler from the window *lines*, *cols* of the source
+        area, derived from this lookup without a new neighbour search"""
+
+        source = crop_area(self.source_area, lines, cols)
+        resampler = get_resampler(source, self.target_area,
+                                  self.radius_of_influence, self.area_file,
+                                  self.cache_dir)
+        if resampler.index is None:
+            index = self.lookup()
+            ncols = self.source_area.shape[1]
+            new_lines = index // ncols - lines.start
+            new_cols = index % ncols - cols.start
+            shape = source.shape
+            inside = ((index >= 0) &
+                      (new_lines >= 0) & (new_lines < shape[0]) &
+                      (new_cols >= 0) & (new_cols < shape[1]))
+            resampler._set_index(np.where(inside,
+                                          new_lines * shape[1] + new_cols,
+                                          -1).astype(np.int32))
+        return resampler
+
+    def _compute(self):
+        """Compute the neighbour lookup with a kd-tree search"""
+
+        import pyresample as pr
+
+        geoloc = get_geolocation(self.source_area, self.area_file,
+                                 self.cache_dir)
+        lons, lats = geoloc.get_lonlats()
+        swath_def = pr.geometry.SwathDefinition(lons, lats)
+
+        (valid_input_index, valid_output_index,
+         index_array, distance_array) = pr.kd_tree.get_neighbour_info(
+            swath_def, self.target_area, self.radius_of_influence,
+            neighbours=1)
+
+        source_index = np.flatnonzero(valid_input_index.ravel())
+        found = index_array < source_index.size
+        valid_index = np.empty(index_array.shape, dtype=np.int32)
+        valid_index[found] = source_index[index_array[found]]
+        valid_index[~found] = -1
+
+        index = np.empty(self.target_area.shape, dtype=np.int32)
+        index.fill(-1)
+        index.ravel()[valid_output_index.ravel()] = valid_index
+        return index
+
+    def resample(self, data):
+        """Resample the source grid array *data*. Returns a masked array,
+        masked where there is no neighbour or the neighbour is masked"""
+
+        self.lookup()
+        result = np.take(np.ma.getdata(data).ravel(), self._take_index)
+        mask = self._nodata
+        if np.ma.getmask(data) is not np.ma.nomask:
+            mask = mask | np.take(np.ma.getmaskarray(data).ravel(),
+                                  self._take_index)
+        return np.ma.masked_array(result, mask)
+
+    def resample_stack(self, arrays):
+        """Resample the source grid arrays *arrays* in one go, into one
+        stacked output buffer per data type (compact scenes mix uint8, int16
+        and float32 arrays). Returns one masked array view of those buffers
+        per input array, of the type of the input"""
+
+        self.lookup()
+        layers = {}
+        for layer, arr in enumerate(arrays):
+            dtype = np.ma.getdata(arr).dtype
+            layers.setdefault(dtype, []).append(layer)
+
+        results = [None] * len(arrays)
+        for dtype, group in layers.items():
+            shape = (len(group), ) + self._take_index.shape
+            stack = np.empty(shape, dtype=dtype)
+            mask = np.empty(shape, dtype=bool)
+            mask[:] = self._nodata
+
+            for pos, layer in enumerate(group):
+                arr = arrays[layer]
+                np.take(np.ma.getdata(arr).ravel(), self._take_index,
+                        out=stack[pos])
+                if np.ma.getmask(arr) is not np.ma.nomask:
+                    mask[pos] |= np.take(np.ma.getmaskarray(arr).ravel(),
+                                         self._take_index)
+                results[layer] = np.ma.masked_array(stack[pos], mask[pos])
+
+        return results
+
+
+def get_resampler(source_area, target_area, radius_of_influence=20000,
+                  area_file=None, cache_dir=None):
+    """Get the resampler from *source_area* to *target_area*, shared within
+    the process"""
+
+    resampler = NearestResampler(source_area, target_area,
+                                 radius_of_influence, area_file, cache_dir)
+    if resampler.key not in _RESAMPLERS:
+        _RESAMPLERS[resampler.key] = resampler
+    return _RESAMPLERS[resampler.key]
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <a000680@c20671.ad.smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Scheduling of the incoming scenes on the processing pipeline: newest slot
+first, one run per scene, a bounded number of scenes in flight, and stale
+scenes dropped or put behind the fresh ones
+"""
+
+import time
+import heapq
+import logging
+import calendar
+import threading
+
+from .pool import AsyncResult
+
+LOG = logging.getLogger(__name__)
+
+DROP, DEFER = 'drop', 'defer'
+
+
+def _epoch(starttime):
+    """Seconds since epoch of the datetime *starttime* (UTC)"""
+
+    if starttime is None:
+        return time.time()
+    return calendar.timegm(starttime.utctimetuple())
+
+
+class SceneScheduler(object):
+
+    """Feed scenes to *pipeline* (a ScenePipeline), newest slot first, with at
+    most *max_inflight* scenes in the pipeline (default the pipeline's
+    max_scenes, which is also the upper limit). Scenes are held back while
+    the pipeline is full, until a scene is done or added.
+
+    A scene key is only run once: it is ignored while queued or in flight,
+    and for *block_for* seconds after it is done. Scenes with a start time
+    more than *max_age* seconds ago are stale, and are dropped or, with
+    *stale* set to 'defer', only run when no fresh scene is waiting.
+
+    The pipeline on_scene callback is taken over by the scheduler, and
+    chained"""
+
+    def __init__(self, pipeline, max_inflight=None, max_age=None,
+                 stale=DROP, block_for=300):
+        if stale not in [DROP, DEFER]:
+            raise ValueError('Unknown stale scene policy: %s' % str(stale))
+        self.pipeline = pipeline
+        # submit must never block, it is called from the pool callbacks
+        self.max_inflight = min(max_inflight or pipeline.max_scenes,
+                                pipeline.max_scenes)
+        self.max_age = max_age
+        self.stale = stale
+        self.block_for = block_for
+
+        self._lock = threading.Lock()
+        self._fresh = []
+        self._deferred = []
+        self._pending = {}
+        self._inflight = 0
+        self._blocked = {}
+        self._expiry = []
+        self._seq = 0
+
+        self._on_scene = pipeline.on_scene
+        pipeline.on_scene = self._scene_done
+
+    def __len__(self):
+        """Number of scenes waiting to be run"""
+
+        return len(self._fresh) + len(self._deferred)
+
+    @property
+    def inflight(self):
+        return self._inflight
+
+    def add(self, key, scene, callback=None, error_callback=None):
+        """Schedule *scene* (see ScenePipeline.submit) under *key*. Returns an
+        AsyncResult, which gets the list of products written, or None if the
+        scene is a duplicate"""
+
+        with self._lock:
+            self._expire()
+            if key in self._pending or key in self._blocked:
+                LOG.debug("Scene %s already scheduled or done, skipping", key)
+                return None
+
+            result = AsyncResult(callback, error_callback)
+            self._pending[key] = result
+            self._seq = self._seq + 1
+            heapq.heappush(self._fresh, (-_epoch(scene.get('starttime')),
+                                         self._seq, key, scene))
+
+        self._dispatch()
+        return result
+
+    def _expire(self):
+        """Forget the done scenes whose blocking time is over"""
+
+        now = time.time()
+        while self._expiry and self._expiry[0][0] <= now:
+            expires, key = heapq.heappop(self._expiry)
+            if self._blocked.get(key) == expires:
+                del self._blocked[key]
+
+    def _is_stale(self, scene, now):
+        if self.max_age is None:
+            return False
+        return now - _epoch(scene.get('starttime')) > self.max_age
+
+    def _next(self):
+        """Pop the next scene to run, shedding the stale ones"""
+
+        now = time.time()
+        shed = []
+        while self._fresh:
+            item = heapq.heappop(self._fresh)
+            if not self._is_stale(item[3], now):
+                return item, shed
+            if self.stale == DEFER:
+                LOG.info("Scene %s is stale, deferring it", item[2])
+                heapq.heappush(self._deferred, item)
+            else:
+                shed.append(item[2])
+
+        if self._deferred:
+            return heapq.heappop(self._deferred), shed
+        return None, shed
+
+    def _dispatch(self):
+        """Submit scenes to the pipeline while there is room for them"""
+
+        while True:
+            with self._lock:
+                if (self._inflight >= self.max_inflight or
+                        self.pipeline.full):
+                    return
+                item, shed = self._next()
+                dropped = [(key, self._pending.pop(key)) for key in shed]
+                if item is not None:
+                    self._inflight = self._inflight + 1
+
+            for key, result in dropped:
+                LOG.warning("Scene %s is stale, dropping it", key)
+                self._block(key)
+                result._set(False, 'Scene %s dropped as stale' % key)
+            if item is None:
+                return
+
+            key, scene = item[2], item[3]
+            LOG.info("Submitting scene %s", key)
+            try:
+                self.pipeline.submit(key, scene)
+            except Exception as err:
+                LOG.exception("Failed submitting scene %s", key)
+                self._scene_done(key, [], True, str(err))
+
+    def _block(self, key):
+        with self._lock:
+            expires = time.time() + self.block_for
+            self._blocked[key] = expires
+            heapq.heappush(self._expiry, (expires, key))
+
+    def _scene_done(self, key, products, failed, reason=None):
+        with self._lock:
+            self._inflight = self._inflight - 1
+            result = self._pending.pop(key, None)
+        self._block(key)
+
+        if self._on_scene is not None:
+            try:
+                self._on_scene(key, products, failed)
+            except Exception:
+                LOG.exception("Failed in scene callback for %s", key)
+        if result is not None:
+            if failed:
+                result._set(False, reason or
+                            'Scene %s failed, products written: %s' %
+                            (key, str(products)))
+            else:
+                result._set(True, products)
+
+        self._dispatch()
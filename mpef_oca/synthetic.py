@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <a000680@c20671.ad.smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Synthetic MPEF OCA products, for benchmarking and offline testing. The
+fields are smooth random fields with the value ranges of the real product,
+masked outside the Earth disk and where the layer does not exist, and
+reproducible from a seed. They are GRIB2 encoded (simple packing with a
+bitmap, space view grid) with the parameter numbers of the MPEF product, and
+the stream is cut into LRIT segment files named after LRIT_PATTERN, with the
+103 byte LRIT header.
+"""
+
+import os
+import io
+import math
+import struct
+from datetime import datetime
+
+import numpy as np
+
+from .lrit import CDS_EPOCH, ANNOTATION, TIMESTAMP, SEGMENT_IDENTIFICATION
+from .utils import OCA_FIELDS
+
+FULL_DISK_SIZE = 3712
+#: Apparent diameter of the Earth, in full disk grid lengths
+EARTH_DIAMETER = 3622
+#: Distance of the satellite from the Earth centre, in Earth radii
+SATELLITE_DISTANCE = 6.610839
+
+DISCIPLINE_SPACE = 3
+
+#: Synthetic scene types: clear, single layer water, single layer ice and
+#: multi layer clouds
+CLEAR, WATER, ICE, MULTILAYER = 0, 111, 112, 113
+
+#: Parameter name: (parameter category, parameter number, decimal scale
+#: factor, value range, layer). The layer tells where the field is defined:
+#: 'disk', 'cloud' or 'multilayer'
+FIELD_SPECS = {'Pixel scene type': (0, 8, 0, None, 'disk'),
+               '24': (1, 24, 1, (0., 300.), 'disk'),
+               '25': (1, 25, 3, (-1., 2.5), 'cloud'),
+               '26': (1, 26, -1, (10000., 100000.), 'cloud'),
+               '27': (1, 27, 8, (1e-6, 6e-5), 'cloud'),
+               '28': (1, 28, 3, (0., 1.), 'cloud'),
+               '29': (1, 29, -1, (0., 20000.), 'cloud'),
+               '30': (1, 30, 8, (0., 2e-5), 'cloud'),
+               '31': (1, 31, 3, (-1., 2.), 'multilayer'),
+               '32': (1, 32, -1, (50000., 100000.), 'multilayer'),
+               '33': (1, 33, 3, (0., 1.), 'multilayer'),
+               '34': (1, 34, -1, (0., 20000.), 'multilayer')}
+
+SPACECRAFT_IDS = {'MSG1': 321, 'MSG2': 322, 'MSG3': 323, 'MSG4': 324}
+
+LRIT_NAME = 'L-000-%s_-MPEF________-OCAE_____-%s-%s-__'
+
+
+def parameter_names():
+    """The parameter names of the OCA product, in the order of the GRIB
+    stream"""
+
+    return [[key for key in param if key not in ['units', 'abbrev']][0]
+            for param in OCA_FIELDS]
+
+
+def _sign_magnitude(value, nbytes):
+    """Encode the integer *value* the GRIB way, with a sign bit"""
+
+    bits = 8 * nbytes - 1
+    if value < 0:
+        return (1 << bits) | -value
+    return value
+
+
+def pack_bits(values, nbits, chunk=1 << 20):
+    """Pack the unsigned integers *values* on *nbits* bits each, big endian,
+    a chunk of values at a time"""
+
+    if nbits == 0 or values.size == 0:
+        return b''
+    packed = []
+    for start in range(0, values.size, chunk):
+        part = values[start:start + chunk].astype('>u4')
+        bits = np.unpackbits(part.view(np.uint8).reshape(-1, 4), axis=1)
+        packed.append(np.packbits(bits[:, 32 - nbits:].ravel()).tobytes())
+    return b''.join(packed)
+
+
+def space_mask(size):
+    """Mask of the pixels of a *size* x *size* full disk grid outside the
+    Earth disk"""
+
+    radius = size / 2. * EARTH_DIAMETER / FULL_DISK_SIZE
+    coords = np.arange(size, dtype=np.float32) - (size - 1) / 2.
+    return (coords[:, np.newaxis] ** 2 +
+            coords[np.newaxis, :] ** 2) > radius ** 2
+
+
+def smooth_field(shape, rng, low=0., high=1., cells=16):
+    """Bilinear interpolation of a *cells* x *cells* random field to
+    *shape*, scaled to [*low*, *high*]"""
+
+    coarse = rng.random_sample((cells + 1, cells + 1)).astype(np.float32)
+
+    def _axis(size):
+        pos = np.linspace(0, cells, size).astype(np.float32)
+        idx = np.minimum(pos.astype(np.int32), cells - 1)
+        return idx, pos - idx
+
+    yidx, yfrac = _axis(shape[0])
+    xidx, xfrac = _axis(shape[1])
+    yfrac = yfrac[:, np.newaxis]
+    top = (coarse[yidx][:, xidx] * (1 - xfrac) +
+           coarse[yidx][:, xidx + 1] * xfrac)
+    bottom = (coarse[yidx + 1][:, xidx] * (1 - xfrac) +
+              coarse[yidx + 1][:, xidx + 1] * xfrac)
+    field = top * (1 - yfrac) + bottom * yfrac
+    return low + (high - low) * field
+
+
+def make_scene_type(size, rng, space=None):
+    """Synthetic scene type of a *size* x *size* full disk"""
+
+    if space is None:
+        space = space_mask(size)
+    cover = smooth_field((size, size), rng)
+    scenetype = np.full((size, size), CLEAR, dtype=np.uint8)
+    scenetype[cover > 0.3] = WATER
+    scenetype[cover > 0.6] = ICE
+    scenetype[cover > 0.85] = MULTILAYER
+    return np.ma.masked_array(scenetype, space)
+
+
+def make_field(name, scenetype, rng):
+    """Synthetic field for the parameter *name*, defined where *scenetype*
+    says its layer exists"""
+
+    _, _, _, value_range, layer = FIELD_SPECS[name]
+    if value_range is None:
+        return scenetype
+
+    mask = np.ma.getmaskarray(scenetype).copy()
+    if layer == 'cloud':
+        mask |= np.ma.getdata(scenetype) == CLEAR
+    elif layer == 'multilayer':
+        mask |= np.ma.getdata(scenetype) != MULTILAYER
+    return np.ma.masked_array(smooth_field(scenetype.shape, rng,
+                                           *value_range), mask)
+
+
+def encode_grib2(data, category, number, decimal_scale, nominal_time,
+                 discipline=DISCIPLINE_SPACE):
+    """Encode the masked 2D array *data*, in grid orientation, as a GRIB2
+    message on a space view grid. The values are stored the way MPEF does,
+    flipped in both directions (scanning from the south east corner)"""
+
+    nlines, ncols = data.shape
+    values = np.ma.getdata(data)[::-1, ::-1].ravel()
+    present = ~np.ma.getmaskarray(data)[::-1, ::-1].ravel()
+
+    scaled = values[present].astype(np.float64) * 10. ** decimal_scale
+    reference = math.floor(scaled.min()) if scaled.size else 0.
+    packed = np.rint(scaled - reference).astype(np.uint32)
+    nbits = int(packed.max()).bit_length() if packed.size else 0
+
+    sec1 = struct.pack('>IBHHBBBHBBBBBBB', 21, 1, 254, 0, 4, 0, 0,
+                       nominal_time.year, nominal_time.month,
+                       nominal_time.day, nominal_time.hour,
+                       nominal_time.minute, nominal_time.second, 0, 0)
+
+    diameter = int(round(EARTH_DIAMETER * float(ncols) / FULL_DISK_SIZE))
+    sec3 = struct.pack('>BBIBIBIIIIIBIIIIBIIII',
+                       7, 0, 0, 1, 63781690, 1, 63565838,
+                       ncols, nlines, 0, 0, 48, diameter, diameter,
+                       ncols * 500, nlines * 500, 0xc0, 0,
+                       int(SATELLITE_DISTANCE * 1e6), 0, 0)
+    sec3 = struct.pack('>IBBIBBH', 14 + len(sec3), 3, 0, nlines * ncols, 0,
+                       0, 90) + sec3
+
+    sec4 = struct.pack('>IBHHBBBBBHBBIBBIBBI', 34, 4, 0, 0, category, number,
+                       0, 0, 0, 0, 0, 0, 0, 255, 255, 0xffffffff, 255, 255,
+                       0xffffffff)
+
+    sec5 = struct.pack('>IBIHfHHBB', 21, 5, int(present.sum()), 0,
+                       reference, 0, _sign_magnitude(decimal_scale, 2),
+                       nbits, 0)
+    bitmap = np.packbits(present).tobytes()
+    sec6 = struct.pack('>IBB', 6 + len(bitmap), 6, 0) + bitmap
+    payload = pack_bits(packed, nbits)
+    sec7 = struct.pack('>IB', 5 + len(payload), 7) + payload
+
+    body = sec1 + sec3 + sec4 + sec5 + sec6 + sec7 + b'7777'
+    sec0 = b'GRIB' + struct.pack('>HBBQ', 0, discipline, 2, 16 + len(body))
+    return sec0 + body
+
+
+def make_grib_stream(size=FULL_DISK_SIZE, nominal_time=None, seed=0):
+    """Encode a synthetic OCA product on a *size* x *size* full disk grid.
+    Returns the GRIB stream"""
+
+    if nominal_time is None:
+        nominal_time = datetime(2016, 10, 1, 12, 0)
+    rng = np.random.RandomState(seed)
+    scenetype = make_scene_type(size, rng)
+
+    messages = []
+    for name in parameter_names():
+        category, number, decimal_scale, _, _ = FIELD_SPECS[name]
+        data = make_field(name, scenetype, rng)
+        messages.append(encode_grib2(data, category, number, decimal_scale,
+                                     nominal_time))
+    return b''.join(messages)
+
+
+def lrit_filename(platform_name, segment, nominal_time):
+    """Name of LRIT segment number *segment*, see LRIT_PATTERN"""
+
+    return LRIT_NAME % (platform_name.ljust(5, '_'),
+                        ('%06d' % segment).ljust(9, '_'),
+                        nominal_time.strftime('%Y%m%d%H%M'))
+
+
+def lrit_header(filename, segment, nsegments, platform_name, nominal_time,
+                data_length):
+    """The 103 byte LRIT header of a segment file"""
+
+    annotation = os.path.basename(filename).ljust(62).encode('ascii')
+    delta = nominal_time - CDS_EPOCH
+    msecs = delta.seconds * 1000 + delta.microseconds // 1000
+
+    secondary = (struct.pack('>BH', ANNOTATION, 3 + len(annotation)) +
+                 annotation +
+                 struct.pack('>BHBHI', TIMESTAMP, 10, 0x40, delta.days,
+                             msecs) +
+                 struct.pack('>BHHBHHH', SEGMENT_IDENTIFICATION, 12,
+                             SPACECRAFT_IDS.get(platform_name, 0), 0,
+                             segment, 1, nsegments))
+    header_length = 16 + len(secondary)
+    return struct.pack('>BHBIQ', 0, 16, 0, header_length,
+                       data_length * 8) + secondary
+
+
+def write_segments(stream, outdir, platform_name='MSG3', nominal_time=None,
+                   nsegments=8):
+    """Cut the GRIB *stream* in *nsegments* LRIT segment files in *outdir*.
+    Returns the file names"""
+
+    if nominal_time is None:
+        nominal_time = datetime(2016, 10, 1, 12, 0)
+    step = int(math.ceil(len(stream) / float(nsegments)))
+
+    filenames = []
+    for segment in range(1, nsegments + 1):
+        data = stream[(segment - 1) * step:segment * step]
+        filename = os.path.join(outdir, lrit_filename(platform_name, segment,
+                                                      nominal_time))
+        with io.open(filename, 'wb') as fpt:
+            fpt.write(lrit_header(filename, segment, nsegments,
+                                  platform_name, nominal_time, len(data)))
+            fpt.write(data)
+        filenames.append(filename)
+    return filenames
+
+
+def make_segments(outdir, size=FULL_DISK_SIZE, platform_name='MSG3',
+                  nominal_time=None, nsegments=8, seed=0):
+    """Write a synthetic OCA product on a *size* x *size* full disk grid as
+    LRIT segment files in *outdir*. Returns the file names"""
+
+    if nominal_time is None:
+        nominal_time = datetime(2016, 10, 1, 12, 0)
+    stream = make_grib_stream(size, nominal_time, seed)
+    return write_segments(stream, outdir, platform_name, nominal_time,
+                          nsegments)
+
+
+def reduced_area(size, area_file):
+    """The full disk area of *area_file* ('met09globeFull') on a *size* x
+    *size* grid, to go with synthetic products of reduced size"""
+
+    import pyresample as pr
+    from .areas import load_area, FULL_DISK
+
+    full = load_area(FULL_DISK, area_file)
+    if size == full.x_size:
+        return full
+    return pr.geometry.AreaDefinition('met09globe%d' % size,
+                                      'Reduced MSG full disk',
+                                      full.proj_id, full.proj_dict,
+                                      size, size, full.area_extent)
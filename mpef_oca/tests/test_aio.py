@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <adam.dybbroe@smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""End to end tests of the asyncio runner, over the in-process LocalBus
+"""
+
+import gc
+import asyncio
+import logging
+from datetime import datetime
+
+import pytest
+
+from mpef_oca import pipeline as pipeline_mod
+from mpef_oca.aio import AsyncRunner, BusTransport
+from mpef_oca.bus import LocalBus
+from mpef_oca.pipeline import ScenePipeline
+from mpef_oca.scheduler import SceneScheduler
+from mpef_oca.tests.test_pipeline import fake_decode, stages  # noqa: F401
+
+
+def failing_decode(filenames, area_ids, path):
+    if any('corrupt' in filename for filename in filenames):
+        raise IOError('Corrupt segment')
+    return fake_decode(filenames, area_ids, path)
+
+
+def make_scene(msg):
+    """Scene of a dict message, None if it is not a dataset"""
+
+    if msg.get('type') != 'dataset':
+        return None
+    scene = {'platform_name': 'Meteosat-10',
+             'starttime': datetime(2016, 5, 1, 12, msg['minute'])}
+    return msg['key'], scene, msg['uris']
+
+
+def make_message(key, scene, product):
+    return {'key': key, 'uri': product['filename'],
+            'area_id': product['area_id'], 'field': product['field']}
+
+
+def check_uri(uris):
+    if any(uri.startswith('remote:') for uri in uris):
+        raise IOError('Not on this host')
+    return ['/local/' + uri for uri in uris]
+
+
+async def wait_for(condition, timeout=10.):
+    loop = asyncio.get_running_loop()
+    tic = loop.time()
+    while not condition():
+        assert loop.time() - tic < timeout
+        await asyncio.sleep(0.01)
+
+
+def test_runner(stages, tmpdir, monkeypatch, caplog):  # noqa: F811
+    """Scenes announced on the bus are checked, scheduled and processed,
+    each product is announced on the sink, and failed scenes are reported
+    once"""
+
+    monkeypatch.setattr(pipeline_mod, 'decode_stage', failing_decode)
+    pipeline = ScenePipeline(stages, ['eurol'], str(tmpdir.mkdir('out')),
+                             fields=['reff'], spool_dir=str(tmpdir),
+                             parallel_decode=False)
+    scheduler = SceneScheduler(pipeline)
+    inbus = LocalBus()
+    outbus = LocalBus()
+    source = BusTransport(subscriber=inbus.subscriber(), timeout=0.05)
+    sink = BusTransport(publisher=outbus.publisher())
+    runner = AsyncRunner([source], sink, scheduler, make_scene, make_message,
+                         check_uri=check_uri)
+
+    messages = [
+        {'type': 'dataset', 'key': 'good', 'minute': 0, 'uris': ['a', 'b']},
+        {'type': 'file', 'key': 'other', 'minute': 0, 'uris': ['a']},
+        {'type': 'dataset', 'key': 'remote', 'minute': 15,
+         'uris': ['remote:a']},
+        {'type': 'dataset', 'key': 'bad', 'minute': 30,
+         'uris': ['corrupt']},
+        {'type': 'dataset', 'key': 'good', 'minute': 0, 'uris': ['a', 'b']}]
+
+    async def scenario():
+        task = asyncio.ensure_future(runner.run())
+        publisher = inbus.publisher()
+        for msg in messages:
+            publisher.send(msg)
+        await wait_for(lambda: (len(runner.results) == 2 and
+                                all(fut.done()
+                                    for fut in runner.results.values())))
+        runner.stop()
+        await asyncio.wait_for(task, 10)
+
+    with caplog.at_level(logging.INFO):
+        asyncio.run(scenario())
+        sink.close()
+        gc.collect()
+
+    assert sorted(runner.results) == ['bad', 'good']
+    assert runner.results['good'].result() == [
+        msg['uri'] for msg in outbus.sent]
+    with pytest.raises(RuntimeError, match='Scene bad failed'):
+        runner.results['bad'].result()
+
+    assert sorted((msg['area_id'], str(msg['field']))
+                  for msg in outbus.sent) == [('eurol', 'None'),
+                                              ('eurol', 'reff')]
+    assert all(msg['key'] == 'good' for msg in outbus.sent)
+
+    assert caplog.text.count('No complete OCA products for scene bad') == 1
+    assert '2 scenes done, 1 failed: bad' in caplog.text
+    assert 'never retrieved' not in caplog.text
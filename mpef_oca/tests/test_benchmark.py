@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <adam.dybbroe@smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the benchmark setup
+"""
+
+from mpef_oca import benchmark, cache, resample
+
+
+def test_private_cache(tmpdir):
+    """The benchmarks use a cache of their own, starting empty, and leave
+    the production cache as it was"""
+
+    production = cache.CACHE_DIR
+    resample._RESAMPLERS['production'] = None
+    with benchmark.private_cache(str(tmpdir)):
+        assert cache.cache_path('resample', 'area', 'key').startswith(
+            str(tmpdir))
+        assert not resample._RESAMPLERS
+    assert cache.CACHE_DIR == production
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <adam.dybbroe@smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the parallel GRIB message decoding, on a synthetic product
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from mpef_oca import oca_reader
+from mpef_oca.oca_reader import OCAData
+from mpef_oca.pipeline import index_stage, decode_message_stage, load_scene
+from mpef_oca.synthetic import make_grib_stream, write_segments
+from mpef_oca.utils import FIELDNAMES
+from mpef_oca.tests.test_oca_reader import FakeArea
+
+pytest.importorskip('pygrib')
+pytest.importorskip('trollsift')
+
+SIZE = 64
+WINDOW = (slice(8, 40), slice(4, 50))
+
+
+def _set_window(self, area_ids):
+    self._window = WINDOW
+    self.area_def = FakeArea('window', (32, 46))
+
+
+@pytest.fixture
+def segments(tmpdir, monkeypatch):
+    """LRIT segments of a synthetic product on a reduced full disk"""
+
+    monkeypatch.setattr(oca_reader, 'load_area',
+                        lambda area_id, *args: FakeArea(area_id,
+                                                        (SIZE, SIZE)))
+    return write_segments(make_grib_stream(SIZE), str(tmpdir.mkdir('lrit')),
+                          nsegments=5)
+
+
+def read_scene(segments, area_ids, nprocs=None):
+    scene = OCAData()
+    scene.read_from_lrit(segments, area_ids=area_ids)
+    scene.load(nprocs=nprocs)
+    return scene
+
+
+@pytest.mark.parametrize('window', [False, True])
+def test_parallel_decode(segments, tmpdir, monkeypatch, window):
+    """The messages decoded in a process pool, and by the pipeline decode
+    tasks, are the ones decoded serially"""
+
+    area_ids = None
+    if window:
+        monkeypatch.setattr(OCAData, '_set_window', _set_window)
+        area_ids = ['window']
+
+    path, tasks = index_stage(segments, area_ids, str(tmpdir.join('full')))
+    assert len(tasks) == 12
+    for args in tasks:
+        decode_message_stage(*args)
+    assert not [name for name in os.listdir(path) if name.endswith('.grb')]
+
+    expected = read_scene(segments, area_ids)
+    for scene in [read_scene(segments, area_ids, nprocs=3),
+                  load_scene(path)]:
+        for item in FIELDNAMES:
+            for attr, name in zip(['data', 'error'], FIELDNAMES[item]):
+                if not name:
+                    continue
+                want = getattr(getattr(expected, item), attr)
+                got = getattr(getattr(scene, item), attr)
+                assert got.shape == expected.area_def.shape
+                np.testing.assert_array_equal(np.ma.getmaskarray(got),
+                                              np.ma.getmaskarray(want))
+                np.testing.assert_array_equal(np.ma.getdata(got),
+                                              np.ma.getdata(want))
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <adam.dybbroe@smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the message handling of the extractor runner, over the
+in-process LocalBus
+"""
+
+import os
+import time
+import importlib.util
+from datetime import datetime
+
+import pytest
+
+from mpef_oca.bus import LocalBus
+
+pytest.importorskip('netifaces')
+message = pytest.importorskip('posttroll.message')
+
+SCRIPT = os.path.join(os.path.dirname(__file__), '..', '..', 'scr',
+                      'mpef_oca_extractor.py')
+
+CONFIG = """[DEFAULT]
+posttroll_topic=/2/lrit/0deg
+processes = 1
+
+[offline]
+output_path = %s
+"""
+
+
+@pytest.fixture
+def extractor(tmpdir, monkeypatch):
+    """The extractor script, loaded with a config in *tmpdir*"""
+
+    tmpdir.join('mpef_oca_config.cfg').write(CONFIG % str(tmpdir))
+    monkeypatch.setenv('MPEF_OCA_CONFIG_DIR', str(tmpdir))
+    monkeypatch.setenv('SMHI_MODE', 'offline')
+    spec = importlib.util.spec_from_file_location('mpef_oca_extractor',
+                                                  SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def dataset_message(platform_name='MSG3', minute=0):
+    start_time = datetime(2016, 5, 1, 12, minute)
+    return message.Message('/2/lrit/0deg', 'dataset',
+                           {'platform_name': platform_name,
+                            'start_time': start_time,
+                            'sensor': 'seviri',
+                            'dataset': [{'uri': '/data/segment_%d' % seg}
+                                        for seg in range(1, 4)]})
+
+
+def wait_for(condition, timeout=5.):
+    tic = time.time()
+    while not condition():
+        if time.time() - tic > timeout:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_listener(extractor):
+    """The listener passes on the dataset messages only"""
+
+    from queue import Queue
+
+    bus = LocalBus()
+    queue = Queue()
+    listener = extractor.FileListener(
+        queue, subscriber=bus.subscriber(topics=['/2/lrit/0deg']))
+    listener.start()
+    publisher = bus.publisher()
+    try:
+        wanted = dataset_message()
+        publisher.send(message.Message('/2/lrit/0deg', 'file',
+                                       {'uri': '/data/segment_1'}))
+        publisher.send(message.Message('/other/topic', 'dataset',
+                                       wanted.data))
+        publisher.send(wanted)
+        assert queue.get(timeout=5) is wanted
+    finally:
+        listener.stop()
+        publisher.send(dataset_message(minute=15))
+        listener.join(5)
+    assert not listener.is_alive()
+
+
+def test_scene_from_message(extractor):
+    key, scene, uris = extractor.scene_from_message(dataset_message())
+    assert key == 'Meteosat-10_201605011200'
+    assert scene['platform_name'] == 'Meteosat-10'
+    assert uris == ['/data/segment_1', '/data/segment_2', '/data/segment_3']
+    assert extractor.scene_from_message(dataset_message('NOAA19')) is None
+
+
+def test_publisher(extractor):
+    """Each product put on the publish queue is announced with its area,
+    field and timings"""
+
+    from queue import Queue
+
+    bus = LocalBus(decode=lambda raw: message.Message(rawstr=raw))
+    subscriber = bus.subscriber()
+    queue = Queue()
+    publisher = extractor.FilePublisher(queue, publisher=bus.publisher())
+    publisher.start()
+
+    key, scene, _ = extractor.scene_from_message(dataset_message())
+    now = time.time()
+    try:
+        for field in [None, 'ul_ctp']:
+            extractor.publish_product(
+                queue, key, scene,
+                {'filename': '/out/product_%s' % field, 'area_id': 'eurol',
+                 'field': field, 'format': 'GeoTIFF', 'written_at': now,
+                 'task_time': 1.5, 'scene_latency': 12.})
+        assert wait_for(lambda: len(bus.sent) == 2)
+    finally:
+        publisher.stop()
+        publisher.join(5)
+
+    first = next(subscriber.recv(timeout=1))
+    assert first.data['uri'].endswith('/out/product_None')
+    assert first.data['area_id'] == 'eurol'
+    assert 'product' not in first.data
+    assert first.data['processing_time'] == 1.5
+    second = next(subscriber.recv(timeout=1))
+    assert second.data['product'] == 'ul_ctp'
+    assert second.data['type'] == 'GeoTIFF'
+    assert second.data['scene_latency'] == 12.
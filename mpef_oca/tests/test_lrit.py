@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <adam.dybbroe@smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the LRIT segment reading
+"""
+
+import os
+
+import pytest
+
+from mpef_oca import oca_reader
+from mpef_oca.oca_reader import OCAData
+from mpef_oca.synthetic import make_grib_stream, write_segments
+from mpef_oca.tests.test_oca_reader import FakeArea
+
+pytest.importorskip('trollsift')
+
+
+@pytest.fixture
+def segments(tmpdir, monkeypatch):
+    """LRIT segments of a small synthetic product"""
+
+    monkeypatch.setattr(oca_reader, 'load_area',
+                        lambda area_id, *args: FakeArea(area_id, (32, 32)))
+    return write_segments(make_grib_stream(32), str(tmpdir), nsegments=4)
+
+
+def test_missing_segment(segments):
+    """A missing segment is an error, not a corrupt GRIB stream"""
+
+    os.remove(segments[2])
+    with pytest.raises(IOError, match='Missing LRIT segments 3 of 1 to 4'):
+        OCAData().read_from_lrit(segments[:2] + segments[3:])
+
+
+def test_last_segment_missing(segments):
+    with pytest.raises(IOError, match='Missing LRIT segments 4 of 1 to 4'):
+        OCAData().read_from_lrit(segments[:3])
+
+
+def test_short_segment(segments):
+    """A truncated segment is an error"""
+
+    with open(segments[1], 'r+b') as fpt:
+        fpt.truncate(os.path.getsize(segments[1]) - 10)
+    with pytest.raises(IOError, match='Short read'):
+        OCAData().read_from_lrit(segments)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <adam.dybbroe@smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the stage metrics
+"""
+
+import sys
+import time
+import resource
+import threading
+
+import numpy as np
+import pytest
+
+from mpef_oca import metrics
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'),
+                    reason='needs /proc/self/statm')
+def test_stage_rss():
+    """The stage records the memory of the process during the stage, not the
+    peak over the process lifetime"""
+
+    big = np.ones(64 * 1024 * 1024, dtype=np.uint8)
+    del big
+
+    with metrics.measure('small') as stage:
+        small = np.ones(1024, dtype=np.uint8)
+    record = stage.record
+    assert abs(record['rss_growth']) < 16 * 1024 * 1024
+    lifetime_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    assert record['rss'] < lifetime_peak - 32 * 1024 * 1024
+
+    with metrics.measure('large') as stage:
+        large = np.ones(64 * 1024 * 1024, dtype=np.uint8)
+    assert stage.record['rss_growth'] > 32 * 1024 * 1024
+    del small, large
+
+    text = metrics.REGISTRY.text()
+    assert 'mpef_oca_stage_rss_growth_bytes{stage="large"}' in text
+
+
+def test_capture_per_thread():
+    """Tasks sharing the threads of a pool keep their own records and scene
+    tags"""
+
+    started = threading.Barrier(2)
+    captured = {}
+
+    def _task(key, wait):
+        metrics.capture(key)
+        started.wait()
+        with metrics.measure('decode', field=key):
+            pass
+        if wait:
+            time.sleep(0.1)
+        with metrics.measure('project', field=key):
+            pass
+        captured[key] = metrics.drain()
+
+    threads = [threading.Thread(target=_task, args=(key, wait))
+               for key, wait in [('first', False), ('second', True)]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for key in ['first', 'second']:
+        assert [(record['stage'], record['scene'], record['field'])
+                for record in captured[key]] == [('decode', key, key),
+                                                 ('project', key, key)]
+    assert metrics.get_scene() is None
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <adam.dybbroe@smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the OCA scene projection
+"""
+
+import numpy as np
+import pytest
+
+from mpef_oca import oca_reader
+from mpef_oca.oca_reader import OCAData
+from mpef_oca.resample import get_resampler
+from mpef_oca.utils import FIELDNAMES, get_encoding
+
+
+class FakeArea(object):
+
+    """The attributes of a pyresample area definition used by the reader"""
+
+    def __init__(self, area_id, shape):
+        self.area_id = area_id
+        self.name = area_id
+        self.proj_id = area_id
+        self.proj_dict = {'proj': 'geos'}
+        self.proj4_string = '+proj=geos'
+        self.shape = shape
+        self.area_extent = (0., 0., 1000. * shape[1], 1000. * shape[0])
+
+
+def make_values(item, attr, shape, rng):
+    """Random physical values of the array *attr* of *item*, in the ranges
+    of the product"""
+
+    if item == 'scenetype':
+        values = rng.choice([111., 112., 113.], size=shape)
+    elif item.endswith('ctp'):
+        values = rng.uniform(10000., 100000., shape)
+    elif item == 'reff':
+        values = rng.uniform(1e-6, 6e-5, shape)
+    elif item == 'cost':
+        values = rng.uniform(0., 300., shape)
+    else:
+        values = rng.uniform(-1., 2.5, shape)
+    if attr == 'error':
+        values = values / 10.
+    return np.ma.masked_array(values, rng.uniform(size=shape) < 0.1)
+
+
+@pytest.fixture
+def areas(tmpdir, monkeypatch):
+    """A source and a target area, with the neighbour lookup in place"""
+
+    area_file = tmpdir.join('areas.def')
+    area_file.write('')
+    monkeypatch.setattr(oca_reader, 'AREA_DEF_FILE', str(area_file))
+
+    source = FakeArea('source', (20, 30))
+    target = FakeArea('target', (10, 12))
+    monkeypatch.setattr(OCAData, '_load_areas',
+                        staticmethod(lambda area_ids: [target]))
+
+    rng = np.random.RandomState(0)
+    index = rng.randint(-1, 20 * 30, size=target.shape).astype(np.int32)
+    get_resampler(source, target, radius_of_influence=20000,
+                  area_file=str(area_file),
+                  cache_dir=str(tmpdir))._set_index(index)
+    return source, target
+
+
+def make_scene(area_def, compact=False, scaled=False):
+    """A scene with all the fields loaded, the same for each storage
+    mode"""
+
+    rng = np.random.RandomState(1)
+    scene = OCAData(area_def=area_def, compact=compact, scaled=scaled)
+    for item in FIELDNAMES:
+        for attr, name in zip(['data', 'error'], FIELDNAMES[item]):
+            if name:
+                values = make_values(item, attr, area_def.shape, rng)
+                setattr(getattr(scene, item), attr,
+                        scene._compacted(item, attr, values))
+    return scene
+
+
+@pytest.mark.parametrize('compact, scaled', [(True, False), (False, True)])
+def test_project_compact(areas, compact, scaled):
+    """Compact and scaled scenes project like the plain scene"""
+
+    source, target = areas
+    expected = make_scene(source).project_many(['target'])[0]
+    result = make_scene(source, compact, scaled).project_many(['target'])[0]
+
+    for item in FIELDNAMES:
+        for attr, name in zip(['data', 'error'], FIELDNAMES[item]):
+            if not name:
+                continue
+            want = getattr(getattr(expected, item), attr)
+            got = getattr(getattr(result, item), attr)
+            assert got.shape == target.shape
+            np.testing.assert_array_equal(np.ma.getmaskarray(got),
+                                          np.ma.getmaskarray(want))
+            valid = ~np.ma.getmaskarray(want)
+            encoding = get_encoding(item, attr, scaled)
+            if encoding.scaled:
+                atol = encoding.scale_factor / 2.
+            else:
+                atol = 1e-6 * np.abs(np.ma.getdata(want)[valid]).max()
+            np.testing.assert_allclose(np.ma.getdata(got)[valid],
+                                       np.ma.getdata(want)[valid],
+                                       rtol=0, atol=atol)
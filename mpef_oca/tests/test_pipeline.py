@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <adam.dybbroe@smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the stage parallel scene pipeline
+"""
+
+import os
+import time
+import threading
+from datetime import datetime
+from multiprocessing.pool import ThreadPool
+
+import pytest
+
+from mpef_oca import pipeline as pipeline_mod
+from mpef_oca.pipeline import ScenePipeline
+
+
+class HungPool(object):
+
+    """A pool whose tasks never complete"""
+
+    def __init__(self):
+        self.tasks = []
+
+    def apply_async(self, func, args=(), kwds=None, callback=None,
+                    error_callback=None):
+        self.tasks.append((func, args, callback, error_callback))
+
+
+def make_scene(minute=0):
+    return {'platform_name': 'Meteosat-10',
+            'starttime': datetime(2016, 5, 1, 12, minute),
+            'filenames': ['segment']}
+
+
+def fake_decode(filenames, area_ids, path):
+    os.makedirs(path)
+    return path
+
+
+def fake_index(filenames, area_ids, path):
+    os.makedirs(path)
+    return path, [(name, os.path.join(path, name))
+                  for name in ['25', '26', '27']]
+
+
+def fake_decode_message(name, prefix):
+    with open(prefix + '.npy', 'w') as fpt:
+        fpt.write(name)
+    return name
+
+
+def fake_project(scene_path, area_id, path):
+    os.makedirs(path)
+    return path
+
+
+def fake_netcdf(scene_path, filename):
+    tic = time.time()
+    with open(filename, 'w') as fpt:
+        fpt.write('nc')
+    return [pipeline_mod._product(filename, tic,
+                                  area_id=os.path.basename(scene_path),
+                                  field=None)]
+
+
+def fake_render(scene_path, field, prefix, render_func=None):
+    tic = time.time()
+    if field == 'broken':
+        raise ValueError('cannot render %s' % field)
+    filename = '%s_%s.tif' % (prefix, field)
+    with open(filename, 'w') as fpt:
+        fpt.write(field)
+    return [pipeline_mod._product(filename, tic,
+                                  area_id=os.path.basename(scene_path),
+                                  field=field)]
+
+
+@pytest.fixture
+def stages(monkeypatch):
+    """Stage functions working on empty files only, run on a thread pool"""
+
+    monkeypatch.setattr(pipeline_mod, 'decode_stage', fake_decode)
+    monkeypatch.setattr(pipeline_mod, 'index_stage', fake_index)
+    monkeypatch.setattr(pipeline_mod, 'decode_message_stage',
+                        fake_decode_message)
+    monkeypatch.setattr(pipeline_mod, 'project_stage', fake_project)
+    monkeypatch.setattr(pipeline_mod, 'netcdf_stage', fake_netcdf)
+    monkeypatch.setattr(pipeline_mod, 'render_stage', fake_render)
+    pool = ThreadPool(3)
+    yield pool
+    pool.close()
+    pool.join()
+
+
+def run_scenes(pool, tmpdir, fields, keys, parallel_decode=False):
+    """Run the scenes *keys* through a pipeline, and get the products
+    announced and the scene outcomes"""
+
+    products = []
+    scenes = {}
+    outdir = tmpdir.mkdir('out')
+    pipeline = ScenePipeline(
+        pool, ['eurol', 'scan'], str(outdir), fields=fields,
+        spool_dir=str(tmpdir), parallel_decode=parallel_decode,
+        on_product=lambda key, scene, product: products.append(
+            (key, product)),
+        on_scene=lambda key, written, failed: scenes.update(
+            {key: (written, failed)}))
+    for minute, key in enumerate(keys):
+        pipeline.submit(key, make_scene(minute))
+    pipeline.join()
+    return outdir, products, scenes
+
+
+def test_pipeline(stages, tmpdir):
+    """Each scene gives a NetCDF file and an image per field for each area,
+    each announced as it is written, and its spool is removed"""
+
+    outdir, products, scenes = run_scenes(stages, tmpdir, ['ul_ctp', 'reff'],
+                                          ['first', 'second'])
+
+    assert sorted(scenes) == ['first', 'second']
+    for key in scenes:
+        written, failed = scenes[key]
+        assert not failed
+        assert len(written) == 2 * 3
+        assert all(os.path.exists(filename) for filename in written)
+        announced = [product for name, product in products if name == key]
+        assert (sorted(product['filename'] for product in announced) ==
+                sorted(written))
+        assert set(product['area_id'] for product in announced) == set(
+            ['eurol', 'scan'])
+        assert all(product['scene_latency'] >= 0 for product in announced)
+    assert len(os.listdir(str(outdir))) == 12
+    assert [name for name in os.listdir(str(tmpdir))
+            if name.startswith('oca_')] == []
+
+
+def test_pipeline_parallel_decode(stages, tmpdir, monkeypatch):
+    """With the default parallel decode, each message of a scene is decoded
+    by a task of its own, and the scene is projected once all are done"""
+
+    decoded = []
+
+    def _decode_message(name, prefix):
+        decoded.append(name)
+        return fake_decode_message(name, prefix)
+
+    def _project(scene_path, area_id, path):
+        assert sorted(os.listdir(scene_path)) == ['25.npy', '26.npy',
+                                                  '27.npy']
+        return fake_project(scene_path, area_id, path)
+
+    monkeypatch.setattr(pipeline_mod, 'decode_message_stage',
+                        _decode_message)
+    monkeypatch.setattr(pipeline_mod, 'project_stage', _project)
+    assert ScenePipeline(stages, [], '').parallel_decode
+
+    outdir, products, scenes = run_scenes(stages, tmpdir, ['reff'],
+                                          ['first', 'second'],
+                                          parallel_decode=True)
+    assert sorted(decoded) == ['25', '25', '26', '26', '27', '27']
+    for key in ['first', 'second']:
+        written, failed = scenes[key]
+        assert not failed
+        assert len(written) == 2 * 2
+
+
+def test_pipeline_failed_stage(stages, tmpdir):
+    """A failing task fails its scene, the other products are still
+    written, and the next scene runs"""
+
+    outdir, products, scenes = run_scenes(stages, tmpdir, ['reff', 'broken'],
+                                          ['first', 'second'])
+    for key in ['first', 'second']:
+        written, failed = scenes[key]
+        assert failed
+        assert len(written) == 2 * 2
+
+
+def test_submit_releases_slot_on_spool_error(tmpdir):
+    """A scene whose spool cannot be made does not keep its slot"""
+
+    pipeline = ScenePipeline(HungPool(), ['eurol'], str(tmpdir),
+                             max_scenes=1,
+                             spool_dir=str(tmpdir.join('missing')))
+    for _ in range(2):
+        with pytest.raises(OSError):
+            pipeline.submit('scene', make_scene())
+    assert pipeline._slots.acquire(False)
+
+
+def test_scene_timeout(tmpdir):
+    """A scene with a task that never completes is failed after the scene
+    timeout, its slot freed, and the late result dropped"""
+
+    pool = HungPool()
+    done = []
+    pipeline = ScenePipeline(pool, ['eurol'], str(tmpdir), max_scenes=1,
+                             spool_dir=str(tmpdir), scene_timeout=0.2,
+                             on_scene=lambda *args: done.append(args))
+    pipeline.submit('first', make_scene())
+    spool = pool.tasks[0][1][4]
+    assert os.path.isdir(os.path.dirname(spool))
+
+    # Blocks until the first scene times out
+    tic = time.time()
+    pipeline.submit('second', make_scene(15))
+    assert time.time() - tic < 5
+    assert done == [('first', [], True)]
+    assert not os.path.exists(os.path.dirname(spool))
+    assert pipeline._inflight['decode'] == 1
+
+    # The late result of the first scene does not disturb the second
+    pool.tasks[0][2](((os.path.dirname(spool), []), []))
+    assert pipeline._inflight['decode'] == 1
+    assert len(done) == 1
+    pipeline.join()
+    assert [key for key, _, _ in done] == ['first', 'second']
+
+    # The watchdog is stopped on close
+    watchdog = pipeline._watchdog
+    assert watchdog.is_alive()
+    pipeline.close()
+    assert not watchdog.is_alive()
+
+
+def test_bounded_queues(tmpdir):
+    """Submit waits while the decode queue is full, and no decode task is
+    started while the project queue is full"""
+
+    pool = HungPool()
+    pipeline = ScenePipeline(pool, ['eurol', 'scan'], str(tmpdir),
+                             max_scenes=4, max_tasks=1, max_queued=1,
+                             spool_dir=str(tmpdir))
+    pipeline.submit('first', make_scene())
+    pipeline.submit('second', make_scene(15))
+    assert len(pool.tasks) == 1
+    assert pipeline.full
+
+    third = threading.Thread(target=pipeline.submit,
+                             args=('third', make_scene(30)))
+    third.start()
+    time.sleep(0.2)
+    assert third.is_alive()
+
+    def _complete(number):
+        func, args, callback, _ = pool.tasks[number]
+        callback(((args[4], []), []))
+
+    def _stages():
+        return [task[1][1] for task in pool.tasks]
+
+    # Indexing the first scene starts the decode of the second, and makes
+    # room for the third
+    _complete(0)
+    third.join(5)
+    assert not third.is_alive()
+    assert _stages() == [pipeline_mod.index_stage, pipeline_mod.project_stage,
+                         pipeline_mod.index_stage]
+    assert len(pipeline._queues['project']) == 1
+
+    # The project queue is full, so the third scene is not decoded yet
+    _complete(2)
+    assert len(pool.tasks) == 3
+    assert len(pipeline._queues['project']) == 3
+    assert len(pipeline._queues['decode']) == 1
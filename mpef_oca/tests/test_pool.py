@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <adam.dybbroe@smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the warm worker pool
+"""
+
+import os
+import signal
+
+import pytest
+
+from mpef_oca.pool import WarmPool
+
+
+def square(value):
+    return value * value
+
+
+def fail(message):
+    raise ValueError(message)
+
+
+def die():
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def getpid():
+    return os.getpid()
+
+
+@pytest.fixture
+def pool():
+    pool = WarmPool(2, poll_interval=0.05)
+    yield pool
+    pool.close()
+    pool.join()
+
+
+def test_results(pool):
+    results = [pool.apply_async(square, (value, )) for value in range(10)]
+    values = [result.get(10) for result in results]
+    assert values == [value * value for value in range(10)]
+
+    errors = []
+    result = pool.apply_async(fail, ('boom', ), error_callback=errors.append)
+    with pytest.raises(RuntimeError, match='boom'):
+        result.get(10)
+    assert 'ValueError' in errors[0]
+
+
+def test_dead_worker(pool):
+    """A worker killed while running a task fails that task, and is
+    replaced"""
+
+    errors = []
+    result = pool.apply_async(die, error_callback=errors.append)
+    with pytest.raises(RuntimeError, match='died with exit code -9'):
+        result.get(10)
+    assert len(errors) == 1
+
+    results = [pool.apply_async(square, (value, )) for value in range(4)]
+    assert [result.get(10) for result in results] == [0, 1, 4, 9]
+    assert len(pool._workers) == 2
+
+
+def test_recycle():
+    """Workers above the RSS limit are replaced without losing tasks"""
+
+    pool = WarmPool(2, max_rss=1, poll_interval=0.05)
+    results = [pool.apply_async(getpid) for _ in range(6)]
+    pids = [result.get(10) for result in results]
+    pool.close()
+    pool.join()
+    assert len(set(pids)) == 6
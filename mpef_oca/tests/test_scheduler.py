@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <adam.dybbroe@smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the latest first scene scheduler
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from mpef_oca.scheduler import SceneScheduler, DEFER
+
+
+class FakePipeline(object):
+
+    """Records the scenes submitted; the test finishes them"""
+
+    def __init__(self, max_scenes=1):
+        self.max_scenes = max_scenes
+        self.full = False
+        self.on_scene = None
+        self.submitted = []
+
+    def submit(self, key, scene):
+        self.submitted.append(key)
+
+    def finish(self, key, failed=False):
+        self.on_scene(key, ['%s.nc' % key], failed)
+
+
+def scene(minutes_ago):
+    return {'starttime': datetime.utcnow() - timedelta(minutes=minutes_ago)}
+
+
+def test_newest_first():
+    pipeline = FakePipeline()
+    scheduler = SceneScheduler(pipeline)
+    results = [scheduler.add(key, scene(age)) for key, age in
+               [('a', 45), ('b', 30), ('c', 15), ('d', 60)]]
+    assert pipeline.submitted == ['a']
+    assert len(scheduler) == 3
+
+    for key in ['a', 'c', 'b']:
+        pipeline.finish(key)
+    assert pipeline.submitted == ['a', 'c', 'b', 'd']
+    assert results[0].get(1) == ['a.nc']
+    assert scheduler.inflight == 1
+
+
+def test_full_pipeline():
+    """Scenes are held back while the pipeline is full"""
+
+    pipeline = FakePipeline(max_scenes=2)
+    scheduler = SceneScheduler(pipeline)
+    scheduler.add('a', scene(5))
+    pipeline.full = True
+    scheduler.add('b', scene(0))
+    assert pipeline.submitted == ['a']
+
+    pipeline.full = False
+    pipeline.finish('a')
+    assert pipeline.submitted == ['a', 'b']
+
+
+def test_duplicates():
+    """A scene is ignored while waiting, in flight, and for block_for
+    seconds after it is done"""
+
+    pipeline = FakePipeline()
+    scheduler = SceneScheduler(pipeline, block_for=300)
+    assert scheduler.add('a', scene(5)) is not None
+    assert scheduler.add('a', scene(5)) is None
+    assert scheduler.add('b', scene(0)) is not None
+    assert scheduler.add('b', scene(0)) is None
+
+    pipeline.finish('a', failed=True)
+    pipeline.finish('b')
+    assert scheduler.add('a', scene(5)) is None
+    assert pipeline.submitted == ['a', 'b']
+
+    scheduler = SceneScheduler(FakePipeline(), block_for=0)
+    scheduler.add('a', scene(5))
+    scheduler.pipeline.finish('a')
+    assert scheduler.add('a', scene(5)) is not None
+
+
+def test_failed_result():
+    pipeline = FakePipeline()
+    scheduler = SceneScheduler(pipeline)
+    result = scheduler.add('a', scene(0))
+    pipeline.finish('a', failed=True)
+    with pytest.raises(RuntimeError, match='Scene a failed'):
+        result.get(1)
+
+
+def test_stale():
+    """Stale scenes are dropped, or deferred behind the fresh ones"""
+
+    pipeline = FakePipeline()
+    scheduler = SceneScheduler(pipeline, max_age=3600)
+    scheduler.add('fresh', scene(0))
+    stale = scheduler.add('stale', scene(120))
+    scheduler.add('newer', scene(-5))
+    pipeline.finish('fresh')
+    pipeline.finish('newer')
+    assert pipeline.submitted == ['fresh', 'newer']
+    with pytest.raises(RuntimeError, match='stale'):
+        stale.get(1)
+
+    pipeline = FakePipeline()
+    scheduler = SceneScheduler(pipeline, max_age=3600, stale=DEFER)
+    scheduler.add('first', scene(0))
+    scheduler.add('stale', scene(120))
+    scheduler.add('fresh', scene(10))
+    pipeline.finish('first')
+    pipeline.finish('fresh')
+    assert pipeline.submitted == ['first', 'fresh', 'stale']
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <adam.dybbroe@smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the palette lookup and the field encodings
+"""
+
+import logging
+
+import numpy as np
+
+from mpef_oca.utils import CPP_COLORS, palette_index
+
+
+def test_cot_palette_index():
+    """log10 COT values land where the log palette puts the COT"""
+
+    values = np.linspace(-1., 2.8, 1000)
+    max_value = CPP_COLORS['cot'].breaks[-1][0]
+    expected = (np.log(10 ** values + 1) * 256 / np.log(max_value))
+    expected = np.maximum(expected.astype(int), 1)
+
+    index = palette_index('ul_cot', np.ma.masked_array(values))
+    np.testing.assert_array_equal(index, expected)
+    assert index.min() < 10
+    assert index.max() > 240
+
+
+def test_baseline_palette_index():
+    """The pressures and the scene type get the palette indices of the
+    original make_image"""
+
+    ctp = np.ma.masked_array(np.append(np.linspace(10000., 100000., 5001),
+                                       np.arange(10000., 100001., 5000.)))
+    np.testing.assert_array_equal(palette_index('ul_ctp', ctp),
+                                  (22. - ctp / 5000.).astype('int16'))
+
+    scenetype = np.ma.masked_array([0., 111., 112., 113.])
+    np.testing.assert_array_equal(palette_index('scenetype', scenetype),
+                                  scenetype.astype('uint8'))
+
+
+def test_reff_palette_index():
+    """The effective radius (m) lands on the log palette intervals, which
+    change colour tone at 10 and 20 microns"""
+
+    max_value = CPP_COLORS['reff'].breaks[-1][0]
+    index = palette_index('reff', np.ma.masked_array([9e-6, 11e-6,
+                                                      19e-6, 21e-6]))
+    breaks = [int(np.log(microns + 1) * 256 / np.log(max_value))
+              for microns in [10, 20]]
+    assert index[0] < breaks[0] <= index[1]
+    assert index[2] < breaks[1] <= index[3]
+
+
+def test_palette_index_outside(caplog):
+    """Values outside the palette range are flagged, not clipped into it"""
+
+    data = np.ma.masked_array([50000., 120000., 130000., 0.],
+                              [False, False, True, False])
+    with caplog.at_level(logging.WARNING):
+        index = palette_index('ul_ctp', data)
+    np.testing.assert_array_equal(index, [12, 0, 0, 0])
+    assert '2 ul_ctp values outside' in caplog.text
+
+    index = palette_index('cost', np.ma.masked_array([0., 150., 1000.]))
+    np.testing.assert_array_equal(index, [1, 127, 255])
+
+
+def test_netcdf_packing_range(caplog):
+    """The packed cost covers its physical range, and values beyond the
+    packing are masked instead of clipped to the limit"""
+
+    from mpef_oca.utils import NETCDF_PACKING
+
+    encoding = NETCDF_PACKING[('cost', 'data')]
+    low, high = encoding.valid_range
+    assert low <= 0. and high > 6000.
+
+    data = np.ma.masked_array([0., 4000.5, 1e5, -50.], [False] * 4)
+    with caplog.at_level(logging.WARNING):
+        stored = encoding.encode(data, 'cost')
+    assert '2 cost values outside' in caplog.text
+    decoded = encoding.decode(np.ma.masked_equal(stored,
+                                                 encoding.fill_value))
+    np.testing.assert_array_equal(np.ma.getmaskarray(decoded),
+                                  [False, False, True, True])
+    np.testing.assert_allclose(decoded[:2], [0., 4000.5], atol=0.05)
@@ -23,9 +23,22 @@
 """Some helper functions and definitions for the OCA product reader and image generator
 """
 
+import logging
 import numpy as np
-from mpop.imageo import palettes
 
+LOG = logging.getLogger(__name__)
+
+
+SATELLITE = {'MSG3': 'Meteosat-10',
+             'MSG2': 'Meteosat-09',
+             'MSG1': 'Meteosat-08',
+             'MSG4': 'Meteosat-11',
+             }
+
+SAT_FILE_PREFIX = {'Meteosat-10': 'met10',
+                   'Meteosat-09': 'met09',
+                   'Meteosat-08': 'met08',
+                   'Meteosat-11': 'met11'}
 
 SCENE_TYPE_LAYERS = {111: 'Single Layer Water Cloud',
                      112: 'Single Layer Ice Cloud',
@@ -64,6 +77,154 @@ FIELDNAMES = {'scenetype': ('Pixel scene type', None),
               'll_ctp': ('32', '34')}
 
 
+class FieldEncoding(object):
+
+    """Storage type of an OCA array. With a scale factor and/or offset the
+    physical values are stored * scale_factor + add_offset"""
+
+    def __init__(self, dtype, scale_factor=None, add_offset=None,
+                 fill_value=0):
+        self.dtype = np.dtype(dtype)
+        self.scale_factor = scale_factor
+        self.add_offset = add_offset
+        self.fill_value = fill_value
+
+    @property
+    def scaled(self):
+        return self.scale_factor is not None or self.add_offset is not None
+
+    @property
+    def valid_range(self):
+        """The physical range of the values that can be stored, for a
+        scaled encoding (the fill value excluded)"""
+
+        info = np.iinfo(self.dtype)
+        low = info.min + 1 if self.fill_value == info.min else info.min
+        high = info.max - 1 if self.fill_value == info.max else info.max
+        return (low * (self.scale_factor or 1.) + (self.add_offset or 0.),
+                high * (self.scale_factor or 1.) + (self.add_offset or 0.))
+
+    def encode(self, data, name=None):
+        """Get the stored values of the physical values *data* (masked values
+        get the fill value). With a scaled encoding, values outside the valid
+        range are stored as the fill value too, and logged"""
+
+        mask = np.ma.getmaskarray(data)
+        data = np.ma.getdata(data)
+        if self.scaled:
+            stored = np.array(data, dtype=np.float32)
+            if self.add_offset:
+                stored -= self.add_offset
+            if self.scale_factor:
+                stored /= self.scale_factor
+            np.rint(stored, out=stored)
+            low, high = self.valid_range
+            with np.errstate(invalid='ignore'):
+                outside = ~((data >= low) & (data <= high)) & ~mask
+            noutside = np.count_nonzero(outside)
+            if noutside:
+                LOG.warning("%d %s values outside the packed range "
+                            "[%g, %g] are masked", noutside,
+                            name or 'field', low, high)
+                mask = mask | outside
+            stored[mask] = 0
+            info = np.iinfo(self.dtype)
+            np.clip(stored, info.min, info.max, out=stored)
+            stored = stored.astype(self.dtype)
+        else:
+            stored = np.array(data, dtype=self.dtype)
+        stored[mask] = self.fill_value
+        return stored
+
+    def decode(self, stored):
+        """Get the physical values of the (masked) array *stored*"""
+
+        if not self.scaled:
+            return stored
+        data = np.ma.getdata(stored).astype(np.float32)
+        if self.scale_factor:
+            data *= self.scale_factor
+        if self.add_offset:
+            data += self.add_offset
+        return np.ma.masked_array(data, np.ma.getmask(stored))
+
+
+class PackedArray(object):
+
+    """A masked array held in a compact storage type, see FieldEncoding, with
+    a bit packed mask"""
+
+    def __init__(self, data, encoding):
+        self.encoding = encoding
+        self.shape = data.shape
+        self.values = encoding.encode(data)
+        mask = np.ma.getmaskarray(data)
+        self.mask_bits = np.packbits(mask.ravel()) if mask.any() else None
+
+    @property
+    def nbytes(self):
+        if self.mask_bits is None:
+            return self.values.nbytes
+        return self.values.nbytes + self.mask_bits.nbytes
+
+    def mask(self):
+        """Get the unpacked boolean mask"""
+
+        if self.mask_bits is None:
+            return np.zeros(self.shape, dtype=bool)
+        size = self.shape[0] * self.shape[1]
+        return np.unpackbits(
+            self.mask_bits)[:size].reshape(self.shape).astype(bool)
+
+    def masked(self):
+        """Get the stored values as a masked array"""
+
+        return np.ma.masked_array(self.values, self.mask())
+
+    def physical(self):
+        """Get the physical values as a masked array"""
+
+        return self.encoding.decode(self.masked())
+
+
+#: Compact storage: float32 for continuous fields, uint8 for the scene type
+COMPACT_ENCODINGS = {'scenetype': FieldEncoding(np.uint8),
+                     'default': FieldEncoding(np.float32)}
+
+#: Scaled int16 storage of the pressures and the errors, keyed by
+#: (field, 'data' or 'error')
+SCALED_ENCODINGS = {
+    ('ul_ctp', 'data'): FieldEncoding(np.int16, 5., 0., -32768),
+    ('ll_ctp', 'data'): FieldEncoding(np.int16, 5., 0., -32768),
+    ('ul_ctp', 'error'): FieldEncoding(np.int16, 5., 0., -32768),
+    ('ll_ctp', 'error'): FieldEncoding(np.int16, 5., 0., -32768),
+    ('ul_cot', 'error'): FieldEncoding(np.int16, 0.001, 0., -32768),
+    ('ll_cot', 'error'): FieldEncoding(np.int16, 0.001, 0., -32768),
+    ('reff', 'error'): FieldEncoding(np.int16, 1e-8, 0., -32768)}
+
+
+#: Scale/offset int16 packing of all the fields in NetCDF output, keyed by
+#: (field, 'data' or 'error'). The cost is offset to cover 0-6553.4, the
+#: optical thickness (log10) -327.67-327.67. Values beyond the valid range of
+#: a packing are masked, see FieldEncoding.encode
+NETCDF_PACKING = dict(SCALED_ENCODINGS)
+NETCDF_PACKING.update({
+    ('scenetype', 'data'): FieldEncoding(np.int16, 1., 0., -32768),
+    ('cost', 'data'): FieldEncoding(np.int16, 0.1, 3276.7, -32768),
+    ('ul_cot', 'data'): FieldEncoding(np.int16, 0.01, 0., -32768),
+    ('ll_cot', 'data'): FieldEncoding(np.int16, 0.01, 0., -32768),
+    ('reff', 'data'): FieldEncoding(np.int16, 1e-8, 0., -32768)})
+
+
+def get_encoding(field, attr='data', scaled=False):
+    """Get the compact storage of the array *attr* of *field*. With *scaled*
+    the pressures and errors are stored as scaled int16"""
+
+    if scaled and (field, attr) in SCALED_ENCODINGS:
+        return SCALED_ENCODINGS[(field, attr)]
+    return COMPACT_ENCODINGS.get(field, COMPACT_ENCODINGS['default'])
+
+
 class LogColors(object):
 
     """
@@ -90,10 +251,12 @@ class LogColors(object):
         b_last, rgb_last = self.breaks[0]
         for b, rgb in self.breaks[1:]:
             # Get a slice of the palette array for the current interval
-            p = palette[
-                np.log(b_last + 1) * N / np.log(max_value):np.log(b + 1) * N / np.log(max_value)]
-            for i in range(3):  # red, green, blue
-                p[:, i] = np.linspace(rgb_last[i], rgb[i], p.shape[0])
+            p = palette[int(np.log(b_last + 1) * N / np.log(max_value)):
+                        int(np.log(b + 1) * N / np.log(max_value))]
+            # Interpolate red, green and blue in one go
+            ramp = np.linspace(0, 1, p.shape[0])[:, np.newaxis]
+            p[:] = (np.array(rgb_last, dtype=np.float64) +
+                    ramp * (np.array(rgb, dtype=np.float64) - rgb_last))
             b_last = b
             rgb_last = rgb
 
@@ -140,6 +303,14 @@ CPP_COLORS['cot'] = CPP_COLORS['cpp_cot']
 CPP_COLORS['reff'] = CPP_COLORS['cpp_reff']
 
 
+def convert_palette(legend):
+    """Convert the RGB *legend* to an mpop palette. mpop is only imported
+    here, on first use"""
+
+    from mpop.imageo import palettes
+    return palettes.convert_palette(legend)
+
+
 def get_reff_legend():
     return get_log_legend('reff')
 
@@ -162,10 +333,19 @@ def get_scenetype_legend():
                        [255, 200, 200]   # Redish for multi layer clouds
                        ])
     legend = np.vstack([np.zeros((111, 3)), legend])
-    palette = palettes.convert_palette(legend)
+    palette = convert_palette(legend)
     return palette
 
 
+def get_cost_legend():
+    """
+    Get a grey scale palette for the measurement cost
+    """
+
+    legend = np.repeat(np.arange(256)[:, np.newaxis], 3, axis=1)
+    return convert_palette(legend)
+
+
 def get_ctp_legend():
     """
     Get the Cloud Top Pressure color palette
@@ -195,5 +375,131 @@ def get_ctp_legend():
     legend.append((255, 255, 255))  # 19: 50-100 hPa
     legend.append((255, 255, 255))  # 20: 0-50 hPa  (=0-5000 Pa)
 
-    palette = palettes.convert_palette(legend)
+    palette = convert_palette(legend)
     return palette
+
+
+PALETTE_FUNCS = {'ll_ctp': get_ctp_legend,
+                 'ul_ctp': get_ctp_legend,
+                 'ul_cot': get_cot_legend,
+                 'll_cot': get_cot_legend,
+                 'reff': get_reff_legend,
+                 'scenetype': get_scenetype_legend,
+                 'cost': get_cost_legend}
+
+
+class PaletteLUT(object):
+
+    """Lookup table from the physical values of a field to the indices of its
+    palette. Values in [edges[k], edges[k + 1]) get indices[k] (in
+    (edges[k], edges[k + 1]] with *right_closed*). Values below edges[0] get
+    the index *below*, values beyond edges[-1] the index *above*"""
+
+    def __init__(self, edges, indices, below=0, above=0, right_closed=False):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.lut = np.concatenate([[below], indices,
+                                   [above]]).astype(np.uint8)
+        self.side = 'left' if right_closed else 'right'
+
+    @classmethod
+    def linear(cls, scale, offset, first, last, below=0, above=0):
+        """Table of the truncated linear mapping value * scale + offset to
+        the indices *first* to *last*"""
+
+        edges = (np.arange(first, last + 2) - offset) / float(scale)
+        indices = np.arange(first, last + 1)
+        if scale < 0:
+            return cls(edges[::-1], indices[::-1], below, above,
+                       right_closed=True)
+        return cls(edges, indices, below, above)
+
+    @classmethod
+    def log(cls, max_value, scale=1., log10=False, N=256):
+        """Table of a LogColors palette of *N* colours built for values up
+        to *max_value*, for physical values * *scale* (or 10**values with
+        *log10*). Small values get the zeros colour (index 1), values
+        beyond *max_value* the over colour (index N - 1)"""
+
+        bounds = np.exp(np.arange(2, N) * np.log(max_value) / N) - 1
+        bounds = np.append(bounds, max_value)
+        with np.errstate(divide='ignore'):
+            if log10:
+                bounds = np.log10(bounds)
+            else:
+                bounds = bounds / scale
+        edges = np.concatenate([[-np.inf], bounds])
+        return cls(edges, np.arange(1, N), above=N - 1)
+
+    @property
+    def value_range(self):
+        return self.edges[0], self.edges[-1]
+
+    def lookup(self, values, out, chunk=1 << 20):
+        """Put the palette indices of *values* in the uint8 array *out*, a
+        chunk of pixels at a time. Returns the boolean array of the pixels
+        outside the table"""
+
+        flat_values = values.ravel()
+        flat_out = out.reshape(-1)
+        outside = np.empty(flat_values.shape, dtype=bool)
+        last = self.edges.size
+        for start in range(0, flat_values.size, chunk):
+            pos = np.searchsorted(self.edges, flat_values[start:start + chunk],
+                                  side=self.side)
+            np.take(self.lut, pos, out=flat_out[start:start + chunk])
+            outside[start:start + chunk] = (pos == 0) | (pos == last)
+        return outside.reshape(values.shape)
+
+
+#: Measurement cost at the top of the grey scale palette
+COST_MAX = 300.
+
+#: Lookup of the palette index of the physical values of each field. The
+#: pressures and the scene type map linearly to their discrete palettes, as
+#: in the original make_image. The optical thickness (log10) and effective
+#: radius (m) map to the log palettes of CPP_COLORS, where make_image used the
+#: log10 COT and the radius in microns as indices, so that nearly all COT
+#: pixels got the indices 0-2 and the radius stayed below the 10 micron
+#: colour tone. The cost maps to the grey scale from 0 to COST_MAX, where
+#: make_image truncated it to an index that wrapped beyond 255. Values
+#: outside a table get the no data (or over) colour, see palette_index
+PALETTE_LUTS = {
+    'll_ctp': PaletteLUT.linear(-1. / 5000., 22., 1, 21),
+    'ul_ctp': PaletteLUT.linear(-1. / 5000., 22., 1, 21),
+    'reff': PaletteLUT.log(CPP_COLORS['reff'].breaks[-1][0], scale=1e6),
+    'ul_cot': PaletteLUT.log(CPP_COLORS['cot'].breaks[-1][0], log10=True),
+    'll_cot': PaletteLUT.log(CPP_COLORS['cot'].breaks[-1][0], log10=True),
+    'scenetype': PaletteLUT.linear(1., 0., 0, 113),
+    'cost': PaletteLUT.linear(253. / COST_MAX, 1., 1, 253, above=255)}
+
+_PALETTES = {}
+
+
+def get_palette(fieldname):
+    """Get the palette of *fieldname*, built once per process"""
+
+    if fieldname not in _PALETTES:
+        _PALETTES[fieldname] = PALETTE_FUNCS[fieldname]()
+    return _PALETTES[fieldname]
+
+
+def palette_index(fieldname, data, out=None):
+    """Convert the physical values *data* of *fieldname* to uint8 palette
+    indices with the lookup table of its palette, with 0 for masked pixels.
+    Values outside the table are logged and get its out of range index"""
+
+    lut = PALETTE_LUTS[fieldname]
+    values = np.ma.getdata(data)
+    if out is None:
+        out = np.empty(values.shape, dtype=np.uint8)
+
+    outside = lut.lookup(values, out)
+    mask = np.ma.getmask(data)
+    if mask is not np.ma.nomask:
+        out[mask] = 0
+        outside &= ~mask
+    noutside = np.count_nonzero(outside)
+    if noutside:
+        LOG.warning("%d %s values outside the palette range [%g, %g]",
+                    noutside, fieldname, *lut.value_range)
+    return out
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <adam.dybbroe@smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Benchmark the MPEF OCA reader and processing on synthetic LRIT segments,
+and compare with a JSON baseline. Exits with status 1 if a case is slower
+than the baseline by more than the threshold.
+
+Make a baseline:   mpef_oca_benchmark.py -a eurol --save baseline.json
+Check against it:  mpef_oca_benchmark.py -a eurol --baseline baseline.json
+
+"""
+
+import sys
+import argparse
+import logging
+
+from mpef_oca.benchmark import (DEFAULT_SIZE, DEFAULT_THRESHOLD, run,
+                                compare, report, load_baseline,
+                                save_baseline)
+
+LOG = logging.getLogger(__name__)
+
+#: Default time format
+_DEFAULT_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+#: Default log format
+_DEFAULT_LOG_FORMAT = '[%(levelname)s: %(asctime)s : %(name)s] %(message)s'
+
+
+def get_arguments():
+    """Get the command line arguments"""
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-a', '--area', dest='areas', action='append',
+                        required=True, help='Area id (repeat for more areas)')
+    parser.add_argument('-s', '--size', type=int, default=DEFAULT_SIZE,
+                        help='Lines and columns of the synthetic full disk '
+                        '(3712 for the real size, default %d)' % DEFAULT_SIZE)
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Runs of each case')
+    parser.add_argument('-b', '--baseline', default=None,
+                        help='Baseline JSON file to compare with')
+    parser.add_argument('--save', default=None,
+                        help='Write the results as a baseline JSON file')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Slowdown (fraction) counted as a regression')
+    parser.add_argument('-w', '--workdir', default=None,
+                        help='Directory of the temporary files')
+    return parser.parse_args()
+
+
+def main():
+    """Run the benchmarks. Returns the exit status"""
+
+    args = get_arguments()
+    current = run(args.areas, args.size, args.repeat, args.workdir)
+
+    baseline = None
+    if args.baseline:
+        baseline = load_baseline(args.baseline)
+    report(current, baseline)
+
+    if args.save:
+        save_baseline(args.save, current)
+        LOG.info("Baseline written to %s", args.save)
+
+    if baseline is None:
+        return 0
+
+    regressions = compare(baseline, current, args.threshold)
+    for case, before, after in regressions:
+        LOG.error("Regression in %s: %.3f s -> %.3f s", case, before, after)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+
+    handler = logging.StreamHandler(sys.stderr)
+
+    handler.setLevel(logging.DEBUG)
+    formatter = logging.Formatter(fmt=_DEFAULT_LOG_FORMAT,
+                                  datefmt=_DEFAULT_TIME_FORMAT)
+    handler.setFormatter(formatter)
+    logging.getLogger('').addHandler(handler)
+    logging.getLogger('').setLevel(logging.INFO)
+
+    LOG = logging.getLogger('oca_benchmark')
+    sys.exit(main())
@@ -27,7 +27,10 @@ output and imagery to users
 
 
 import os
-from ConfigParser import RawConfigParser
+try:
+    from ConfigParser import RawConfigParser
+except ImportError:
+    from configparser import RawConfigParser
 import logging
 LOG = logging.getLogger(__name__)
 
@@ -63,6 +66,15 @@ for option, value in CONF.items(MODE):
     OPTIONS[option] = value
 
 OUTPUT_PATH = OPTIONS['output_path']
+NPROCESSES = int(OPTIONS.get('processes', 6))
+MAX_WORKER_RSS_MB = int(OPTIONS.get('max_worker_rss_mb', 4000))
+MAX_SCENES = int(OPTIONS.get('max_scenes', 2))
+SCENE_TIMEOUT = float(OPTIONS.get('scene_timeout_minutes', 30)) * 60
+MAX_SCENE_AGE = float(OPTIONS.get('max_scene_age_minutes', 60)) * 60
+STALE_SCENES = OPTIONS.get('stale_scenes', 'drop')
+RERUN_BLOCK = float(OPTIONS.get('rerun_block_minutes', 5)) * 60
+METRICS_FILE = OPTIONS.get('metrics_file')
+RUNNER = OPTIONS.get('runner', 'threads')
 #: Default time format
 _DEFAULT_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
 
@@ -75,31 +87,34 @@ servername = socket.gethostname()
 SERVERNAME = OPTIONS.get('servername', servername)
 
 import sys
-from urlparse import urlparse
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
 import posttroll.subscriber
 from posttroll.publisher import Publish
 import netifaces
 from posttroll.message import Message
 from datetime import datetime
-
-from multiprocessing import Pool, Manager
+from functools import partial
+
+from multiprocessing import Manager
+from mpef_oca.pool import WarmPool
+from mpef_oca.pipeline import ScenePipeline
+from mpef_oca.scheduler import SceneScheduler
+from mpef_oca.render import DEFAULT_FIELDS
+from mpef_oca import metrics
 import threading
-from Queue import Empty
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
 
-SATELLITE = {'MSG3': 'Meteosat-10',
-             'MSG2': 'Meteosat-09',
-             'MSG1': 'Meteosat-08',
-             'MSG4': 'Meteosat-11',
-             }
+from mpef_oca.utils import SATELLITE, SAT_FILE_PREFIX
 
 SUPPORTED_SATELLITES = ['Meteosat-08', 'Meteosat-09',
                         'Meteosat-10', 'Meteosat-11']
 
-SAT_FILE_PREFIX = {'Meteosat-10': 'met10',
-                   'Meteosat-09': 'met09',
-                   'Meteosat-08': 'met08',
-                   'Meteosat-11': 'met11'}
-
 
 def get_local_ips():
     inet_addrs = [netifaces.ifaddresses(iface).get(netifaces.AF_INET)
@@ -112,29 +127,20 @@ def get_local_ips():
     return ips
 
 
-def reset_job_registry(objdict, key):
-    """Remove job key from registry"""
-    LOG.debug("Release/reset job-key " + str(key) + " from job registry")
-    if key in objdict:
-        objdict.pop(key)
-    else:
-        LOG.warning("Nothing to reset/release - " +
-                    "Register didn't contain any entry matching: " +
-                    str(key))
-    return
-
-
 class FilePublisher(threading.Thread):
 
-    """A publisher for the oca level2 netCDF files. Picks up the return value from
-    the oca_extractor when ready, and publishes the files via posttroll
+    """A publisher for the oca level2 netCDF files and images. Picks up the
+    messages put on the queue as each product is ready, and publishes them
+    via posttroll, or via *publisher* (e.g. a mpef_oca.bus.LocalBus
+    publisher) if given
 
     """
 
-    def __init__(self, queue):
+    def __init__(self, queue, publisher=None):
         threading.Thread.__init__(self)
         self.loop = True
         self.queue = queue
+        self.publisher = publisher
         self.jobs = {}
 
     def stop(self):
@@ -144,25 +150,30 @@ class FilePublisher(threading.Thread):
 
     def run(self):
 
-        with Publish('mpef_oca_extractor', 0, ['netCDF/3', ]) as publisher:
+        if self.publisher is None:
+            self.publisher = Publish('mpef_oca_extractor', 0, ['netCDF/3', ])
+
+        with self.publisher as publisher:
 
             while self.loop:
                 retv = self.queue.get()
 
                 if retv != None:
-                    LOG.info("Publish the OCA level-2 netcdf file")
+                    LOG.info("Publish the OCA level-2 product")
                     publisher.send(retv)
 
 
 class FileListener(threading.Thread):
 
     """A file listener class, to listen for incoming messages with a 
-    relevant file for further processing"""
+    relevant file for further processing. Listens via posttroll, or via
+    *subscriber* (e.g. a mpef_oca.bus.LocalBus subscriber) if given"""
 
-    def __init__(self, queue):
+    def __init__(self, queue, subscriber=None):
         threading.Thread.__init__(self)
         self.loop = True
         self.queue = queue
+        self.subscriber = subscriber
 
     def stop(self):
         """Stops the file listener"""
@@ -171,8 +182,11 @@ class FileListener(threading.Thread):
 
     def run(self):
 
-        with posttroll.subscriber.Subscribe('', [OPTIONS['posttroll_topic'], ],
-                                            True) as subscr:
+        if self.subscriber is None:
+            self.subscriber = posttroll.subscriber.Subscribe(
+                '', [OPTIONS['posttroll_topic'], ], True)
+
+        with self.subscriber as subscr:
 
             for msg in subscr.recv(timeout=90):
                 if not self.loop:
@@ -184,40 +198,45 @@ class FileListener(threading.Thread):
                     self.queue.put(msg)
 
     def check_message(self, msg):
+        return check_message(msg)
 
-        if not msg:
-            return False
 
-        # urlobj = urlparse(msg.data['uri'])
-        # server = urlobj.netloc
-        # url_ip = socket.gethostbyname(urlobj.netloc)
-        # if urlobj.netloc and (url_ip not in get_local_ips()):
-        #     LOG.warning("Server %s not the current one: %s",
-        #                 str(server),
-        #                 socket.gethostname())
-        #     return False
+def check_message(msg):
+    """Check if it is a relevant message"""
 
-        if msg.type != 'dataset':
-            LOG.debug('Message is not of type dataset')
-            return False
+    if not msg:
+        return False
 
-        if ('platform_name' not in msg.data or
-                'start_time' not in msg.data):
-            LOG.warning(
-                "Message is lacking crucial fields...")
-            return False
+    # urlobj = urlparse(msg.data['uri'])
+    # server = urlobj.netloc
+    # url_ip = socket.gethostbyname(urlobj.netloc)
+    # if urlobj.netloc and (url_ip not in get_local_ips()):
+    #     LOG.warning("Server %s not the current one: %s",
+    #                 str(server),
+    #                 socket.gethostname())
+    #     return False
+
+    if msg.type != 'dataset':
+        LOG.debug('Message is not of type dataset')
+        return False
 
-        LOG.debug("Ok: message = %s", str(msg))
-        return True
+    if ('platform_name' not in msg.data or
+            'start_time' not in msg.data):
+        LOG.warning(
+            "Message is lacking crucial fields...")
+        return False
 
+    LOG.debug("Ok: message = %s", str(msg))
+    return True
 
-def create_message(resultfile, mda):
+
+def create_message(resultfile, mda, filetype='netCDF'):
     """Create the posttroll message"""
 
     to_send = mda.copy()
     to_send['uri'] = ('ssh://%s/%s' % (SERVERNAME, resultfile))
     to_send['uid'] = resultfile
-    to_send['type'] = 'netCDF'
+    to_send['type'] = filetype
     to_send['format'] = 'OCA'
     to_send['data_processing_level'] = '3'
     environment = MODE
@@ -230,15 +249,91 @@ def create_message(resultfile, mda):
     return pub_message
 
 
+def product_message(key, scene, product):
+    """Create the message announcing the *product* of the scene *key*, with
+    the timing of its processing"""
+
+    mda = dict(scene.get('mda', {}))
+    mda['area_id'] = product['area_id']
+    if product.get('field'):
+        mda['product'] = product['field']
+    mda['creation_time'] = datetime.utcfromtimestamp(product['written_at'])
+    mda['processing_time'] = product['task_time']
+    mda['scene_latency'] = product['scene_latency']
+    LOG.debug("Product ready: %s", product['filename'])
+    return create_message(product['filename'], mda, product['format'])
+
+
+def publish_product(publish_q, key, scene, product):
+    """Put the message announcing the *product* of the scene *key* on the
+    publish queue"""
+
+    publish_q.put(product_message(key, scene, product))
+
+
+def scene_from_message(msg):
+    """Get the scene key, the scene and the file uris of a dataset message,
+    or None if it is not one to process"""
+
+    if not check_message(msg):
+        return None
+
+    platform_name = SATELLITE.get(msg.data['platform_name'],
+                                  msg.data['platform_name'])
+    if platform_name not in SUPPORTED_SATELLITES:
+        LOG.debug("Ignoring data from %s", platform_name)
+        return None
+
+    start_time = msg.data['start_time']
+    keyname = (str(platform_name) + '_' +
+               str(start_time.strftime('%Y%m%d%H%M')))
+    scene = {'platform_name': platform_name,
+             'starttime': start_time,
+             'sensor': str(msg.data['sensor']),
+             'mda': msg.data}
+    uris = [obj['uri'] for obj in msg.data['dataset']]
+    return keyname, scene, uris
+
+
+def render_product(lcd, field, prefix):
+    """Render the *field* of the projected scene *lcd* with coast lines, to
+    <prefix>_<field>.tif. The file is written under a temporary name and
+    renamed in place"""
+
+    with metrics.measure('render', area=lcd.area_def.area_id,
+                         field=field) as stage:
+        img = lcd.make_image(field)
+        img.add_overlay()
+        product_path = prefix + '_' + field + '.tif'
+        tmp_path = os.path.join(os.path.dirname(product_path),
+                                '.' + os.path.basename(product_path))
+        img.save(tmp_path)
+        os.rename(tmp_path, product_path)
+        stage.written(metrics.file_size(product_path))
+    return product_path
+
+
+def write_metrics(*args):
+    """Write the stage metrics summed so far to the Prometheus text file, if
+    one is configured. Called as each scene is done"""
+
+    if not METRICS_FILE:
+        return
+    try:
+        metrics.REGISTRY.write_textfile(METRICS_FILE)
+    except (IOError, OSError):
+        LOG.exception("Failed writing the metrics to %s", METRICS_FILE)
+
+
 def oca_extractor(mda, scene, job_id, publish_q, area_ids):
-    """Read the LRIT encoded Grib files and convert to netCDF
+    """Read the LRIT encoded Grib files and convert to netCDF, all in one
+    task. The runner uses the stage parallel ScenePipeline instead
 
     """
 
-    from mpop.satellites import GeostationaryFactory
-    #from mpop.utils import debug_on
-    # debug_on()
+    from mpef_oca.oca_reader import OCAData
 
+    metrics.set_scene(job_id)
     try:
         LOG.debug("Load and project OCA data: Start...")
 
@@ -246,13 +341,14 @@ def oca_extractor(mda, scene, job_id, publish_q, area_ids):
         for lritfile in lrit_files:
             LOG.info("LRIT file = %s", lritfile)
 
-        glbd = GeostationaryFactory.create_scene(scene['platform_name'],
-                                                 "", scene['sensor'],
-                                                 scene['starttime'],
-                                                 area='met09globeFull')
-        glbd.load(['OCA'], filenames=lrit_files)
+        glbd = OCAData()
+        glbd.read_from_lrit(lrit_files, area_ids=area_ids)
 
-        for area_id in area_ids:
+        LOG.info("Project...")
+        lcds = glbd.project_many(area_ids)
+        LOG.info("Projection done...")
+
+        for area_id, lcd in zip(area_ids, lcds):
 
             fname_prfx = '%s_%s_%s_oca' % (SAT_FILE_PREFIX.get(scene['platform_name'],
                                                                scene['platform_name'].lower()),
@@ -260,26 +356,37 @@ def oca_extractor(mda, scene, job_id, publish_q, area_ids):
                                                '%Y%m%d%H%M'),
                                            area_id)
 
-            LOG.info("Project...")
-            lcd = glbd.project(area_id)
-            LOG.info("Projection done...")
+            ncfile = os.path.join(OUTPUT_PATH, fname_prfx + '.nc')
+            lcd.to_netcdf(ncfile)
+            publish_q.put(create_message(ncfile, mda))
 
-            lcd.save(os.path.join(OUTPUT_PATH, fname_prfx + '.nc'))
+            for field in DEFAULT_FIELDS:
+                product_path = render_product(
+                    lcd, field, os.path.join(OUTPUT_PATH, fname_prfx))
+                publish_q.put(create_message(product_path, mda, 'GeoTIFF'))
 
-            for field in ['scenetype', 'reff',
-                          'ul_ctp', 'ul_cot', 'll_ctp', 'll_cot', 'cost']:
-                img = lcd.image.oca(field)
-                img.add_overlay()
-                product_path = os.path.join(
-                    OUTPUT_PATH, fname_prfx + '_' + field)
-                img.save(product_path + '.tif')
+        glbd.close()
+        write_metrics()
 
     except:
         LOG.exception('Failed in oca_extractor...')
         return
 
 
-def ready2run(msg, files4oca, job_register, sceneid):
+def init_worker(area_ids):
+    """Prepare a worker process: import the reader and load the area
+    definitions, geolocation and neighbour lookups once, for all the scenes
+    the worker will process"""
+
+    from mpef_oca.oca_reader import warm_up
+
+    try:
+        warm_up(area_ids)
+    except Exception:
+        LOG.exception('Failed warming up worker...')
+
+
+def ready2run(msg, files4oca, sceneid):
     """Check whether we have all input and are ready to run """
 
     from trollduction.producer import check_uri
@@ -316,10 +423,15 @@ def ready2run(msg, files4oca, job_register, sceneid):
 
     LOG.debug("files4oca: %s", str(files4oca[sceneid]))
 
-    job_register[sceneid] = datetime.utcnow()
     return True
 
 
+def scene_failed(keyname, reason):
+    """Report a scene that was dropped or failed"""
+
+    LOG.error("No complete OCA products for scene %s: %s", keyname, reason)
+
+
 def oca_runner(area_ids):
     """Listens and triggers processing. OCA products are stored on a list of areas
     specified by *area_ids*
@@ -329,18 +441,30 @@ def oca_runner(area_ids):
     LOG.info(
         "*** Start the extraction and conversion of MPEF OCA level2 profiles")
 
-    pool = Pool(processes=6, maxtasksperchild=1)
+    pool = WarmPool(processes=NPROCESSES, initializer=init_worker,
+                    initargs=(area_ids, ),
+                    max_rss=MAX_WORKER_RSS_MB * 1024 * 1024)
     manager = Manager()
     listener_q = manager.Queue()
     publisher_q = manager.Queue()
 
+    pipeline = ScenePipeline(pool, area_ids, OUTPUT_PATH,
+                             render_func=render_product,
+                             max_scenes=MAX_SCENES, max_tasks=NPROCESSES,
+                             on_product=partial(publish_product, publisher_q),
+                             on_scene=write_metrics,
+                             scene_timeout=SCENE_TIMEOUT)
+    scheduler = SceneScheduler(pipeline, max_inflight=MAX_SCENES,
+                               max_age=MAX_SCENE_AGE, stale=STALE_SCENES,
+                               block_for=RERUN_BLOCK)
+
     pub_thread = FilePublisher(publisher_q)
     pub_thread.start()
     listen_thread = FileListener(listener_q)
     listen_thread.start()
 
     files4oca = {}
-    jobs_dict = {}
+    results = {}
     while True:
 
         try:
@@ -365,45 +489,37 @@ def oca_runner(area_ids):
         keyname = (str(platform_name) + '_' +
                    str(start_time.strftime('%Y%m%d%H%M')))
 
-        status = ready2run(msg, files4oca,
-                           jobs_dict, keyname)
+        status = ready2run(msg, files4oca, keyname)
 
         if status:
-            jobs_dict[keyname] = datetime.utcnow()
-
             for fname in files4oca[keyname]:
                 LOG.debug("Filename: %s", fname)
 
             scene = {'platform_name': platform_name,
                      'starttime': start_time,
                      'sensor': sensor,
-                     'filenames': files4oca[keyname]}
-
-            if keyname not in jobs_dict:
-                LOG.warning("Scene-run seems unregistered! Forget it...")
-                continue
-
-            pool.apply_async(oca_extractor,
-                             (msg.data, scene,
-                              jobs_dict[
-                                  keyname],
-                              publisher_q, area_ids))
-
-            # Clean the files4oca dict:
-            LOG.debug("files4oca: " + str(files4oca))
-            try:
-                files4oca.pop(keyname)
-            except KeyError:
-                LOG.warning("Failed trying to remove key " + str(keyname) +
-                            " from dictionary files4oca")
-            LOG.debug("After cleaning: files4oca = " + str(files4oca))
-
-            # Block any future run on this scene for x minutes from now
-            # x = 5
-            thread_job_registry = threading.Timer(
-                5 * 60.0, reset_job_registry, args=(jobs_dict, keyname))
-            thread_job_registry.start()
-
+                     'filenames': files4oca[keyname],
+                     'mda': msg.data}
+
+            # The scheduler runs the newest scene first, drops the stale
+            # ones, and skips the scenes already run in the last minutes
+            result = scheduler.add(keyname, scene,
+                                   error_callback=partial(scene_failed,
+                                                          keyname))
+            if result is not None:
+                results[keyname] = result
+            files4oca.pop(keyname, None)
+
+            for key in [key for key in results if results[key].ready()]:
+                if results[key].successful():
+                    LOG.info("Scene %s done: %s", key,
+                             str(results[key].get()))
+                results.pop(key)
+            LOG.debug("Scenes waiting: %d, in flight: %d",
+                      len(scheduler), scheduler.inflight)
+
+    pipeline.join()
+    pipeline.close()
     pool.close()
     pool.join()
 
@@ -411,6 +527,54 @@ def oca_runner(area_ids):
     listen_thread.stop()
 
 
+def oca_async_runner(area_ids, sources=None, sink=None):
+    """Listens and triggers processing on an asyncio event loop (Python 3.7+).
+    The messages come from the mpef_oca.aio transports *sources* and the
+    products are announced on *sink*, both posttroll by default. The files
+    are checked in threads and the scenes processed on a process pool, with
+    no Manager queues in between. OCA products are stored on a list of
+    areas specified by *area_ids*
+
+    """
+
+    import asyncio
+    from concurrent.futures import ProcessPoolExecutor
+    from trollduction.producer import check_uri
+    from mpef_oca.aio import AsyncRunner, BusTransport, ExecutorPool
+
+    LOG.info(
+        "*** Start the asyncio runner of the MPEF OCA level2 extraction")
+
+    if sources is None:
+        sources = [BusTransport(subscriber=posttroll.subscriber.Subscribe(
+            '', [OPTIONS['posttroll_topic'], ], True))]
+    if sink is None:
+        sink = BusTransport(publisher=Publish('mpef_oca_extractor', 0,
+                                              ['netCDF/3', ]))
+
+    pool = ExecutorPool(ProcessPoolExecutor(NPROCESSES,
+                                            initializer=init_worker,
+                                            initargs=(area_ids, )))
+    pipeline = ScenePipeline(pool, area_ids, OUTPUT_PATH,
+                             render_func=render_product,
+                             max_scenes=MAX_SCENES, max_tasks=NPROCESSES,
+                             on_scene=write_metrics,
+                             scene_timeout=SCENE_TIMEOUT)
+    scheduler = SceneScheduler(pipeline, max_inflight=MAX_SCENES,
+                               max_age=MAX_SCENE_AGE, stale=STALE_SCENES,
+                               block_for=RERUN_BLOCK)
+    runner = AsyncRunner(sources, sink, scheduler, scene_from_message,
+                         product_message, check_uri=check_uri)
+
+    try:
+        asyncio.run(runner.run())
+    finally:
+        pipeline.close()
+        pool.close()
+        pool.join()
+        sink.close()
+
+
 if __name__ == "__main__":
 
     handler = logging.StreamHandler(sys.stderr)
@@ -424,4 +588,7 @@ if __name__ == "__main__":
     logging.getLogger('posttroll').setLevel(logging.INFO)
 
     LOG = logging.getLogger('oca_reader')
-    oca_runner(['eurol'])
+    if RUNNER == 'asyncio':
+        oca_async_runner(['eurol'])
+    else:
+        oca_runner(['eurol'])
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 Adam.Dybbroe
+
+# Author(s):
+
+#   Adam.Dybbroe <adam.dybbroe@smhi.se>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Bulk reprocessing of archived MPEF OCA LRIT segments to netCDF and
+imagery. Several instances, on one or more nodes sharing the file system,
+can work on the same archive with the same state directory: slots are
+claimed with claim files and checkpointed when done, so that a killed run
+resumes where it stopped.
+
+"""
+
+import os
+import sys
+import time
+import argparse
+import logging
+from multiprocessing import Pool
+
+from mpef_oca.archive import find_slots, SlotClaims, process_slot
+
+LOG = logging.getLogger(__name__)
+
+#: Default time format
+_DEFAULT_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+#: Default log format
+_DEFAULT_LOG_FORMAT = '[%(levelname)s: %(asctime)s : %(name)s] %(message)s'
+
+
+def run_slot(args):
+    """Claim, process and checkpoint one slot. Returns (key, status)"""
+
+    key, filenames, options = args
+    claims = SlotClaims(options['state_dir'], options['stale_after'])
+    if not claims.claim(key):
+        return key, 'skipped'
+
+    try:
+        process_slot(filenames, options['areas'], options['output_dir'],
+                     formats=options['formats'],
+                     nthreads=options['nthreads'])
+    except Exception:
+        LOG.exception('Failed processing slot %s', key)
+        claims.release(key)
+        return key, 'failed'
+
+    claims.done(key)
+    return key, 'done'
+
+
+def reprocess(options):
+    """Process all the slots of the archive not already done"""
+
+    slots = find_slots(options['archive_dir'])
+    claims = SlotClaims(options['state_dir'], options['stale_after'])
+    todo = [(key, slots[key][2], options) for key in sorted(slots)
+            if not claims.is_done(key)]
+    LOG.info("%d slots found, %d left to process", len(slots), len(todo))
+
+    pool = Pool(processes=options['processes'])
+    tic = time.time()
+    ndone = 0
+    try:
+        for key, status in pool.imap_unordered(run_slot, todo):
+            if status == 'done':
+                ndone = ndone + 1
+                minutes = max((time.time() - tic) / 60., 1e-6)
+                LOG.info("Slot %s done: %d slots, %.2f slots/min",
+                         key, ndone, ndone / minutes)
+            elif status == 'failed':
+                LOG.warning("Slot %s failed", key)
+    finally:
+        pool.close()
+        pool.join()
+
+    minutes = max((time.time() - tic) / 60., 1e-6)
+    LOG.info("Finished: %d slots in %.1f min, %.2f slots/min",
+             ndone, minutes, ndone / minutes)
+
+
+def get_arguments():
+    """Get the command line arguments"""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('archive_dir',
+                        help='Root of the archive tree of LRIT segments')
+    parser.add_argument('-o', '--output-dir', required=True,
+                        help='Directory of the netCDF files and images')
+    parser.add_argument('-a', '--area', dest='areas', action='append',
+                        required=True, help='Area id (repeat for more areas)')
+    parser.add_argument('-s', '--state-dir', default=None,
+                        help='Directory of the claim and checkpoint files, '
+                        'shared by all the nodes (default: '
+                        '<output-dir>/.reprocess)')
+    parser.add_argument('-j', '--processes', type=int, default=4,
+                        help='Number of processes on this node')
+    parser.add_argument('-t', '--threads', dest='nthreads', type=int,
+                        default=2, help='Threads per process')
+    parser.add_argument('-f', '--format', dest='formats', action='append',
+                        default=None, choices=['tif', 'png'],
+                        help='Image format (repeat for more, default tif)')
+    parser.add_argument('--no-images', action='store_true',
+                        help='Only write the netCDF files')
+    parser.add_argument('--stale-after', type=float, default=3600.,
+                        help='Age in seconds after which a claim is '
+                        'considered left by a killed run')
+    args = parser.parse_args()
+
+    options = vars(args)
+    if not options['state_dir']:
+        options['state_dir'] = os.path.join(options['output_dir'],
+                                            '.reprocess')
+    if options['no_images']:
+        options['formats'] = ()
+    elif not options['formats']:
+        options['formats'] = ('tif', )
+    return options
+
+
+if __name__ == "__main__":
+
+    handler = logging.StreamHandler(sys.stderr)
+
+    handler.setLevel(logging.DEBUG)
+    formatter = logging.Formatter(fmt=_DEFAULT_LOG_FORMAT,
+                                  datefmt=_DEFAULT_TIME_FORMAT)
+    handler.setFormatter(formatter)
+    logging.getLogger('').addHandler(handler)
+    logging.getLogger('').setLevel(logging.INFO)
+
+    LOG = logging.getLogger('oca_reprocess')
+    reprocess(get_arguments())
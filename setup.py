@@ -64,10 +64,13 @@ setup(name='oca_reader',
                         'numpy>=1.5.1',
                         'pygrib',
                         'netCDF4',
-                        'pyresample'],
+                        'pyresample',
+                        'GDAL'],
 
       # test_requires=["mock"],
-      scripts=['scr/mpef_oca_extractor.py', ],
+      scripts=['scr/mpef_oca_extractor.py',
+               'scr/mpef_oca_reprocess.py',
+               'scr/mpef_oca_benchmark.py', ],
       # data_files=[('etc', ['etc/mpef_oca_config.cfg.template']),
       #            ],
       # test_suite='tests.suite',